@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qs
+
+
+# Parsed HTTP request passed to serve() handler, header names are lower case
+Request = namedtuple("Request", "method path query headers body")
+# HTTP response returned by serve() handler and ConnectionPool.request
+Response = namedtuple("Response", "status headers body")
+
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+# Max bytes of chunk size line with extensions
+MAX_CHUNK_LINE = 1024
+
+
+class HTTPError(Exception):
+    """Exception for malformed HTTP message"""
+    pass
+
+
+async def read_headers(reader) -> dict:
+    """Read HTTP headers till empty line, return them with lower case names"""
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise HTTPError("Connection closed while reading headers")
+        if line in (b"\r\n", b"\n"):
+            return headers
+        name, separator, value = line.decode("latin-1").partition(":")
+        if not separator:
+            raise HTTPError(f"Malformed header line: {line!r}")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def read_body(reader, headers: dict, max_size: int = None) -> bytes:
+    """
+    Read HTTP message body by content-length or chunked encoding, sizes
+    are checked against max_size before the body is read
+    """
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        total = 0
+        while True:
+            line = await reader.readline()
+            if len(line) > MAX_CHUNK_LINE:
+                raise HTTPError("Chunk size line is too long")
+            size = int(line.split(b";")[0], 16)
+            if size < 0:
+                raise HTTPError(f"Malformed chunk size: {line!r}")
+            if size == 0:
+                await read_headers(reader)
+                return b"".join(chunks)
+            total += size
+            if max_size is not None and total > max_size:
+                raise HTTPError("Body is too large")
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    length = int(headers.get("content-length", 0))
+    if max_size is not None and length > max_size:
+        raise HTTPError("Body is too large")
+    return await reader.readexactly(length)
+
+
+def encode_message(start_line: str, headers: dict, body: bytes) -> bytes:
+    """Return HTTP message bytes with content-length header"""
+    lines = [start_line]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def json_response(status: int, data, headers: dict = None) -> Response:
+    """Return Response with JSON encoded data"""
+    response_headers = {"Content-Type": "application/json"}
+    response_headers.update(headers or {})
+    return Response(status, response_headers,
+                    json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+class ConnectionPool:
+    """
+    Pool of persistent keep-alive HTTP/1.1 connections to one host.
+    At most size requests run at the same time
+    """
+
+    def __init__(self, base_url: str, size: int = 10,
+                 headers: dict = None) -> None:
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.use_ssl = parts.scheme == "https"
+        self.port = parts.port or (443 if self.use_ssl else 80)
+        self.size = size
+        self.headers = {"Host": parts.netloc}
+        self.headers.update(headers or {})
+        self.idle = []
+        self.slots = None
+
+    async def connect(self) -> tuple:
+        """Open new connection"""
+        return await asyncio.open_connection(self.host, self.port,
+                                             ssl=self.use_ssl or None)
+
+    @staticmethod
+    def close_connection(connection: tuple) -> None:
+        connection[1].close()
+
+    async def roundtrip(self, connection: tuple, method: str, path: str,
+                        body: bytes, headers: dict) -> tuple:
+        """Send request and return (response, keep_alive)"""
+        reader, writer = connection
+        request_headers = dict(self.headers)
+        request_headers.update(headers)
+        writer.write(encode_message(f"{method} {path} HTTP/1.1",
+                                    request_headers, body))
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        version, status = status_line.decode("latin-1").split(None, 2)[:2]
+        response_headers = await read_headers(reader)
+        keep_alive = version == "HTTP/1.1" and \
+            response_headers.get("connection", "").lower() != "close"
+        if "content-length" in response_headers or \
+                "transfer-encoding" in response_headers:
+            response_body = await read_body(reader, response_headers)
+        else:
+            response_body = await reader.read()
+            keep_alive = False
+        return Response(int(status), response_headers,
+                        response_body), keep_alive
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: dict = None, timeout: float = None
+                      ) -> Response:
+        """Make HTTP request using idle connection or new one"""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        async with self.slots:
+            # Idle connection could be already closed by server, so retry
+            # once on new connection
+            while True:
+                reused = bool(self.idle)
+                connection = self.idle.pop() if reused \
+                    else await self.connect()
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        self.roundtrip(connection, method, path, body,
+                                       headers or {}), timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) \
+                        as connection_error:
+                    self.close_connection(connection)
+                    if reused:
+                        logging.debug(f"Reconnect after {connection_error}")
+                        continue
+                    raise
+                except BaseException:
+                    self.close_connection(connection)
+                    raise
+                break
+            if keep_alive:
+                self.idle.append(connection)
+            else:
+                self.close_connection(connection)
+            return response
+
+    async def post_json(self, path: str, payload, headers: dict = None,
+                        timeout: float = None):
+        """POST payload as JSON and return decoded JSON response"""
+        request_headers = {"Content-Type": "application/json",
+                           "Accept": "application/json"}
+        request_headers.update(headers or {})
+        response = await self.request(
+            "POST", path, json.dumps(payload).encode("utf-8"),
+            request_headers, timeout)
+        return json.loads(response.body)
+
+    async def close(self) -> None:
+        """Close idle connections"""
+        while self.idle:
+            self.close_connection(self.idle.pop())
+
+
+async def serve(handler, host: str, port: int,
+                max_body_size: int = 1 << 20, ssl=None):
+    """
+    Start HTTP/1.1 server with keep-alive and pipelining, pipelined requests
+    are answered in order. handler is coroutine function taking Request and
+    returning Response, ssl is SSLContext of HTTPS server
+    """
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = \
+                        request_line.decode("latin-1").split()
+                    headers = await read_headers(reader)
+                    body = await read_body(reader, headers, max_body_size)
+                except (HTTPError, ValueError) as request_error:
+                    logging.debug(f"Bad request: {request_error}")
+                    status = 413 if "too large" in str(request_error) \
+                        else 400
+                    writer.write(encode_message(
+                        f"HTTP/1.1 {status} {REASONS[status]}",
+                        {"Connection": "close"}, b""))
+                    break
+                parts = urlsplit(target)
+                request = Request(method, parts.path, parse_qs(parts.query),
+                                  headers, body)
+                try:
+                    response = await handler(request)
+                except Exception:
+                    logging.exception(f"Failed handle {method} {target}")
+                    response = Response(500, {}, b"")
+                keep_alive = version == "HTTP/1.1" and \
+                    headers.get("connection", "").lower() != "close"
+                response_headers = dict(response.headers)
+                if not keep_alive:
+                    response_headers["Connection"] = "close"
+                status = response.status
+                writer.write(encode_message(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}",
+                    response_headers, response.body))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # Connection tasks are created here, asyncio 3.11 logs cancellation of
+    # tasks it creates for coroutine callbacks as unhandled exception
+    connections = set()
+
+    def start_connection(reader, writer):
+        task = asyncio.ensure_future(handle_connection(reader, writer))
+        connections.add(task)
+        task.add_done_callback(connections.discard)
+
+    return await asyncio.start_server(start_connection, host, port,
+                                      ssl=ssl)
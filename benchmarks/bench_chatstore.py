@@ -0,0 +1,42 @@
+import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from timing import timed
+from fake_telegram import message_update
+from fake_telegram import stubbed_bot
+
+
+def make_updates(chat_ids, text, first_update_id=1):
+    return [message_update(first_update_id + index, chat_id, text)
+            for index, chat_id in enumerate(chat_ids)]
+
+
+def bench_chatstore(chats: int = 100000, active: int = 100) -> dict:
+    """Timings of bot cycle stages with chats open conversations"""
+    bot = stubbed_bot("benchmark")
+    results = {"chats": chats, "active": active}
+    bot.updates = make_updates(range(chats), "/start")
+    # Updates are replied when applied, process_chat only handles chats
+    # restored from storage. Result names are kept for --compare with
+    # results of earlier commits
+    results["add_updates_to_queue"] = timed(bot.add_updates_to_queue)
+    results["process_chat_all_ready"] = timed(bot.process_chat)
+    results["cleanup_old_chats_all_ready"] = timed(bot.cleanup_old_chats)
+    # Only few chats got new message, cycle cost should not depend on
+    # number of open conversations
+    bot.updates = make_updates(range(min(active, chats)), "2015", chats)
+    results["add_updates_to_queue_active"] = timed(bot.add_updates_to_queue)
+    results["process_chat_active"] = timed(bot.process_chat)
+    results["cleanup_old_chats_active"] = timed(bot.cleanup_old_chats)
+    results["idle_cycle"] = timed(lambda: (bot.process_chat(),
+                                           bot.cleanup_old_chats()))
+    bot.sessions.ttl = 0
+    results["evict_all_expired"] = timed(bot.cleanup_old_chats)
+    results["chats_left"] = len(bot.sessions)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(bench_chatstore(), indent=2))
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from timing import per_call
+from taxcalc import CarEcoTax
+
+
+def eager_debug(production_year: int, horse_powers: int) -> None:
+    """Debug calls as they were made in CarEcoTax before named logger"""
+    logging.debug(f"created new instance with {production_year} "
+                  f"production year and {horse_powers} horse powers")
+    logging.debug(f"set tax age to {8}")
+    logging.debug(f"{horse_powers * 1.5} converted to integer "
+                  f"{int(horse_powers * 1.5)}")
+
+
+def lazy_debug(logger: logging.Logger, production_year: int,
+               horse_powers: int) -> None:
+    """Same debug calls with isEnabledFor guard and %-style arguments"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("created new instance with %s production year and "
+                     "%s horse powers", production_year, horse_powers)
+        logger.debug("set tax age to %s", 8)
+        logger.debug("%s converted to integer %s", horse_powers * 1.5,
+                     int(horse_powers * 1.5))
+
+
+def bench_logging(number: int = 100000) -> dict:
+    """Per call overhead of discarded debug messages, DEBUG is off"""
+    root = logging.getLogger()
+    level = root.level
+    logger = logging.getLogger("taxcalc")
+    try:
+        root.setLevel(logging.WARNING)
+        eager = per_call(lambda: eager_debug(2015, 150), number)
+        lazy = per_call(lambda: lazy_debug(logger, 2015, 150), number)
+        calculate = per_call(lambda: CarEcoTax(2015, 150).calculate(),
+                             number // 5)
+    finally:
+        root.setLevel(level)
+    return {
+        "eager_debug_seconds": eager,
+        "lazy_debug_seconds": lazy,
+        "saved_per_call_seconds": eager - lazy,
+        "calculate_seconds": calculate
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(bench_logging(), indent=2))
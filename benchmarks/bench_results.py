@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+import tracemalloc
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from taxcalc import CarEcoTax
+from taxcalc import TaxResultBatch
+from taxcalc import calculate_tax
+
+
+class DictCarEcoTax:
+    """Layout of CarEcoTax instance before __slots__"""
+
+    def __init__(self, production_year, horse_powers, car_tax_age, tax):
+        self.production_year = production_year
+        self.horse_powers = horse_powers
+        self.car_tax_age = car_tax_age
+        self.tax = tax
+
+
+def cars(count: int):
+    for row in range(count):
+        yield 1995 + row % 31, 40 + row * 7 % 400
+
+
+def allocated_per_result(build, count: int) -> float:
+    """Return bytes allocated by build(count) divided by count"""
+    tracemalloc.start()
+    try:
+        started = tracemalloc.get_traced_memory()[0]
+        results = build(count)
+        allocated = tracemalloc.get_traced_memory()[0] - started
+    finally:
+        tracemalloc.stop()
+    del results
+    return allocated / count
+
+
+def bench_results(count: int = 100000) -> dict:
+    """Memory per kept calculation result by representation"""
+    def dict_instances(count):
+        results = []
+        for year, hp in cars(count):
+            tax = CarEcoTax(year, hp)
+            tax.calculate()
+            results.append(DictCarEcoTax(tax.production_year,
+                                         tax.horse_powers,
+                                         tax.car_tax_age, tax.tax))
+        return results
+
+    def slots_instances(count):
+        results = []
+        for year, hp in cars(count):
+            tax = CarEcoTax(year, hp)
+            tax.calculate()
+            results.append(tax)
+        return results
+
+    def tax_results(count):
+        return [calculate_tax(year, hp) for year, hp in cars(count)]
+
+    def batch(count):
+        results = TaxResultBatch()
+        for year, hp in cars(count):
+            results.append(calculate_tax(year, hp))
+        return results
+
+    results = {
+        "dict_instance_bytes": allocated_per_result(dict_instances, count),
+        "slots_instance_bytes": allocated_per_result(slots_instances, count),
+        "tax_result_bytes": allocated_per_result(tax_results, count),
+        "batch_bytes": allocated_per_result(batch, count)
+    }
+    results["dict_instance_to_batch_ratio"] = \
+        results["dict_instance_bytes"] / results["batch_bytes"]
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(bench_results(), indent=2))
@@ -0,0 +1,38 @@
+import json
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatstore import ChatSessionStore
+from chatstore import SQLiteStorage
+
+
+def bench_storage(cycles: int = 200, updates_per_cycle: int = 50) -> dict:
+    """Write cost per update of SQLite storage with commit per cycle"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = ChatSessionStore(
+            storage=SQLiteStorage(os.path.join(directory, "bot.db")))
+        update_id = 0
+        started = time.perf_counter()
+        for cycle in range(cycles):
+            for _ in range(updates_per_cycle):
+                update_id += 1
+                chat_id = update_id % 5000
+                store.add_message(chat_id, update_id, "2015")
+                store.mark_processed(chat_id)
+            store.commit(update_id + 1)
+        elapsed = time.perf_counter() - started
+        store.close()
+    updates = cycles * updates_per_cycle
+    return {
+        "cycles": cycles,
+        "updates": updates,
+        "seconds": elapsed,
+        "ms_per_update": elapsed / updates * 1000,
+        "ms_per_commit": elapsed / cycles * 1000
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(bench_storage(), indent=2))
@@ -0,0 +1,54 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from tax_api_load import run_load
+
+
+def free_port() -> int:
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def bench_tax_api(requests: int = 20000, connections: int = 8) -> dict:
+    """GET /tax latency and throughput of tax API server process"""
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "tax_api.py", "--port",
+                               str(port)], cwd=ROOT,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}"
+        results = {}
+        for pipeline in (1, 16):
+            load = asyncio.run(run_load(url, requests, connections,
+                                        pipeline))
+            for metric in ("errors", "requests_per_second", "latency_p50",
+                           "latency_p99"):
+                results[f"pipeline_{pipeline}_{metric}"] = load[metric]
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    print(json.dumps(bench_tax_api(), indent=2))
@@ -0,0 +1,138 @@
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from timing import per_call
+from timing import timed
+from taxcalc import CarEcoTax
+from taxcalc import TAX_CACHE
+from taxcalc import calculate_bulk_lines
+from taxcalc import write_bulk_results
+
+
+def bench_calculate(number: int = 20000) -> dict:
+    """Single CarEcoTax(...).calculate() latency with logging off and on"""
+    root = logging.getLogger()
+    level, handlers = root.level, root.handlers
+    results = {}
+    try:
+        root.handlers = [logging.StreamHandler(io.StringIO())]
+        root.setLevel(logging.WARNING)
+        results["logging_disabled_seconds"] = per_call(
+            lambda: CarEcoTax(2015, 150).calculate(), number)
+        root.setLevel(logging.DEBUG)
+        results["logging_enabled_seconds"] = per_call(
+            lambda: CarEcoTax(2015, 150).calculate(), number // 10)
+    finally:
+        root.handlers = handlers
+        root.setLevel(level)
+    TAX_CACHE.calculate(2015, 150)
+    results["cached_seconds"] = per_call(
+        lambda: TAX_CACHE.calculate(2015, 150), number)
+    return results
+
+
+def synthetic_lines(rows: int):
+    """CSV lines with production years and horse powers"""
+    yield "prod_year,horsepowers\n"
+    for row in range(rows):
+        yield f"{1995 + row % 31},{40 + row * 7 % 400}\n"
+
+
+def bench_bulk(rows: int = 1000000) -> dict:
+    """Bulk mode and calculate_many throughput over synthetic rows"""
+    results = {"rows": rows}
+    TAX_CACHE.clear()
+
+    def run_bulk():
+        write_bulk_results(calculate_bulk_lines(synthetic_lines(rows),
+                                                "csv"),
+                           io.StringIO(), io.StringIO(), 1000)
+
+    seconds = timed(run_bulk)
+    results["bulk_seconds"] = seconds
+    results["bulk_rows_per_second"] = rows / seconds
+    try:
+        import numpy
+    except ImportError:
+        return results
+    years = numpy.arange(rows) % 31 + 1995
+    horse_powers = numpy.arange(rows) * 7 % 400 + 40
+    seconds = timed(lambda: CarEcoTax.calculate_many(years, horse_powers))
+    results["calculate_many_seconds"] = seconds
+    results["calculate_many_rows_per_second"] = rows / seconds
+    return results
+
+
+def python_env() -> dict:
+    """Environment of measured interpreters, bytecode cache is enabled"""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def importtime(module: str) -> int:
+    """Return cumulative import microseconds of module by -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             f"import {module}"],
+                            cwd=ROOT, env=python_env(), check=True,
+                            capture_output=True, text=True).stderr
+    # import time: self [us] | cumulative | imported package
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module \
+                and not fields[2].startswith("  "):
+            return int(fields[1])
+    raise ValueError(f"{module} is not in -X importtime output")
+
+
+def bench_startup(repeat: int = 10, queries: int = 10000) -> dict:
+    """
+    Import time of taxcalc and telegram_bot in fresh interpreter, single
+    calculation from command line and query of warm --serve process
+    """
+    env = python_env()
+
+    def best(*args):
+        return min(timed(lambda: subprocess.run(
+            [sys.executable, *args], cwd=ROOT, env=env, check=True,
+            stdout=subprocess.DEVNULL))
+            for _ in range(repeat))
+
+    # Write bytecode cache before measuring
+    best("-c", "import taxcalc, telegram_bot")
+    baseline = best("-c", "pass")
+    results = {
+        "interpreter_seconds": baseline,
+        "import_taxcalc_seconds": best("-c", "import taxcalc") - baseline,
+        "import_telegram_bot_seconds":
+            best("-c", "import telegram_bot") - baseline,
+        "importtime_taxcalc_us": min(importtime("taxcalc")
+                                     for _ in range(repeat)),
+        "importtime_telegram_bot_us": min(importtime("telegram_bot")
+                                          for _ in range(repeat)),
+        "cli_script_seconds": best("taxcalc.py", "-p", "150", "-y", "2015"),
+        "cli_module_seconds": best("-m", "taxcalc", "-p", "150", "-y",
+                                   "2015")
+    }
+    query_lines = "".join(f"{1995 + query % 31} {40 + query * 7 % 400}\n"
+                          for query in range(queries))
+
+    def serve():
+        subprocess.run([sys.executable, "-m", "taxcalc", "--serve"],
+                       cwd=ROOT, env=env, check=True, input=query_lines,
+                       text=True, stdout=subprocess.DEVNULL)
+
+    results["serve_query_seconds"] = (timed(serve) - baseline) / queries
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps({"calculate": bench_calculate(),
+                      "bulk": bench_bulk(),
+                      "startup": bench_startup()}, indent=2))
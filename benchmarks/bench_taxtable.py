@@ -0,0 +1,33 @@
+import json
+import os
+import sys
+import tempfile
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from timing import per_call
+from timing import timed
+from taxcalc import CarEcoTax
+from taxtable import TaxTable
+from taxtable import export_table
+
+
+def bench_taxtable(number: int = 20000) -> dict:
+    """Export and open time of binary table and lookup latency"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "taxes.bin")
+        results = {"export_seconds": timed(
+            lambda: export_table(path, 2020, 2030, 1000))}
+        results["file_bytes"] = os.path.getsize(path)
+        results["open_seconds"] = per_call(lambda: TaxTable(path).close(),
+                                           number // 10)
+        with TaxTable(path) as table:
+            results["lookup_seconds"] = per_call(
+                lambda: table.lookup(2015, 150, 2020), number)
+    results["calculate_seconds"] = per_call(
+        lambda: CarEcoTax(2015, 150, as_of=2020).calculate(), number)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(bench_taxtable(), indent=2))
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_telegram import ConversationLoad
+from fake_telegram import FakeTelegramApi
+from telegram_bot import TelegramBot
+from telegram_workers import run_ingest
+from telegram_workers import start_workers
+
+
+def bench_workers(workers: int, chats: int = 200, send_latency: float = 0.02,
+                  timeout: float = 120) -> dict:
+    """Reply throughput of ingest process with workers against fake API"""
+    token = "benchmark"
+    loop = asyncio.new_event_loop()
+    api = FakeTelegramApi(token, send_latency)
+    server = loop.run_until_complete(api.start())
+    api_url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    load = ConversationLoad(api, chats)
+    stop = multiprocessing.Event()
+    # Fake API has no rate limits
+    processes, queues = start_workers(token, api_url, workers, stop,
+                                      send_rate=None, chat_send_rate=None)
+    ingest = TelegramBot(token, api_url)
+    ingest.poll_timeout = 1
+    ingest_thread = threading.Thread(target=run_ingest,
+                                     args=(ingest, queues, stop),
+                                     daemon=True)
+    ingest_thread.start()
+    started = time.perf_counter()
+    asyncio.run_coroutine_threadsafe(_start_load(load), loop).result()
+    finished = asyncio.run_coroutine_threadsafe(_wait(load, timeout), loop)
+    finished.result()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for process in processes:
+        process.join(5)
+    ingest_thread.join(5)
+    asyncio.run_coroutine_threadsafe(_shutdown(server), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    return {
+        "workers": workers,
+        "chats": chats,
+        "replies": len(load.latencies),
+        "seconds": round(elapsed, 3),
+        "replies_per_second": round(len(load.latencies) / elapsed, 1)
+    }
+
+
+async def _start_load(load: ConversationLoad) -> None:
+    load.start()
+
+
+async def _wait(load: ConversationLoad, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(load.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _shutdown(server) -> None:
+    """Close server and its open connections"""
+    server.close()
+    tasks = [task for task in asyncio.all_tasks()
+             if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reply throughput by number of bot workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--send-latency", type=float, default=0.02)
+    args = parser.parse_args()
+    for workers in args.workers:
+        print(json.dumps(bench_workers(workers, args.chats,
+                                       args.send_latency)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS_DIR)
+from bench_chatstore import bench_chatstore
+from bench_logging import bench_logging
+from bench_results import bench_results
+from bench_storage import bench_storage
+from bench_tax_api import bench_tax_api
+from bench_taxcalc import bench_bulk
+from bench_taxcalc import bench_calculate
+from bench_taxcalc import bench_startup
+from bench_taxtable import bench_taxtable
+
+
+def benchmarks(quick: bool) -> dict:
+    """Benchmark name to function, quick uses smaller sizes"""
+    rows = 100000 if quick else 1000000
+    chat_counts = (10, 1000, 10000) if quick else (10, 1000, 100000)
+    suite = {
+        "calculate": bench_calculate,
+        "logging": bench_logging,
+        "bulk": lambda: bench_bulk(rows),
+        "startup": lambda: bench_startup(3 if quick else 10),
+        "storage": bench_storage,
+        "taxtable": bench_taxtable,
+        "tax_api": lambda: bench_tax_api(5000 if quick else 20000),
+        "results": lambda: bench_results(10000 if quick else 100000)
+    }
+    for chats in chat_counts:
+        suite[f"chatstore_{chats}"] = \
+            lambda chats=chats: bench_chatstore(chats)
+    return suite
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old: dict, new: dict) -> None:
+    """Print new to old ratio of every common numeric result"""
+    print(f"{'benchmark':<50} {'old':>12} {'new':>12} {'new/old':>8}")
+    for name, results in new["results"].items():
+        old_results = old["results"].get(name, {})
+        for metric, value in results.items():
+            old_value = old_results.get(metric)
+            if not isinstance(value, (int, float)) or \
+                    not isinstance(old_value, (int, float)):
+                continue
+            ratio = value / old_value if old_value else float("nan")
+            print(f"{name + '.' + metric:<50} {old_value:>12.6g} "
+                  f"{value:>12.6g} {ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run benchmarks and save results as JSON")
+    parser.add_argument("names",
+                        nargs="*",
+                        help="benchmarks to run, all by default")
+    parser.add_argument("--quick",
+                        action='store_true',
+                        default=False,
+                        help="use smaller sizes")
+    parser.add_argument("--output",
+                        help="results file, "
+                             "benchmarks/results/<commit>.json by default")
+    parser.add_argument("--compare",
+                        metavar="FILE",
+                        help="previous results file to compare with")
+    args = parser.parse_args()
+    suite = benchmarks(args.quick)
+    unknown = set(args.names) - set(suite)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}, "
+                     f"available: {', '.join(suite)}")
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "quick": args.quick,
+        "results": {}
+    }
+    for name, function in suite.items():
+        if args.names and name not in args.names:
+            continue
+        print(f"running {name}...", file=sys.stderr)
+        report["results"][name] = function()
+    output = args.output or os.path.join(BENCHMARKS_DIR, "results",
+                                         f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"results saved to {output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as compare_file:
+            compare(json.load(compare_file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import timeit
+
+
+def per_call(function, number: int = 10000, repeat: int = 5) -> float:
+    """Return best per call seconds of function over repeat runs"""
+    timer = timeit.Timer(function)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def timed(function) -> float:
+    """Return seconds of one function call"""
+    started = timeit.default_timer()
+    function()
+    return timeit.default_timer() - started
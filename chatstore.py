@@ -0,0 +1,276 @@
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+
+
+class ChatSession:
+    """Conversation state of one chat"""
+    __slots__ = ("last_message", "last_message_id", "horse_powers",
+                 "prod_year", "processed", "updated_at")
+
+    def __init__(self, last_message: str, last_message_id: int,
+                 updated_at: float) -> None:
+        self.last_message = last_message
+        self.last_message_id = last_message_id
+        self.horse_powers = None
+        self.prod_year = None
+        self.processed = False
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return f"ChatSession(last_message={self.last_message!r}, " \
+               f"last_message_id={self.last_message_id}, " \
+               f"horse_powers={self.horse_powers}, " \
+               f"prod_year={self.prod_year}, processed={self.processed})"
+
+
+class MemoryStorage:
+    """Storage backend which doesn't persist anything"""
+
+    def load(self) -> tuple:
+        """Return (offset, sessions) where sessions are ordered by update"""
+        return 0, []
+
+    def save_session(self, chat_id, session: ChatSession) -> None:
+        pass
+
+    def delete_session(self, chat_id) -> None:
+        pass
+
+    def load_outbound(self) -> list:
+        """Return (chat_id, payload, created_at) of not sent replies"""
+        return []
+
+    def save_outbound(self, chat_id, message_id: int, payload: dict,
+                      created_at: float) -> None:
+        pass
+
+    def delete_outbound(self, chat_id, message_id: int) -> None:
+        pass
+
+    def commit(self, offset: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteStorage:
+    """
+    SQLite storage backend in WAL mode. Changed sessions and not sent
+    replies are written in one transaction together with update offset on
+    commit
+    """
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # WAL with normal synchronous mode is still consistent after crash
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "chat_id INTEGER PRIMARY KEY, last_message TEXT, "
+                "last_message_id INTEGER, horse_powers INTEGER, "
+                "prod_year INTEGER, processed INTEGER, updated_at REAL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "name TEXT PRIMARY KEY, value INTEGER)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS outbound ("
+                "chat_id INTEGER, message_id INTEGER, payload TEXT, "
+                "created_at REAL, PRIMARY KEY (chat_id, message_id))")
+        # Changed sessions by chat id, None for deleted ones
+        self.changed = {}
+        # Changed replies by (chat_id, message_id), None for sent ones
+        self.outbound_changed = {}
+        self.committed_offset = None
+
+    def load(self) -> tuple:
+        """Return (offset, sessions) where sessions are ordered by update"""
+        row = self.connection.execute(
+            "SELECT value FROM state WHERE name = 'offset'").fetchone()
+        sessions = []
+        for row_values in self.connection.execute(
+                "SELECT chat_id, last_message, last_message_id, "
+                "horse_powers, prod_year, processed, updated_at "
+                "FROM sessions ORDER BY updated_at"):
+            session = ChatSession(row_values[1], row_values[2],
+                                  row_values[6])
+            session.horse_powers = row_values[3]
+            session.prod_year = row_values[4]
+            session.processed = bool(row_values[5])
+            sessions.append((row_values[0], session))
+        self.committed_offset = row[0] if row else 0
+        return self.committed_offset, sessions
+
+    def save_session(self, chat_id, session: ChatSession) -> None:
+        # Session values are read on commit, so later changes are saved too
+        self.changed[chat_id] = session
+
+    def delete_session(self, chat_id) -> None:
+        self.changed[chat_id] = None
+
+    def load_outbound(self) -> list:
+        """Return (chat_id, payload, created_at) of not sent replies"""
+        return [(chat_id, json.loads(payload), created_at)
+                for chat_id, payload, created_at in self.connection.execute(
+                    "SELECT chat_id, payload, created_at FROM outbound "
+                    "ORDER BY created_at, rowid")]
+
+    def save_outbound(self, chat_id, message_id: int, payload: dict,
+                      created_at: float) -> None:
+        self.outbound_changed[chat_id, message_id] = (
+            json.dumps(payload, ensure_ascii=False), created_at)
+
+    def delete_outbound(self, chat_id, message_id: int) -> None:
+        self.outbound_changed[chat_id, message_id] = None
+
+    def commit(self, offset: int) -> None:
+        """Write changed sessions, replies and offset in one transaction"""
+        if not self.changed and not self.outbound_changed and \
+                offset == self.committed_offset:
+            return
+        saved = [(chat_id, session.last_message, session.last_message_id,
+                  session.horse_powers, session.prod_year,
+                  int(session.processed), session.updated_at)
+                 for chat_id, session in self.changed.items()
+                 if session is not None]
+        deleted = [(chat_id,) for chat_id, session in self.changed.items()
+                   if session is None]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                saved)
+            self.connection.executemany(
+                "DELETE FROM sessions WHERE chat_id = ?", deleted)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO outbound VALUES (?, ?, ?, ?)",
+                [key + value for key, value in self.outbound_changed.items()
+                 if value is not None])
+            self.connection.executemany(
+                "DELETE FROM outbound WHERE chat_id = ? AND message_id = ?",
+                [key for key, value in self.outbound_changed.items()
+                 if value is None])
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state VALUES ('offset', ?)",
+                (offset,))
+        self.changed = {}
+        self.outbound_changed = {}
+        self.committed_offset = offset
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class ChatSessionStore:
+    """
+    Chat sessions by chat id with O(1) lookup, ready queue of chats with
+    unprocessed message and eviction of sessions not updated for ttl seconds.
+    Sessions and update offset are persisted by storage backend
+    """
+
+    def __init__(self, ttl: float = 24 * 60 * 60, clock=time.time,
+                 storage=None) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self.storage = storage or MemoryStorage()
+        # Ordered by last update, so expired sessions are at the beginning
+        self.sessions = OrderedDict()
+        # Chat ids with unprocessed message in arrival order
+        self.ready = OrderedDict()
+        self.offset, sessions = self.storage.load()
+        for chat_id, session in sessions:
+            self.sessions[chat_id] = session
+            if not session.processed:
+                self.ready[chat_id] = None
+        # Replies queued but not sent before restart
+        self.restored_outbound = self.storage.load_outbound()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, chat_id):
+        return chat_id in self.sessions
+
+    def get(self, chat_id):
+        """Return ChatSession or None"""
+        return self.sessions.get(chat_id)
+
+    def add_message(self, chat_id, message_id: int, text: str) -> ChatSession:
+        """Set chat last message and put chat to ready queue"""
+        now = self.clock()
+        session = self.sessions.get(chat_id)
+        if session is None:
+            session = ChatSession(text, message_id, now)
+            self.sessions[chat_id] = session
+        else:
+            session.last_message = text
+            session.last_message_id = message_id
+            session.processed = False
+            session.updated_at = now
+            self.sessions.move_to_end(chat_id)
+        self.ready[chat_id] = None
+        self.storage.save_session(chat_id, session)
+        return session
+
+    def ready_chat_ids(self) -> list:
+        """Return chat ids with unprocessed message"""
+        return list(self.ready)
+
+    def has_ready(self) -> bool:
+        return bool(self.ready)
+
+    def mark_processed(self, chat_id) -> None:
+        """Mark chat last message replied and remove it from ready queue"""
+        session = self.sessions.get(chat_id)
+        if session is not None:
+            session.processed = True
+            self.storage.save_session(chat_id, session)
+        self.ready.pop(chat_id, None)
+
+    def add_outbound(self, chat_id, message_id: int, payload: dict,
+                     created_at: float) -> None:
+        """Persist reply to message till it is sent"""
+        self.storage.save_outbound(chat_id, message_id, payload, created_at)
+
+    def remove_outbound(self, chat_id, message_id: int) -> None:
+        """Forget sent or dropped reply on next commit"""
+        self.storage.delete_outbound(chat_id, message_id)
+
+    def take_restored_outbound(self) -> list:
+        """Return replies not sent before restart, once"""
+        restored, self.restored_outbound = self.restored_outbound, []
+        return restored
+
+    def save(self, chat_id) -> None:
+        """Persist session changed outside of store on next commit"""
+        session = self.sessions.get(chat_id)
+        if session is not None:
+            self.storage.save_session(chat_id, session)
+
+    def remove(self, chat_id) -> None:
+        if self.sessions.pop(chat_id, None) is not None:
+            self.storage.delete_session(chat_id)
+        self.ready.pop(chat_id, None)
+
+    def evict_expired(self) -> list:
+        """Remove sessions not updated for ttl seconds, return their ids"""
+        expire_before = self.clock() - self.ttl
+        evicted = []
+        while self.sessions:
+            chat_id, session = next(iter(self.sessions.items()))
+            if session.updated_at > expire_before:
+                break
+            self.remove(chat_id)
+            evicted.append(chat_id)
+        return evicted
+
+    def commit(self, offset: int) -> None:
+        """Persist changes of polling cycle together with update offset"""
+        self.offset = offset
+        self.storage.commit(offset)
+
+    def close(self) -> None:
+        self.storage.close()
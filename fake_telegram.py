@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import statistics
+import threading
+import time
+from asynchttp import json_response
+from asynchttp import serve
+
+
+class FakeTelegramApi:
+    """
+    Local fake of Telegram Bot API getUpdates and sendMessage methods for
+    measuring bot latency and throughput offline
+    """
+
+    def __init__(self, token: str = "test", send_latency: float = 0.0
+                 ) -> None:
+        self.path_prefix = f"/bot{token}/"
+        self.send_latency = send_latency
+        self.pending_updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.sent_messages = []
+        self.new_updates = None
+        # Called with (chat_id, payload) for every sendMessage
+        self.on_message = None
+
+    def push_message(self, chat_id: int, text: str) -> dict:
+        """Add user message update for bot"""
+        update = {
+            "update_id": self.next_update_id,
+            "message": {
+                "message_id": self.next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text
+            }
+        }
+        self.next_update_id += 1
+        self.next_message_id += 1
+        self.pending_updates.append(update)
+        if self.new_updates is not None:
+            self.new_updates.set()
+        return update
+
+    async def get_updates(self, payload: dict) -> list:
+        offset = payload.get("offset") or 0
+        # Updates before offset are confirmed by bot
+        self.pending_updates = [update for update in self.pending_updates
+                                if update["update_id"] >= offset]
+        timeout = payload.get("timeout") or 0
+        if not self.pending_updates and timeout > 0:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending_updates[:payload.get("limit") or 100]
+
+    async def send_message(self, payload: dict) -> dict:
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": payload["chat_id"], "type": "private"},
+            "text": payload["text"]
+        }
+        self.next_message_id += 1
+        self.sent_messages.append(payload)
+        if self.on_message is not None:
+            self.on_message(payload["chat_id"], payload)
+        return message
+
+    async def handle(self, request):
+        """asynchttp.serve handler"""
+        if not request.path.startswith(self.path_prefix):
+            return json_response(404, {"ok": False, "error_code": 404,
+                                       "description": "Not Found"})
+        method = request.path[len(self.path_prefix):]
+        payload = json.loads(request.body or b"{}")
+        if method == "getUpdates":
+            result = await self.get_updates(payload)
+        elif method == "sendMessage":
+            result = await self.send_message(payload)
+        else:
+            return json_response(404, {"ok": False, "error_code": 404,
+                                       "description": "Not Found"})
+        return json_response(200, {"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Start server and return it, port 0 means any free port"""
+        self.new_updates = asyncio.Event()
+        return await serve(self.handle, host, port)
+
+
+class ConversationLoad:
+    """
+    Simulated users: every chat sends /start, production year and horse
+    powers, next message is sent when bot replied to previous one
+    """
+
+    def __init__(self, api: FakeTelegramApi, chats: int) -> None:
+        year = str(datetime.datetime.today().year - 5)
+        self.script = ["/start", year, "150"]
+        self.api = api
+        self.chats = chats
+        self.steps = {}
+        self.sent_at = {}
+        self.latencies = []
+        self.done = None
+        api.on_message = self.on_reply
+
+    def start(self) -> None:
+        self.done = asyncio.Event()
+        for chat_id in range(1, self.chats + 1):
+            self.next_message(chat_id)
+
+    def next_message(self, chat_id: int) -> None:
+        step = self.steps.get(chat_id, 0)
+        self.steps[chat_id] = step + 1
+        self.sent_at[chat_id] = time.perf_counter()
+        self.api.push_message(chat_id, self.script[step])
+
+    def on_reply(self, chat_id: int, payload: dict) -> None:
+        self.latencies.append(time.perf_counter() - self.sent_at[chat_id])
+        if self.steps[chat_id] < len(self.script):
+            self.next_message(chat_id)
+        elif len(self.latencies) == self.chats * len(self.script):
+            self.done.set()
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Update with text message of chat"""
+    return {"update_id": update_id,
+            "message": {"message_id": update_id,
+                        "chat": {"id": chat_id},
+                        "text": text}}
+
+
+def stubbed_bot(token: str = "test"):
+    """TelegramBot collecting replies in replies instead of sending them"""
+    from telegram_bot import TelegramBot
+    bot = TelegramBot(token)
+    bot.replies = []
+    bot.submit_message = lambda chat_id, payload, created_at: \
+        bot.replies.append(payload)
+    return bot
+
+
+def run_sync_bot(api_url: str, token: str, stop: threading.Event) -> None:
+    """Run TelegramBot same as telegram_bot.main does"""
+    from telegram_bot import TelegramBot
+    bot = TelegramBot(token, api_url)
+    bot.send_rate = bot.chat_send_rate = None
+    while not stop.is_set():
+        time.sleep(1)
+        bot.run()
+
+
+async def benchmark(bot_type: str, chats: int, send_latency: float,
+                    timeout: float) -> dict:
+    """Run bot against fake API with simulated users and return stats"""
+    token = "benchmark"
+    api = FakeTelegramApi(token, send_latency)
+    server = await api.start()
+    api_url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    load = ConversationLoad(api, chats)
+    stop = threading.Event()
+    if bot_type == "async":
+        from telegram_async import AsyncTelegramBot
+        bot = AsyncTelegramBot(token, api_url, poll_timeout=5)
+        # Fake API has no rate limits
+        bot.send_rate = bot.chat_send_rate = None
+        bot_task = asyncio.ensure_future(bot.run_forever())
+    else:
+        bot_thread = threading.Thread(target=run_sync_bot,
+                                      args=(api_url, token, stop),
+                                      daemon=True)
+        bot_thread.start()
+    started = time.perf_counter()
+    load.start()
+    try:
+        await asyncio.wait_for(load.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        logging.error(f"Benchmark timed out after {timeout}s")
+    elapsed = time.perf_counter() - started
+    if bot_type == "async":
+        bot_task.cancel()
+        try:
+            await bot_task
+        except asyncio.CancelledError:
+            pass
+    else:
+        stop.set()
+    server.close()
+    # Answer pending long polls so their connections are closed by bot
+    api.new_updates.set()
+    await asyncio.sleep(0)
+    latencies = sorted(load.latencies)
+    return {
+        "bot": bot_type,
+        "chats": chats,
+        "replies": len(latencies),
+        "seconds": round(elapsed, 3),
+        "replies_per_second": round(len(latencies) / elapsed, 1),
+        "latency_p50": round(statistics.median(latencies), 4)
+        if latencies else None,
+        "latency_p99": round(latencies[int(len(latencies) * 0.99) - 1], 4)
+        if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fake Telegram Bot API server and bot benchmark")
+    parser.add_argument("--serve",
+                        action='store_true',
+                        default=False,
+                        help="only run fake API server")
+    parser.add_argument("--port",
+                        type=int,
+                        default=8081,
+                        help="fake API server port for --serve")
+    parser.add_argument("--token",
+                        default="test",
+                        help="bot token expected by --serve server")
+    parser.add_argument("--bot",
+                        choices=["async", "sync"],
+                        default="async",
+                        help="bot to benchmark")
+    parser.add_argument("--chats",
+                        type=int,
+                        default=100,
+                        help="number of simulated chats")
+    parser.add_argument("--send-latency",
+                        type=float,
+                        default=0.05,
+                        help="sendMessage latency of fake API in seconds")
+    parser.add_argument("--timeout",
+                        type=float,
+                        default=120,
+                        help="benchmark timeout in seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    if args.serve:
+        async def serve_forever():
+            api = FakeTelegramApi(args.token, args.send_latency)
+            server = await api.start("127.0.0.1", args.port)
+            async with server:
+                await server.serve_forever()
+        asyncio.run(serve_forever())
+        return
+    print(json.dumps(asyncio.run(benchmark(args.bot, args.chats,
+                                           args.send_latency,
+                                           args.timeout))))
+
+
+if __name__ == "__main__":
+    main()
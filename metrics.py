@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(labelnames: tuple, labelvalues: tuple, extra: str = ""
+                  ) -> str:
+    """Return Prometheus {name="value"} label set"""
+    pairs = [f'{name}="{value}"'
+             for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class of metric with optional labels"""
+    metric_type = None
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *labelvalues):
+        """Return child metric for label values"""
+        child = self.children.get(labelvalues)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(labelvalues,
+                                                 self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> list:
+        """Return exposition lines without HELP and TYPE"""
+        lines = []
+        # Other threads could add children meanwhile
+        with self.lock:
+            children = sorted(self.children.items())
+        for labelvalues, child in children:
+            lines.extend(child.samples(self.name, self.labelnames,
+                                       labelvalues))
+        return lines
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class CounterChild:
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, labelvalues) -> list:
+        labels = format_labels(labelnames, labelvalues)
+        return [f"{name}{labels} {self.value}"]
+
+
+class Counter(Metric):
+    """Monotonically increasing counter"""
+    metric_type = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class GaugeChild:
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.function = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function) -> None:
+        """Read gauge value from function on every exposition"""
+        self.function = function
+
+    def samples(self, name, labelnames, labelvalues) -> list:
+        labels = format_labels(labelnames, labelvalues)
+        value = self.function() if self.function else self.value
+        return [f"{name}{labels} {value}"]
+
+
+class Gauge(Metric):
+    """Value which could go up and down"""
+    metric_type = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function) -> None:
+        self.labels().set_function(function)
+
+
+class Timer:
+    """Context manager observing elapsed seconds into histogram"""
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class HistogramChild:
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> Timer:
+        return Timer(self)
+
+    def samples(self, name, labelnames, labelvalues) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            labels = format_labels(labelnames, labelvalues,
+                                   f'le="{bound}"')
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = format_labels(labelnames, labelvalues)
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(Metric):
+    """Distribution of observed values by cumulative buckets"""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS
+                 ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> Timer:
+        return Timer(self.labels())
+
+
+class Registry:
+    """Collection of metrics rendered in Prometheus text format"""
+
+    def __init__(self) -> None:
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"{metric.name} metric already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames,
+                                       buckets))
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics.values())
+
+    def write_textfile(self, path: str) -> None:
+        """Write metrics for node exporter textfile collector atomically"""
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as textfile:
+            textfile.write(self.render())
+        os.replace(temporary_path, path)
+
+
+# Default registry of application metrics
+REGISTRY = Registry()
+
+
+def start_http_server(port: int, host: str = "", registry: Registry = REGISTRY
+                      ):
+    """Serve /metrics from daemon thread and return ThreadingHTTPServer"""
+    # http.server is slow to import and only needed by exporting processes
+    from http.server import BaseHTTPRequestHandler
+    from http.server import ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type",
+                             "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True,
+                     name="metrics").start()
+    return server
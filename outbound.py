@@ -0,0 +1,278 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class RateLimitError(Exception):
+    """Exception for 429 response, send again after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket of rate tokens per second with capacity burst, rate None
+    means unlimited
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate, capacity: float, now: float) -> None:
+        if rate is not None and rate <= 0:
+            raise ValueError(f"Rate should be greater then 0 or None, "
+                             f"got {rate}")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, now: float) -> None:
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens
+                              + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Return seconds till token is available, 0 if it is now"""
+        if self.rate is None:
+            return 0.0
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        """Take token, wait_time should be 0 before"""
+        if self.rate is not None:
+            self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        if self.rate is None:
+            return True
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundMessage:
+    """Message waiting for sending with number of failed attempts"""
+    __slots__ = ("chat_id", "payload", "created_at", "attempts")
+
+    def __init__(self, chat_id, payload: dict, created_at: float) -> None:
+        self.chat_id = chat_id
+        self.payload = payload
+        # Time of message replied to, by ChatSessionStore clock
+        self.created_at = created_at
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """
+    Queue of outbound messages limited by global and per chat token
+    buckets. Messages of one chat are sent one by one in order, failed
+    ones are retried with exponential backoff and 429 pauses all sending
+    for retry_after seconds. Not thread safe, drivers lock it
+    """
+    # Seconds between removing full per chat buckets
+    prune_interval = 60.0
+
+    def __init__(self, rate=30, chat_rate=1, chat_burst: int = 3,
+                 max_attempts: int = 5, backoff: float = 1.0,
+                 max_backoff: float = 60.0, clock=time.monotonic) -> None:
+        self.clock = clock
+        now = clock()
+        self.bucket = TokenBucket(rate, max(rate or 1, 1), now)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Not sent messages by chat id
+        self.queues = {}
+        # Chats which could send now in round robin order
+        self.ready = OrderedDict()
+        # (due_at, sequence, chat_id) of chats waiting for bucket or retry
+        self.delayed = []
+        self.sequence = 0
+        self.paused_until = 0.0
+        self.next_prune_at = now + self.prune_interval
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def submit(self, chat_id, payload: dict, created_at: float) -> None:
+        """Add message to the end of chat queue"""
+        chat_queue = self.queues.get(chat_id)
+        if chat_queue is None:
+            chat_queue = self.queues[chat_id] = deque()
+            self.ready[chat_id] = None
+        chat_queue.append(OutboundMessage(chat_id, payload, created_at))
+        self.pending += 1
+
+    def delay(self, chat_id, due_at: float) -> None:
+        self.sequence += 1
+        heapq.heappush(self.delayed, (due_at, self.sequence, chat_id))
+
+    def next_message(self, now: float = None) -> tuple:
+        """
+        Return (message, None) of message which should be sent now or
+        (None, seconds) to wait for the next one, seconds is None if there
+        is nothing to send. Chat of returned message is in flight till
+        sent, failed or rate_limited is called
+        """
+        now = self.clock() if now is None else now
+        if now >= self.next_prune_at:
+            self.prune_buckets(now)
+        while self.delayed and self.delayed[0][0] <= now:
+            self.ready[heapq.heappop(self.delayed)[2]] = None
+        if not self.ready:
+            return None, self.delayed[0][0] - now if self.delayed else None
+        if now < self.paused_until:
+            return None, self.paused_until - now
+        wait = self.bucket.wait_time(now)
+        if wait:
+            return None, wait
+        while self.ready:
+            chat_id, _ = self.ready.popitem(last=False)
+            chat_bucket = self.chat_buckets.get(chat_id)
+            if chat_bucket is None:
+                chat_bucket = self.chat_buckets[chat_id] = TokenBucket(
+                    self.chat_rate, self.chat_burst, now)
+            wait = chat_bucket.wait_time(now)
+            if wait:
+                self.delay(chat_id, now + wait)
+                continue
+            chat_bucket.take()
+            self.bucket.take()
+            return self.queues[chat_id].popleft(), None
+        return None, self.delayed[0][0] - now
+
+    def sent(self, message: OutboundMessage) -> None:
+        """Message was sent, next message of chat could be sent"""
+        self.pending -= 1
+        self.release_chat(message.chat_id)
+
+    def failed(self, message: OutboundMessage, now: float = None) -> bool:
+        """
+        Schedule retry of failed message with exponential backoff, return
+        False if message is dropped after max_attempts
+        """
+        now = self.clock() if now is None else now
+        message.attempts += 1
+        if message.attempts >= self.max_attempts:
+            self.pending -= 1
+            self.release_chat(message.chat_id)
+            return False
+        backoff = min(self.max_backoff,
+                      self.backoff * 2 ** (message.attempts - 1))
+        # Jitter spreads retries of many chats failed at the same time
+        self.queues[message.chat_id].appendleft(message)
+        self.delay(message.chat_id, now + backoff * random.uniform(0.5, 1))
+        return True
+
+    def rate_limited(self, message: OutboundMessage, retry_after: float,
+                     now: float = None) -> None:
+        """Pause sending for retry_after seconds and send message first"""
+        now = self.clock() if now is None else now
+        self.paused_until = max(self.paused_until, now + retry_after)
+        self.queues[message.chat_id].appendleft(message)
+        self.ready[message.chat_id] = None
+        self.ready.move_to_end(message.chat_id, last=False)
+
+    def release_chat(self, chat_id) -> None:
+        if self.queues[chat_id]:
+            self.ready[chat_id] = None
+        else:
+            del self.queues[chat_id]
+
+    def prune_buckets(self, now: float) -> None:
+        """Remove full buckets of chats, new ones are the same"""
+        self.next_prune_at = now + self.prune_interval
+        for chat_id in [chat_id for chat_id, bucket
+                        in self.chat_buckets.items()
+                        if chat_id not in self.queues and bucket.is_full(now)]:
+            del self.chat_buckets[chat_id]
+
+
+class OutboundSender:
+    """
+    Threads sending messages of OutboundScheduler by blocking send
+    function. send(payload) raises RateLimitError on 429 and
+    retry_exceptions on other failures
+    """
+
+    def __init__(self, scheduler: OutboundScheduler, send,
+                 retry_exceptions: tuple, on_sent=None, on_dropped=None,
+                 threads: int = 4) -> None:
+        self.scheduler = scheduler
+        self.send = send
+        self.retry_exceptions = retry_exceptions
+        self.on_sent = on_sent
+        self.on_dropped = on_dropped
+        self.threads = threads
+        self.condition = threading.Condition()
+        self.workers = []
+        self.stopped = False
+
+    def submit(self, chat_id, payload: dict, created_at: float) -> None:
+        with self.condition:
+            self.scheduler.submit(chat_id, payload, created_at)
+            self.condition.notify()
+        if not self.workers:
+            self.start()
+
+    def start(self) -> None:
+        self.workers = [threading.Thread(target=self.run, daemon=True,
+                                         name=f"sender-{index}")
+                        for index in range(self.threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout: float = None) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        return
+                    message, wait = self.scheduler.next_message()
+                    if message is not None:
+                        break
+                    self.condition.wait(wait)
+            self.send_one(message)
+
+    def send_one(self, message: OutboundMessage) -> None:
+        try:
+            result = self.send(message.payload)
+        except RateLimitError as rate_limit:
+            logging.warning(f"Rate limited, retry after "
+                            f"{rate_limit.retry_after}s")
+            with self.condition:
+                self.scheduler.rate_limited(message, rate_limit.retry_after)
+                self.condition.notify_all()
+            return
+        except self.retry_exceptions as send_error:
+            with self.condition:
+                retried = self.scheduler.failed(message)
+                self.condition.notify_all()
+            logging.error(f"Failed sent message to {message.chat_id} chat "
+                          f"id, attempt {message.attempts}: {send_error}")
+            if not retried and self.on_dropped:
+                self.on_dropped(message)
+            return
+        with self.condition:
+            self.scheduler.sent(message)
+            self.condition.notify_all()
+        if self.on_sent:
+            self.on_sent(message, result)
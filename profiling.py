@@ -0,0 +1,215 @@
+import os
+import sys
+import threading
+import time
+
+
+class NullSpan:
+    """Span of disabled tracer, shared and doing nothing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """Context manager adding elapsed seconds to tracer stage total"""
+    __slots__ = ("tracer", "name", "started")
+
+    def __init__(self, tracer, name: str) -> None:
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add(self.name, time.perf_counter() - self.started)
+
+
+class Tracer:
+    """
+    Per stage totals of named trace spans. Disabled tracer returns shared
+    NULL_SPAN and hot loops check enabled once to wrap their stages, so
+    tracing costs nothing till it is enabled
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.lock = threading.Lock()
+        # (seconds, count) by stage name
+        self.totals = {}
+
+    def span(self, name: str):
+        return Span(self, name) if self.enabled else NULL_SPAN
+
+    def add(self, name: str, seconds: float) -> None:
+        with self.lock:
+            total, count = self.totals.get(name, (0.0, 0))
+            self.totals[name] = (total + seconds, count + 1)
+
+    def merge(self, totals: dict) -> None:
+        """Add stage totals of other tracer, e.g. of worker process"""
+        with self.lock:
+            for name, (seconds, count) in totals.items():
+                total, total_count = self.totals.get(name, (0.0, 0))
+                self.totals[name] = (total + seconds, total_count + count)
+
+    def wrap(self, name: str, function):
+        """Return function adding its call time to name stage"""
+        def traced(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - started)
+        return traced
+
+    def wrap_iter(self, name: str, iterable):
+        """Generator adding time of getting every item to name stage"""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - started)
+                return
+            self.add(name, time.perf_counter() - started)
+            yield item
+
+    def report(self) -> str:
+        """Return stage totals table sorted by total time"""
+        with self.lock:
+            totals = sorted(self.totals.items(), key=lambda item: -item[1][0])
+        all_seconds = sum(seconds for _, (seconds, _) in totals) or 1
+        lines = [f"{'stage':<16}{'calls':>10}{'total s':>12}"
+                 f"{'mean us':>12}{'share':>8}"]
+        for name, (seconds, count) in totals:
+            lines.append(f"{name:<16}{count:>10}{seconds:>12.4f}"
+                         f"{seconds / count * 1e6:>12.2f}"
+                         f"{seconds / all_seconds:>8.1%}")
+        return "\n".join(lines) + "\n"
+
+    def enable(self, report_at_exit: bool = True) -> None:
+        self.enabled = True
+        if report_at_exit:
+            import atexit
+            atexit.register(lambda: sys.stderr.write(self.report()))
+
+
+# Process wide tracer used by trace spans of bulk mode and bots
+TRACER = Tracer()
+
+
+def frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:" \
+           f"{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples stacks of all other threads every interval seconds and writes
+    them as collapsed stacks, input of flamegraph.pl and speedscope
+    """
+
+    def __init__(self, path: str, interval: float = 0.005) -> None:
+        self.path = path
+        self.interval = interval
+        self.counts = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="sampling-profiler")
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def sample(self) -> None:
+        names = {thread.ident: thread.name
+                 for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.thread.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        with open(self.path, "w", encoding="utf-8") as output:
+            for stack, count in sorted(self.counts.items()):
+                output.write(f"{stack} {count}\n")
+
+
+class CProfiler:
+    """cProfile of calling thread saved to pstats file"""
+
+    def __init__(self, path: str) -> None:
+        import cProfile
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+
+
+PROFILE_SUFFIXES = {"cprofile": ".pstats", "sample": ".folded"}
+
+
+def add_profile_arguments(parser) -> None:
+    """Add --profile and --trace options to argparse parser"""
+    parser.add_argument("--profile",
+                        choices=sorted(PROFILE_SUFFIXES),
+                        help="profile run: cprofile writes pstats file, "
+                             "sample writes collapsed stacks for "
+                             "flamegraph tools")
+    parser.add_argument("--profile-output",
+                        metavar="FILE",
+                        help="profile file, <program>.pstats or "
+                             "<program>.folded by default")
+    parser.add_argument("--profile-interval",
+                        type=float,
+                        default=0.005,
+                        help="sampling interval in seconds")
+    parser.add_argument("--trace",
+                        action='store_true',
+                        default=False,
+                        help="print time of main stages to stderr at exit")
+
+
+def start_profiling(args, program: str):
+    """
+    Enable tracer and start profiler of parsed add_profile_arguments
+    options, return profiler to stop or None
+    """
+    if args.trace:
+        TRACER.enable()
+    if not args.profile:
+        return None
+    path = args.profile_output or f"{program}{PROFILE_SUFFIXES[args.profile]}"
+    if args.profile == "cprofile":
+        profiler = CProfiler(path)
+    else:
+        profiler = SamplingProfiler(path, args.profile_interval)
+    profiler.start()
+    return profiler
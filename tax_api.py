@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import time
+import zlib
+from asynchttp import Response
+from asynchttp import json_response
+from asynchttp import serve
+from metrics import REGISTRY
+from metrics import start_http_server
+from taxcalc import CLOCK
+from taxcalc import CarEcoTaxHorsePowerError
+from taxcalc import CarEcoTaxProdYearError
+from taxcalc import calculate_tax
+from taxcalc import rate_table
+
+
+TAX_API_REQUEST_SECONDS = REGISTRY.histogram(
+    "tax_api_request_seconds", "Duration of tax API request handling",
+    labelnames=("endpoint",))
+TAX_API_CARS = REGISTRY.counter(
+    "tax_api_cars_total", "Cars calculated by tax API",
+    labelnames=("endpoint",))
+
+
+class TaxApiError(Exception):
+    """Exception for wrong tax API request, answered with 400"""
+    pass
+
+
+def parse_int(value, name: str) -> int:
+    """Return JSON integer value or raise TaxApiError, floats are wrong"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TaxApiError(f"{name} should be integer: {value!r}")
+    return value
+
+
+def parse_query_int(value: str, name: str) -> int:
+    """Return query parameter of decimal digits as integer"""
+    if not (value.isascii() and value.isdigit()):
+        raise TaxApiError(f"{name} should be integer: {value!r}")
+    return int(value)
+
+
+def parse_as_of(value):
+    """Return as_of year or date of YYYY or YYYY-MM-DD value"""
+    if value is None:
+        return None
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        if not datetime.MINYEAR <= value <= datetime.MAXYEAR:
+            raise TaxApiError(f"as_of year should be from "
+                              f"{datetime.MINYEAR} to {datetime.MAXYEAR}: "
+                              f"{value}")
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            pass
+    raise TaxApiError(f"as_of should be YYYY year or YYYY-MM-DD date: "
+                      f"{value!r}")
+
+
+def tax_result(year: int, hp: int, as_of=None) -> dict:
+    """Return JSON object of one car tax or raise TaxApiError"""
+    try:
+        result = calculate_tax(year, hp, as_of)
+    except (CarEcoTaxProdYearError,
+            CarEcoTaxHorsePowerError) as car_error:
+        raise TaxApiError(str(car_error))
+    return {"year": result.year, "hp": result.hp,
+            "tax_age": result.tax_age, "bracket": result.bracket,
+            "tax": result.amount}
+
+
+class TaxApi:
+    """
+    HTTP JSON API of tax calculation: GET /tax?year=&hp= for one car and
+    POST /tax/batch with JSON array of {"year", "hp"} objects. GET
+    responses have ETag and Cache-Control of tax year and schedule
+    """
+    # Max seconds GET responses could be cached, schedule could be reloaded
+    max_age = 3600
+    # Max number of cars in one batch request
+    max_batch_size = 10000
+
+    def __init__(self) -> None:
+        # Short schedule digest by rate table, tables are replaced on reload
+        self.digests = {}
+
+    def schedule_digest(self, table) -> str:
+        digest = self.digests.get(table)
+        if digest is None:
+            data = json.dumps(table.tax_per_hp, sort_keys=True)
+            digest = f"{zlib.crc32(data.encode('utf-8')):08x}"
+            self.digests[table] = digest
+        return digest
+
+    def cache_headers(self, as_of) -> dict:
+        """Return ETag and Cache-Control headers of tax year as of date"""
+        tax_year = CLOCK.year() if as_of is None else \
+            as_of if isinstance(as_of, int) else as_of.year
+        digest = self.schedule_digest(rate_table(as_of))
+        max_age = self.max_age
+        if as_of is None:
+            # Current tax year answers change on new year
+            next_year_at = datetime.datetime(tax_year + 1, 1, 1).timestamp()
+            max_age = max(0, min(max_age, int(next_year_at - time.time())))
+        return {"ETag": f'"{tax_year}-{digest}"',
+                "Cache-Control": f"public, max-age={max_age}"}
+
+    async def handle(self, request) -> Response:
+        """asynchttp.serve handler"""
+        if request.path == "/tax":
+            endpoint, allowed, handler = "tax", "GET", self.get_tax
+        elif request.path == "/tax/batch":
+            endpoint, allowed, handler = "batch", "POST", self.post_batch
+        else:
+            return json_response(404, {"error": "Not Found"})
+        if request.method != allowed:
+            return json_response(405, {"error": "Method Not Allowed"},
+                                 {"Allow": allowed})
+        with TAX_API_REQUEST_SECONDS.labels(endpoint).time():
+            try:
+                return handler(request)
+            except TaxApiError as api_error:
+                return json_response(400, {"error": str(api_error)})
+
+    def get_tax(self, request) -> Response:
+        query = request.query
+        for name in ("year", "hp"):
+            if name not in query:
+                raise TaxApiError(f"{name} query parameter is required")
+        as_of = parse_as_of(query.get("as_of", [None])[0])
+        # Wrong query gets 400 even if client has cached response
+        result = tax_result(parse_query_int(query["year"][0], "year"),
+                            parse_query_int(query["hp"][0], "hp"), as_of)
+        headers = self.cache_headers(as_of)
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(304, headers, b"")
+        TAX_API_CARS.labels("tax").inc()
+        return json_response(200, result, headers)
+
+    def post_batch(self, request) -> Response:
+        try:
+            cars = json.loads(request.body)
+        except ValueError as json_error:
+            raise TaxApiError(f"Malformed JSON: {json_error}")
+        if not isinstance(cars, list):
+            raise TaxApiError("Body should be JSON array of cars")
+        if len(cars) > self.max_batch_size:
+            raise TaxApiError(f"Batch should have at most "
+                              f"{self.max_batch_size} cars")
+        results = []
+        for car in cars:
+            # Wrong car doesn't fail the whole batch
+            try:
+                if not isinstance(car, dict):
+                    raise TaxApiError("Car should be JSON object")
+                results.append(tax_result(parse_int(car.get("year"), "year"),
+                                          parse_int(car.get("hp"), "hp"),
+                                          parse_as_of(car.get("as_of"))))
+            except TaxApiError as car_error:
+                results.append({"error": str(car_error)})
+        TAX_API_CARS.labels("batch").inc(len(cars))
+        return json_response(200, results)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Start server and return it, port 0 means any free port"""
+        return await serve(self.handle, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="HTTP JSON API of car eco tax calculation")
+    parser.add_argument("--host",
+                        default="127.0.0.1",
+                        help="listen address")
+    parser.add_argument("--port",
+                        type=int,
+                        default=8080,
+                        help="listen port")
+    parser.add_argument("--metrics-port",
+                        type=int,
+                        help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+
+    async def serve_forever():
+        server = await TaxApi().start(args.host, args.port)
+        logging.info(f"Serving tax API on {args.host}:{args.port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
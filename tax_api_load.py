@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+from asynchttp import encode_message
+from asynchttp import read_body
+from asynchttp import read_headers
+
+
+def request_targets(count: int) -> list:
+    """GET /tax targets of different cars"""
+    return [f"/tax?year={1995 + index % 31}&hp={40 + index * 7 % 400}"
+            for index in range(count)]
+
+
+async def run_connection(host: str, port: int, targets: list,
+                         pipeline: int, latencies: list) -> int:
+    """
+    Send targets over one keep-alive connection, pipeline requests are
+    written at once before reading their responses. Returns error count
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    errors = 0
+    try:
+        for start in range(0, len(targets), pipeline):
+            batch = targets[start:start + pipeline]
+            sent_at = time.perf_counter()
+            writer.write(b"".join(
+                encode_message(f"GET {target} HTTP/1.1",
+                               {"Host": f"{host}:{port}"}, b"")
+                for target in batch))
+            await writer.drain()
+            for _ in batch:
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError("Connection closed by server")
+                headers = await read_headers(reader)
+                await read_body(reader, headers)
+                latencies.append(time.perf_counter() - sent_at)
+                if status_line.split()[1] != b"200":
+                    errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def run_load(url: str, requests: int = 10000, connections: int = 8,
+                   pipeline: int = 1) -> dict:
+    """Return throughput and latency of GET /tax requests to url"""
+    parts = urlsplit(url)
+    targets = request_targets(requests)
+    latencies = []
+    started = time.perf_counter()
+    errors = await asyncio.gather(*(
+        run_connection(parts.hostname, parts.port or 80,
+                       targets[index::connections], pipeline, latencies)
+        for index in range(connections)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "connections": connections,
+        "pipeline": pipeline,
+        "errors": sum(errors),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_p50": round(statistics.median(latencies), 6),
+        "latency_p99": round(latencies[int(len(latencies) * 0.99) - 1], 6)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load generator of tax API GET /tax endpoint")
+    parser.add_argument("--url",
+                        default="http://127.0.0.1:8080",
+                        help="tax API base url")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=10000,
+                        help="total number of requests")
+    parser.add_argument("--connections",
+                        type=int,
+                        default=8,
+                        help="number of keep-alive connections")
+    parser.add_argument("--pipeline",
+                        type=int,
+                        default=1,
+                        help="requests sent at once on connection")
+    args = parser.parse_args()
+    if min(args.requests, args.connections, args.pipeline) <= 0:
+        parser.error("--requests, --connections and --pipeline should be "
+                     "greater then 0")
+    print(json.dumps(asyncio.run(run_load(args.url, args.requests,
+                                          args.connections, args.pipeline)),
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,37 @@
 import datetime
-import argparse
 import sys
-import logging
+import io
+import json
+import os
+import time
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple, OrderedDict
+
+
+# Heavy modules (argparse, logging, csv) and profiling are imported where
+# they are used, single calculation from command line doesn't need them
+_logger = None
+# Value of logging.DEBUG
+DEBUG = 10
+
+
+def get_logger():
+    """Return taxcalc logger, logging is imported on first call"""
+    global _logger
+    if _logger is None:
+        import logging
+        _logger = logging.getLogger(__name__)
+    return _logger
+
+
+def debug_enabled() -> bool:
+    """Return True if taxcalc debug messages are logged"""
+    # Nothing could enable DEBUG before logging is imported
+    if _logger is None and "logging" not in sys.modules:
+        return False
+    return get_logger().isEnabledFor(DEBUG)
 
 
 class CarEcoTaxProdYearError(Exception):
@@ -14,89 +44,366 @@ class CarEcoTaxHorsePowerError(Exception):
     pass
 
 
-class CarEcoTax:
-    """Class for car eco tax calculation"""
-    tax_per_hp = {
-        "from_0_to_50": {
-            "for_three_years": 2.5,
-            "per_additional_year": 0.5
-        },
-        "from_51_to_80": {
-            "for_three_years": 5,
-            "per_additional_year": 1
-        },
-        "from_81_to_100": {
-            "for_three_years": 7.5,
-            "per_additional_year": 1.5
-        },
-        "from_101_to_150": {
-            "for_three_years": 10,
-            "per_additional_year": 2
-        },
-        "from_151_to_200": {
-            "for_three_years": 12.5,
-            "per_additional_year": 2.5
-        },
-        "from_201_to_250": {
-            "for_three_years": 15,
-            "per_additional_year": 3
-        },
-        "from_251_to_300": {
-            "for_three_years": 17.5,
-            "per_additional_year": 3.5
-        },
-        "more_then_300": {
-            "for_three_years": 25,
-            "per_additional_year": 5
+class SystemClock:
+    """
+    Current local date. Year is recomputed only after next year start, so
+    year() is cheap enough for hot paths
+    """
+
+    def __init__(self) -> None:
+        self.current_year = None
+        self.next_year_at = 0.0
+
+    def today(self) -> datetime.date:
+        return datetime.date.today()
+
+    def year(self) -> int:
+        if time.time() >= self.next_year_at:
+            self.current_year = self.today().year
+            self.next_year_at = datetime.datetime(
+                self.current_year + 1, 1, 1).timestamp()
+        return self.current_year
+
+
+class FixedClock:
+    """Clock always returning as_of date or year"""
+
+    def __init__(self, as_of) -> None:
+        if isinstance(as_of, int):
+            as_of = datetime.date(as_of, 12, 31)
+        elif isinstance(as_of, datetime.datetime):
+            as_of = as_of.date()
+        self.as_of = as_of
+
+    def today(self) -> datetime.date:
+        return self.as_of
+
+    def year(self) -> int:
+        return self.as_of.year
+
+
+# Shared by calculator, cache and telegram bot
+CLOCK = SystemClock()
+
+
+def reference_year(as_of=None) -> int:
+    """Return year of as_of year, date or datetime, current year for None"""
+    if as_of is None:
+        return CLOCK.year()
+    if isinstance(as_of, int):
+        return as_of
+    return as_of.year
+
+
+def parse_as_of(value: str):
+    """Parse YYYY year or YYYY-MM-DD date of --as-of option"""
+    if value.isdigit():
+        return int(value)
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        import argparse
+        raise argparse.ArgumentTypeError(f"{value} should be year or "
+                                         f"YYYY-MM-DD date")
+
+
+def validate_car(production_year: int, horse_powers: int,
+                 as_of=None) -> tuple:
+    """
+    Verify production year and horse powers, return (production_year,
+    car_tax_age) where two digit production year is counted from 2000
+    """
+    # Verify production_year and horse_powers are integers and
+    # they both are greater then 0
+    if not isinstance(production_year, int) or production_year <= 0:
+        raise CarEcoTaxProdYearError("Production year should be integer "
+                                     "and greater then 0")
+    if not isinstance(horse_powers, int) or horse_powers <= 0:
+        raise CarEcoTaxHorsePowerError("Horse powers should be integer "
+                                       "and greater then 0")
+    # Allow use tow digit numbers if car is newer than 2000 year
+    if len(str(production_year)) <= 2:
+        production_year += 2000
+    elif len(str(production_year)) != 4:
+        raise CarEcoTaxProdYearError(f"{production_year} wrong "
+                                     f"production year")
+    # Tax is calculated as of given year or date, current one by default
+    current_year = reference_year(as_of)
+    # Raise exception if enter year is greater than current one
+    if production_year > current_year:
+        raise CarEcoTaxProdYearError("Production year could not "
+                                     "be greater than current")
+    age = current_year - production_year
+    # Calculate car tax age
+    if age > 8:
+        return production_year, 8
+    if age == 0:
+        return production_year, 1
+    # from 1 to 3 years tax calculation is the same
+    if age < 4:
+        return production_year, 3
+    return production_year, age
+
+
+class TaxRateTable:
+    """
+    Compiled tax_per_hp schedule: sorted bracket upper bounds searched with
+    bisect and precomputed per hp rate for every tax age
+    """
+    tax_ages = (1, 3, 4, 5, 6, 7, 8)
+
+    def __init__(self, tax_per_hp: dict) -> None:
+        self.tax_per_hp = tax_per_hp
+        self.brackets = tuple(tax_per_hp)
+        upper_bounds = [self.bracket_upper_bound(name)
+                        for name in self.brackets]
+        # Only the last bracket could be open, bounds should be ascending
+        if None in upper_bounds[:-1] or upper_bounds[-1] is not None \
+                or upper_bounds[:-1] != sorted(set(upper_bounds[:-1])):
+            raise ValueError(f"Wrong tax brackets: {self.brackets}")
+        self.upper_bounds = tuple(upper_bounds[:-1])
+        # Same formula as before: for_three_years rate changed by
+        # per_additional_year for every year after third one
+        self.rates = {
+            tax_age: tuple(rate["for_three_years"]
+                           + ((tax_age - 3) * rate["per_additional_year"])
+                           for rate in tax_per_hp.values())
+            for tax_age in self.tax_ages
         }
 
-    }
+    @staticmethod
+    def bracket_upper_bound(name: str):
+        """Return upper bound from from_X_to_Y or more_then_X bracket name"""
+        if name.startswith("more_then_"):
+            return None
+        return int(name.rsplit("_", 1)[1])
+
+    def bracket(self, horse_powers: int) -> int:
+        """Return index of horse powers bracket"""
+        return bisect_left(self.upper_bounds, horse_powers)
+
+    def rate(self, horse_powers: int, car_tax_age: int):
+        """Return tax per horse power"""
+        return self.rates[car_tax_age][self.bracket(horse_powers)]
+
+
+class TaxSchedule:
+    """
+    Versioned tax schedules compiled to rate tables, the table effective
+    as of date is the last one with effective_from not after it
+    """
+    format_version = 1
+
+    def __init__(self, data: dict) -> None:
+        if not isinstance(data, dict) or \
+                data.get("version") != self.format_version:
+            raise ValueError(f"Tax schedule should be version "
+                             f"{self.format_version}")
+        try:
+            schedules = sorted(
+                (datetime.date.fromisoformat(schedule["effective_from"]),
+                 schedule["tax_per_hp"])
+                for schedule in data["schedules"])
+        except (KeyError, TypeError) as schedule_error:
+            raise ValueError(f"Wrong tax schedule: {schedule_error!r}")
+        if not schedules:
+            raise ValueError("Tax schedule has no schedules")
+        self.data = data
+        self.effective_from = [effective_from
+                               for effective_from, _ in schedules]
+        if len(set(self.effective_from)) != len(self.effective_from):
+            raise ValueError("Tax schedules effective_from should differ")
+        try:
+            self.tables = [TaxRateTable(tax_per_hp)
+                           for _, tax_per_hp in schedules]
+        except (AttributeError, KeyError, TypeError) as schedule_error:
+            raise ValueError(f"Wrong tax_per_hp: {schedule_error!r}")
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as schedule_file:
+            return cls(json.load(schedule_file))
+
+    def table(self, as_of=None) -> TaxRateTable:
+        """
+        Return rate table effective as of year end, date or current date,
+        the first one for dates before it
+        """
+        if isinstance(as_of, int) and \
+                not datetime.MINYEAR <= as_of <= datetime.MAXYEAR:
+            raise CarEcoTaxProdYearError(f"{as_of} wrong year")
+        if len(self.tables) == 1:
+            return self.tables[0]
+        if as_of is None:
+            as_of = CLOCK.today()
+        elif isinstance(as_of, int):
+            as_of = datetime.date(as_of, 12, 31)
+        elif isinstance(as_of, datetime.datetime):
+            as_of = as_of.date()
+        index = bisect_right(self.effective_from, as_of) - 1
+        return self.tables[max(index, 0)]
+
+
+# Built-in schedule used when schedule file is absent
+DEFAULT_SCHEDULE = TaxSchedule({
+    "version": 1,
+    "schedules": [{
+        "effective_from": "2000-01-01",
+        "tax_per_hp": {
+            "from_0_to_50": {
+                "for_three_years": 2.5,
+                "per_additional_year": 0.5
+            },
+            "from_51_to_80": {
+                "for_three_years": 5,
+                "per_additional_year": 1
+            },
+            "from_81_to_100": {
+                "for_three_years": 7.5,
+                "per_additional_year": 1.5
+            },
+            "from_101_to_150": {
+                "for_three_years": 10,
+                "per_additional_year": 2
+            },
+            "from_151_to_200": {
+                "for_three_years": 12.5,
+                "per_additional_year": 2.5
+            },
+            "from_201_to_250": {
+                "for_three_years": 15,
+                "per_additional_year": 3
+            },
+            "from_251_to_300": {
+                "for_three_years": 17.5,
+                "per_additional_year": 3.5
+            },
+            "more_then_300": {
+                "for_three_years": 25,
+                "per_additional_year": 5
+            }
+        }
+    }]
+})
+
+
+class ScheduleReloader:
+    """
+    TaxSchedule of JSON file reloaded when file modification time changes
+    or after SIGHUP. New schedule replaces the old one by one assignment,
+    calculations in progress finish with the table they already have.
+    DEFAULT_SCHEDULE is used till file is created or when it is wrong
+    """
+    check_interval = 1.0
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.reload_requested = False
+        self.next_check_at = time.monotonic() + self.check_interval
+        self.file_version = self.stat()
+        self.schedule = DEFAULT_SCHEDULE
+        if self.file_version is not None:
+            try:
+                self.schedule = TaxSchedule.load(path)
+            except (OSError, ValueError) as schedule_error:
+                get_logger().error("Tax schedule %s is not loaded, using "
+                                   "built-in one: %s", path, schedule_error)
+
+    def stat(self):
+        """Return file version or None if file doesn't exist"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self) -> TaxSchedule:
+        """Return current schedule, reload it if file changed"""
+        now = time.monotonic()
+        if now >= self.next_check_at or self.reload_requested:
+            self.next_check_at = now + self.check_interval
+            self.reload(force=self.reload_requested)
+        return self.schedule
+
+    def reload(self, force: bool = True) -> bool:
+        """
+        Load schedule again if file changed or force is set, keep the old
+        one if new file is not valid. Returns True if schedule was replaced
+        """
+        self.reload_requested = False
+        try:
+            file_version = self.stat()
+            if not force and file_version == self.file_version:
+                return False
+            # Wrong file is reported once, not on every check
+            self.file_version = file_version
+            self.schedule = TaxSchedule.load(self.path)
+        except (OSError, ValueError) as schedule_error:
+            get_logger().error("Tax schedule %s is not reloaded: %s",
+                               self.path, schedule_error)
+            return False
+        get_logger().info("Tax schedule reloaded from %s", self.path)
+        return True
+
+    def install_sighup(self) -> None:
+        """Reload schedule on next check after SIGHUP"""
+        import signal
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.request_reload)
+
+    def request_reload(self, *args) -> None:
+        self.reload_requested = True
+
+
+# Loaded at import, TAX_SCHEDULE env var overrides bundled file
+SCHEDULES = ScheduleReloader(os.environ.get(
+    "TAX_SCHEDULE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 "tax_schedule.json")))
+
+
+def rate_table(as_of=None) -> TaxRateTable:
+    """Return rate table of current schedule effective as of date"""
+    return SCHEDULES.check().table(as_of)
+
+
+class TaxPerHp:
+    """
+    Read-only tax_per_hp of CarEcoTax: rates of instance table or of the
+    current schedule when read from class
+    """
+
+    def __get__(self, instance, owner=None) -> dict:
+        if instance is None:
+            return rate_table().tax_per_hp
+        return instance.rate_table.tax_per_hp
+
+    def __set__(self, instance, value) -> None:
+        raise AttributeError("tax_per_hp is read-only, rates are changed "
+                             "by tax schedule file")
+
+
+class CarEcoTax:
+    """Class for car eco tax calculation"""
+    __slots__ = ("production_year", "horse_powers", "car_tax_age",
+                 "rate_table", "tax")
+    tax_per_hp = TaxPerHp()
 
     def __init__(self, production_year: int, horse_powers: int,
-                 log=False) -> None:
-        # Configure log
-        if log:
-            logging.basicConfig(level=logging.DEBUG,
-                                format='%(asctime)s - '
-                                       '%(levelname)s - '
-                                       '%(message)s',
-                                datefmt='%d-%b-%y %H:%M:%S')
-        logging.debug(f"created new instance with {production_year} "
-                      f"production year and {horse_powers} horse powers")
-        # Verify production_year and horse_powers are integers and
-        # they both are greater then 0
-        if not isinstance(production_year, int) or production_year <= 0:
-            raise CarEcoTaxProdYearError("Production year should be integer "
-                                         "and greater then 0")
-        if not isinstance(horse_powers, int) or horse_powers <= 0:
-            raise CarEcoTaxHorsePowerError("Horse powers should be integer "
-                                           "and greater then 0")
-        # Allow use tow digit numbers if car is newer than 2000 year
-        if len(str(production_year)) <= 2:
-            self.production_year = production_year + 2000
-        elif len(str(production_year)) != 4:
-            raise CarEcoTaxProdYearError(f"{production_year} wrong "
-                                         f"production year")
-        else:
-            self.production_year = production_year
-        current_year = datetime.datetime.today().year
-        # Raise exception if enter year is greater than current one
-        if self.production_year > current_year:
-            raise CarEcoTaxProdYearError("Production year could not "
-                                         "be greater than current")
-        age = current_year - self.production_year
-        # Calculate car tax age
-        if age > 8:
-            self.car_tax_age = 8
-        elif age == 0:
-            self.car_tax_age = 1
-        # from 1 to 3 years tax calculation is the same
-        elif age in range(1, 4):
-            self.car_tax_age = 3
-        else:
-            self.car_tax_age = age
+                 log=False, as_of=None) -> None:
+        # log is kept for compatibility, logging is configured by main()
+        debug = debug_enabled()
+        if debug:
+            get_logger().debug("created new instance with %s production "
+                               "year and %s horse powers", production_year,
+                               horse_powers)
+        self.production_year, self.car_tax_age = validate_car(
+            production_year, horse_powers, as_of)
+        # Schedule is resolved once, reload doesn't change instance tax
+        self.rate_table = rate_table(as_of)
         self.horse_powers = horse_powers
-        logging.debug(f"set tax age to {self.car_tax_age}")
+        if debug:
+            get_logger().debug("set tax age to %s", self.car_tax_age)
         self.tax = 0
 
     def __str__(self):
@@ -108,70 +415,845 @@ class CarEcoTax:
         If it is possible will convert tax as integer and return
         """
         if isinstance(self.tax, float) and self.tax.is_integer():
-            logging.debug(f"{self.tax} converted to integer {int(self.tax)}")
+            if debug_enabled():
+                get_logger().debug("%s converted to integer %s", self.tax,
+                                   int(self.tax))
             return int(self.tax)
-        logging.debug(f"Cannot convert {self.tax} to integer")
+        if debug_enabled():
+            get_logger().debug("Cannot convert %s to integer", self.tax)
         return self.tax
 
     def calculate(self):
         """Calculate car eco tax"""
-        if self.horse_powers in range(0, 51):
-            tax_data = self.tax_per_hp["from_0_to_50"]
-        elif self.horse_powers in range(51, 81):
-            tax_data = self.tax_per_hp["from_51_to_80"]
-        elif self.horse_powers in range(81, 101):
-            tax_data = self.tax_per_hp["from_81_to_100"]
-        elif self.horse_powers in range(101, 151):
-            tax_data = self.tax_per_hp["from_101_to_150"]
-        elif self.horse_powers in range(151, 201):
-            tax_data = self.tax_per_hp["from_151_to_200"]
-        elif self.horse_powers in range(200, 251):
-            tax_data = self.tax_per_hp["from_201_to_250"]
-        elif self.horse_powers in range(250, 301):
-            tax_data = self.tax_per_hp["from_251_to_300"]
-        elif self.horse_powers > 300:
-            tax_data = self.tax_per_hp["more_then_300"]
-            logging.debug(f"Car have a more then 301 horse powers: "
-                          f"{self.horse_powers}")
-        self.tax = self.horse_powers * (tax_data["for_three_years"]
-                                        + ((self.car_tax_age - 3)
-                                           * (tax_data["per_additional_year"]))
-                                        )
+        table = self.rate_table
+        bracket = table.bracket(self.horse_powers)
+        if bracket == len(table.upper_bounds) and debug_enabled():
+            get_logger().debug("Car have a more then %s horse powers: %s",
+                               table.upper_bounds[-1], self.horse_powers)
+        self.tax = self.horse_powers * table.rates[self.car_tax_age][bracket]
         return self.try_convert_to_int()
 
+    def result(self):
+        """Calculate car eco tax and return it as TaxResult"""
+        amount = self.calculate()
+        return TaxResult(self.production_year, self.horse_powers,
+                         self.car_tax_age,
+                         self.rate_table.bracket(self.horse_powers), amount)
+
+    @classmethod
+    def calculate_many(cls, production_years, horse_powers, as_of=None):
+        """
+        Calculate car eco tax for many cars in one vectorized pass.
+        Requires numpy. Returns (taxes, errors) arrays, where errors marks
+        rows which would raise an exception in the scalar API and their
+        taxes are set to nan
+        """
+        import numpy as np
+        columns = cls._calculate_columns(np, production_years, horse_powers,
+                                         as_of)
+        return columns[4], columns[5]
+
+    @classmethod
+    def _calculate_columns(cls, np, production_years, horse_powers,
+                           as_of=None):
+        """
+        Return (years, hps, car_tax_ages, brackets, taxes, errors) arrays
+        of calculate_many
+        """
+        years, errors = cls._as_int_array(np, production_years)
+        hps, hp_errors = cls._as_int_array(np, horse_powers)
+        if years.shape != hps.shape:
+            raise ValueError("production_years and horse_powers should "
+                             "have the same shape")
+        current_year = reference_year(as_of)
+        # Same rules as in __init__: positive, two digit or four digit
+        # years which are not greater than current one
+        errors |= (years <= 0) | ((years >= 100) & (years < 1000)) \
+            | (years >= 10000)
+        years = np.where(years < 100, years + 2000, years)
+        errors |= years > current_year
+        errors |= hp_errors | (hps <= 0)
+        age = current_year - years
+        car_tax_age = np.where(age == 0, 1, np.clip(age, 3, 8))
+        table = rate_table(as_of)
+        brackets = np.searchsorted(table.upper_bounds, hps)
+        # Rows are indexed by tax age, unused 0 and 2 rows stay zero
+        rates = np.zeros((max(table.tax_ages) + 1, len(table.brackets)),
+                         dtype=np.float64)
+        for tax_age, tax_age_rates in table.rates.items():
+            rates[tax_age] = tax_age_rates
+        taxes = hps * rates[car_tax_age, brackets]
+        taxes[errors] = np.nan
+        return years, hps, car_tax_age, brackets, taxes, errors
+
+    @staticmethod
+    def _as_int_array(np, values):
+        """
+        Return values as int64 array and mask of non integer values or
+        integers out of int64 range
+        """
+        array = np.asarray(values)
+        if array.dtype.kind in "ib":
+            return array.astype(np.int64), np.zeros(array.shape, dtype=bool)
+        if array.dtype.kind == "u":
+            too_large = array > np.iinfo(np.int64).max
+            return np.where(too_large, 0, array).astype(np.int64), too_large
+        # Keep original python objects of mixed sequences
+        flat = np.asarray(values, dtype=object).ravel()
+        int64 = np.iinfo(np.int64)
+        not_int = np.fromiter((not isinstance(value, (int, np.integer))
+                               or not int64.min <= value <= int64.max
+                               for value in flat),
+                              dtype=bool, count=flat.size)
+        ints = np.fromiter((0 if bad else value
+                            for value, bad in zip(flat, not_int)),
+                           dtype=np.int64, count=flat.size)
+        return ints.reshape(array.shape), not_int.reshape(array.shape)
+
+
+# Immutable calculation result, bracket is index in TaxRateTable.brackets
+TaxResult = namedtuple("TaxResult", "year hp tax_age bracket amount")
+
+
+def calculate_tax(production_year: int, horse_powers: int,
+                  as_of=None, table: TaxRateTable = None) -> TaxResult:
+    """
+    Calculate car eco tax without CarEcoTax instance, by table effective
+    as of given date by default
+    """
+    year, car_tax_age = validate_car(production_year, horse_powers, as_of)
+    if table is None:
+        table = rate_table(as_of)
+    bracket = table.bracket(horse_powers)
+    amount = horse_powers * table.rates[car_tax_age][bracket]
+    if isinstance(amount, float) and amount.is_integer():
+        amount = int(amount)
+    return TaxResult(year, horse_powers, car_tax_age, bracket, amount)
+
+
+class TaxResultBatch:
+    """
+    TaxResult values kept as struct of arrays, 20 bytes per result instead
+    of python object per result and per field
+    """
+    __slots__ = ("years", "hps", "tax_ages", "brackets", "amounts")
+
+    def __init__(self, results=()) -> None:
+        self.years = array("H")
+        self.hps = array("q")
+        self.tax_ages = array("B")
+        self.brackets = array("B")
+        self.amounts = array("d")
+        self.extend(results)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __getitem__(self, index: int) -> TaxResult:
+        amount = self.amounts[index]
+        if amount.is_integer():
+            amount = int(amount)
+        return TaxResult(self.years[index], self.hps[index],
+                         self.tax_ages[index], self.brackets[index], amount)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self) -> int:
+        """Size of result arrays in bytes"""
+        return sum(len(column) * column.itemsize
+                   for column in (self.years, self.hps, self.tax_ages,
+                                  self.brackets, self.amounts))
+
+    def append(self, result: TaxResult) -> None:
+        self.years.append(result.year)
+        self.hps.append(result.hp)
+        self.tax_ages.append(result.tax_age)
+        self.brackets.append(result.bracket)
+        self.amounts.append(result.amount)
+
+    def extend(self, results) -> None:
+        for result in results:
+            self.append(result)
+
+    def calculate(self, production_years, horse_powers, as_of=None) -> list:
+        """
+        Calculate and append results of many cars, vectorized with numpy
+        when it is installed. Returns indexes of rejected cars
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            return self._calculate_each(production_years, horse_powers,
+                                        as_of)
+        years, hps, car_tax_ages, brackets, taxes, errors = \
+            CarEcoTax._calculate_columns(np, production_years,
+                                         horse_powers, as_of)
+        valid = ~errors
+        self.years.frombytes(years[valid].astype(np.uint16).tobytes())
+        self.hps.frombytes(hps[valid].astype(np.int64).tobytes())
+        self.tax_ages.frombytes(
+            car_tax_ages[valid].astype(np.uint8).tobytes())
+        self.brackets.frombytes(brackets[valid].astype(np.uint8).tobytes())
+        self.amounts.frombytes(taxes[valid].astype(np.float64).tobytes())
+        return np.flatnonzero(errors).tolist()
+
+    def _calculate_each(self, production_years, horse_powers,
+                        as_of=None) -> list:
+        rejected = []
+        for index, (production_year, horse_power) in enumerate(
+                zip(production_years, horse_powers)):
+            try:
+                self.append(calculate_tax(production_year, horse_power,
+                                          as_of))
+            except (CarEcoTaxProdYearError, CarEcoTaxHorsePowerError):
+                rejected.append(index)
+        return rejected
+
+
+class TaxCache:
+    """
+    Bounded LRU cache of CarEcoTax calculations keyed on normalized
+    production year, horse powers, reference year and rate table. Whole
+    cache is dropped when current year changes
+    """
+
+    def __init__(self, maxsize: int = 16384, current_year=None) -> None:
+        self.maxsize = maxsize
+        self.current_year = current_year or CLOCK.year
+        self.entries = OrderedDict()
+        self.year = None
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = threading.Lock()
+
+    def calculate(self, production_year: int, horse_powers: int,
+                  as_of=None):
+        """Return CarEcoTax(production_year, horse_powers, as_of) tax"""
+        # Wrong types are never cached, CarEcoTax raises exception for them
+        if type(production_year) is not int or \
+                type(horse_powers) is not int:
+            return CarEcoTax(production_year, horse_powers,
+                             as_of=as_of).calculate()
+        year = self.current_year()
+        normalized_year = production_year + 2000 \
+            if 0 < production_year < 100 else production_year
+        # Reloaded or newly effective schedule has new table, so old
+        # entries are not hit anymore and are evicted by LRU
+        table = rate_table(as_of)
+        key = (normalized_year, horse_powers,
+               year if as_of is None else reference_year(as_of), table)
+        with self.lock:
+            if year != self.year:
+                self.entries.clear()
+                self.year = year
+            tax = self.entries.get(key)
+            if tax is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return tax
+            self.misses += 1
+        # Only successful calculations are cached
+        tax = calculate_tax(production_year, horse_powers, key[2],
+                            table).amount
+        with self.lock:
+            self.entries[key] = tax
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return tax
+
+    def stats(self) -> dict:
+        """Return hits, misses, evictions, size and hit_rate"""
+        requests = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hit_rate": self.hits / requests if requests else 0.0}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits, self.misses, self.evictions = 0, 0, 0
+
+
+# Shared by bulk mode and telegram bot
+TAX_CACHE = TaxCache()
+
+# Record fields of bulk mode input, named same as CLI options
+BULK_FIELDS = ("prod_year", "horsepowers")
+
+
+class BulkRecordError(Exception):
+    """Exception for malformed bulk mode record"""
+    pass
+
+
+def detect_bulk_format(path: str) -> str:
+    """Return jsonl for JSON Lines file extensions and csv otherwise"""
+    if path.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "csv"
+
+
+def bulk_record_value(record: dict, field: str) -> int:
+    """Return record field as integer or raise BulkRecordError"""
+    try:
+        value = record[field]
+    except KeyError:
+        raise BulkRecordError(f"{field} field is missing")
+    if isinstance(value, str):
+        # Only decimal digits as tax API accepts, not "1_000" or " +5"
+        if not (value.isascii() and value.isdigit()):
+            raise BulkRecordError(f"{field} should be integer: {value!r}")
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise BulkRecordError(f"{field} should be integer: {value!r}")
+    return value
+
+
+def is_undecodable(line: str) -> bool:
+    """
+    Check if line read with surrogateescape error handler has bytes which
+    are not UTF-8
+    """
+    if line.isascii():
+        return False
+    try:
+        line.encode("utf-8")
+    except UnicodeEncodeError:
+        return True
+    return False
+
+
+def escape_undecodable(line: str) -> str:
+    """Return line with not UTF-8 bytes replaced by \\xNN escapes"""
+    return line.encode("utf-8", "surrogateescape").decode("utf-8",
+                                                          "backslashreplace")
+
+
+def parse_bulk_lines(lines, input_format: str, header=None):
+    """
+    Generator of (line, record) pairs, record is dict or BulkRecordError.
+    header is list of csv column names. Lines could be read with
+    surrogateescape, records with not UTF-8 bytes are errors
+    """
+    if input_format == "jsonl":
+        for line in lines:
+            if not line.strip():
+                continue
+            if is_undecodable(line):
+                yield line, BulkRecordError("Record is not valid UTF-8")
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as json_error:
+                record = BulkRecordError(f"Malformed JSON: {json_error}")
+            else:
+                if not isinstance(record, dict):
+                    record = BulkRecordError("Record should be JSON object")
+            yield line, record
+        return
+    import csv
+    # Physical lines of current record, quoted fields could have line
+    # breaks. csv.reader reads only lines of the record it returns
+    record_lines = []
+    # Set when any line of current record is not UTF-8
+    undecodable = [False]
+
+    def tracked_lines():
+        for line in lines:
+            record_lines.append(line)
+            if is_undecodable(line):
+                undecodable[0] = True
+            yield line
+
+    def record_text() -> str:
+        text = record_lines[0] if len(record_lines) == 1 \
+            else "".join(record_lines)
+        record_lines.clear()
+        undecodable[0] = False
+        return text
+
+    reader = csv.reader(tracked_lines())
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as csv_error:
+            # Reader skips the rest of wrong line and continues
+            yield record_text(), BulkRecordError(f"Malformed CSV: "
+                                                 f"{csv_error}")
+            continue
+        if undecodable[0]:
+            yield record_text(), BulkRecordError("Record is not valid "
+                                                 "UTF-8")
+            continue
+        line = record_text()
+        if not row:
+            continue
+        if len(row) != len(header):
+            record = BulkRecordError(f"Expected {len(header)} columns, "
+                                     f"got {len(row)}")
+        else:
+            record = dict(zip(header, row))
+        yield line, record
+
+
+def calculate_bulk_lines(lines, input_format: str, header=None,
+                         as_of=None):
+    """
+    Generator of (output_line, reject_line) pairs, one of them is None.
+    csv output is input line with appended tax column, jsonl output is
+    input record with tax key, rejects are JSON Lines with error and
+    original record. First csv line is used as header if header isn't given.
+    Taxes are calculated as of given year or date, current one by default
+    """
+    lines = iter(lines)
+    if input_format == "csv" and header is None:
+        header_line = next(lines, None)
+        if header_line is None:
+            return
+        import csv
+        header_line = escape_undecodable(header_line)
+        header = next(csv.reader([header_line]), [])
+        yield header_line.rstrip("\r\n") + ",tax\n", None
+    from profiling import TRACER
+    records = parse_bulk_lines(lines, input_format, header)
+    record_value, calculate = bulk_record_value, TAX_CACHE.calculate
+    format_line = format_bulk_line
+    # Stages are wrapped only when traced, so rows cost the same otherwise
+    if TRACER.enabled:
+        records = TRACER.wrap_iter("parse", records)
+        record_value = TRACER.wrap("validate", record_value)
+        calculate = TRACER.wrap("lookup", calculate)
+        format_line = TRACER.wrap("format", format_line)
+    for line, record in records:
+        stripped_line = line.rstrip("\r\n")
+        try:
+            if isinstance(record, BulkRecordError):
+                raise record
+            tax = calculate(record_value(record, "prod_year"),
+                            record_value(record, "horsepowers"), as_of)
+        except (BulkRecordError, CarEcoTaxProdYearError,
+                CarEcoTaxHorsePowerError) as record_error:
+            if not stripped_line.isascii():
+                stripped_line = escape_undecodable(stripped_line)
+            reject = {"error": str(record_error), "record": stripped_line}
+            yield None, json.dumps(reject, ensure_ascii=False) + "\n"
+            continue
+        yield format_line(input_format, stripped_line, record, tax), None
+
+
+def format_bulk_line(input_format: str, stripped_line: str, record: dict,
+                     tax) -> str:
+    """Return output line of calculated bulk record"""
+    if input_format == "jsonl":
+        record["tax"] = tax
+        return json.dumps(record, ensure_ascii=False) + "\n"
+    return f"{stripped_line},{tax}\n"
+
+
+def write_bulk_results(results, output, rejects, chunk_size: int) -> tuple:
+    """
+    Write calculate_bulk_lines results by chunks of chunk_size lines and
+    return (written, rejected) counts
+    """
+    from profiling import TRACER
+    written, rejected = 0, 0
+    output_buffer, rejects_buffer = [], []
+    for output_line, reject_line in results:
+        if output_line is not None:
+            output_buffer.append(output_line)
+            written += 1
+            if len(output_buffer) >= chunk_size:
+                with TRACER.span("write"):
+                    output.writelines(output_buffer)
+                output_buffer.clear()
+        else:
+            rejects_buffer.append(reject_line)
+            rejected += 1
+            if len(rejects_buffer) >= chunk_size:
+                with TRACER.span("write"):
+                    rejects.writelines(rejects_buffer)
+                rejects_buffer.clear()
+    with TRACER.span("write"):
+        output.writelines(output_buffer)
+        rejects.writelines(rejects_buffer)
+        output.flush()
+        rejects.flush()
+    return written, rejected
+
+
+# Statistics of one bulk_shards shard, trace is stage totals of traced run
+ShardStats = namedtuple("ShardStats",
+                        "index start end written rejected seconds trace")
+
+
+def shard_byte_ranges(path: str, shards: int, start: int = 0,
+                      quoted: bool = False) -> list:
+    """
+    Split file from start offset to the end into up to shards (start, end)
+    byte ranges, every range begins at the line start. With quoted ranges
+    don't split csv quoted fields with line breaks: quotes before range
+    start are counted and their number should be even
+    """
+    size = os.path.getsize(path)
+    bounds = [start]
+    # Quotes before position of quoted scan
+    position, quotes = start, 0
+    with open(path, "rb") as file:
+        for index in range(1, shards):
+            offset = start + (size - start) * index // shards
+            if offset <= bounds[-1]:
+                continue
+            # Move to the start of next line unless offset is already there
+            file.seek(offset - 1)
+            file.readline()
+            offset = file.tell()
+            if quoted and offset < size:
+                file.seek(position)
+                remaining = offset - position
+                while remaining > 0:
+                    block = file.read(min(remaining, 1 << 20))
+                    quotes += block.count(b'"')
+                    remaining -= len(block)
+                # Offset is inside quoted field, try next lines
+                while quotes % 2 and offset < size:
+                    line = file.readline()
+                    quotes += line.count(b'"')
+                    offset += len(line)
+                position = offset
+            if offset >= size:
+                break
+            if offset > bounds[-1]:
+                bounds.append(offset)
+    if size > bounds[-1]:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def calculate_shard(path: str, index: int, start: int, end: int,
+                    input_format: str, header=None, as_of=None,
+                    trace: bool = False) -> tuple:
+    """
+    Calculate byte range of bulk file and return (output, rejects, stats).
+    Runs in worker processes, so uses only this module. Stage totals of
+    the shard are returned in stats when trace is on
+    """
+    started = time.perf_counter()
+    from profiling import TRACER
+    if trace:
+        TRACER.enabled = True
+        # Worker process is reused for next shards, return only this one
+        traced_before = dict(TRACER.totals)
+    with open(path, "rb") as file:
+        file.seek(start)
+        # Not UTF-8 records are rejected as in single process
+        text = file.read(end - start).decode("utf-8", "surrogateescape")
+    output, rejects = io.StringIO(), io.StringIO()
+    results = calculate_bulk_lines(io.StringIO(text, newline=""),
+                                   input_format, header, as_of)
+    written, rejected = write_bulk_results(results, output, rejects,
+                                           chunk_size=1000)
+    shard_trace = None
+    if trace:
+        shard_trace = {}
+        for name, (seconds, count) in TRACER.totals.items():
+            seconds_before, count_before = traced_before.get(name, (0.0, 0))
+            if count > count_before:
+                shard_trace[name] = (seconds - seconds_before,
+                                     count - count_before)
+    stats = ShardStats(index, start, end, written, rejected,
+                       time.perf_counter() - started, shard_trace)
+    return output.getvalue(), rejects.getvalue(), stats
+
+
+def merge_shard_trace(result: tuple) -> tuple:
+    """Add stage totals of calculate_shard result to TRACER"""
+    from profiling import TRACER
+    if result[2].trace:
+        TRACER.merge(result[2].trace)
+    return result
+
+
+def bulk_shards(path: str, input_format: str, workers: int,
+                shards: int = None, as_of=None):
+    """
+    Calculate bulk file in worker processes by byte range shards.
+    Generator of (output, rejects, stats) in original order, first item is
+    csv header line with None stats. Output is the same as
+    calculate_bulk_lines output for the whole file. Stage totals of
+    workers are added to TRACER when it is enabled
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from profiling import TRACER
+    # Fix reference date, so all shards use the same one as single process
+    as_of = CLOCK.today() if as_of is None else as_of
+    start, header = 0, None
+    if input_format == "csv":
+        with open(path, "rb") as file:
+            header_bytes = file.readline()
+        if not header_bytes:
+            return
+        start = len(header_bytes)
+        header_line = escape_undecodable(
+            header_bytes.decode("utf-8", "surrogateescape"))
+        import csv
+        header = next(csv.reader([header_line]), [])
+        yield header_line.rstrip("\r\n") + ",tax\n", "", None
+    # Quotes of csv are counted in the whole file, it is much faster than
+    # calculation of it
+    ranges = shard_byte_ranges(path, shards or workers * 4, start,
+                               quoted=input_format == "csv")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep limited number of shards in flight to bound memory
+        pending = deque()
+        for index, (shard_start, shard_end) in enumerate(ranges):
+            pending.append(executor.submit(calculate_shard, path, index,
+                                           shard_start, shard_end,
+                                           input_format, header, as_of,
+                                           TRACER.enabled))
+            if len(pending) >= workers * 2:
+                yield merge_shard_trace(pending.popleft().result())
+        while pending:
+            yield merge_shard_trace(pending.popleft().result())
+
+
+def bulk_main(args) -> int:
+    """Run bulk mode of CLI and return exit code"""
+    input_format = args.format or detect_bulk_format(args.input)
+    opened = []
+    try:
+        # Not UTF-8 records are rejected, they don't stop the run
+        if args.input == "-":
+            source = sys.stdin
+            source.reconfigure(errors="surrogateescape")
+        elif args.workers > 1:
+            source = None
+        else:
+            source = open(args.input, encoding="utf-8",
+                          errors="surrogateescape", newline="")
+            opened.append(source)
+        output = sys.stdout
+        if args.output and args.output != "-":
+            output = open(args.output, "w", encoding="utf-8", newline="")
+            opened.append(output)
+        rejects = sys.stderr
+        if args.rejects:
+            rejects = open(args.rejects, "w", encoding="utf-8",
+                           newline="")
+            opened.append(rejects)
+        if args.workers > 1:
+            written, rejected = 0, 0
+            for shard_output, shard_rejects, stats in bulk_shards(
+                    args.input, input_format, args.workers,
+                    as_of=args.as_of):
+                output.write(shard_output)
+                rejects.write(shard_rejects)
+                if stats is None:
+                    written += 1
+                    continue
+                written += stats.written
+                rejected += stats.rejected
+                if args.stats:
+                    rows = stats.written + stats.rejected
+                    print(f"shard {stats.index}: {rows} rows in "
+                          f"{stats.seconds:.3f}s "
+                          f"({rows / max(stats.seconds, 1e-9):.0f} rows/s)",
+                          file=sys.stderr)
+            output.flush()
+            rejects.flush()
+        else:
+            results = calculate_bulk_lines(source, input_format,
+                                           as_of=args.as_of)
+            written, rejected = write_bulk_results(results, output, rejects,
+                                                   args.chunk_size)
+            if args.stats:
+                print(f"tax cache: {TAX_CACHE.stats()}", file=sys.stderr)
+    except OSError as file_error:
+        print(file_error, file=sys.stderr)
+        return 1
+    finally:
+        for file in opened:
+            file.close()
+    if debug_enabled():
+        get_logger().debug("Bulk mode wrote %s lines, rejected %s", written,
+                           rejected)
+    return 0
+
+
+def serve_lines(lines, as_of=None):
+    """
+    Generator of answers to "prod_year horsepowers" query lines, one line
+    per query: tax or error message after "error: "
+    """
+    for line in lines:
+        fields = line.replace(",", " ").split()
+        try:
+            production_year, horse_powers = map(int, fields)
+        except ValueError:
+            yield f"error: expected production year and horse powers, " \
+                  f"got {line.strip()!r}\n"
+            continue
+        try:
+            tax = TAX_CACHE.calculate(production_year, horse_powers, as_of)
+        except (CarEcoTaxProdYearError,
+                CarEcoTaxHorsePowerError) as car_error:
+            yield f"error: {car_error}\n"
+            continue
+        yield f"{tax}\n"
+
+
+def serve_main(as_of=None) -> int:
+    """Answer queries from stdin till it is closed"""
+    try:
+        for answer in serve_lines(sys.stdin, as_of):
+            sys.stdout.write(answer)
+            # Caller waits for answer before next query
+            sys.stdout.flush()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    return 0
+
+
+def single_main(production_year: int, horse_powers: int, as_of=None) -> int:
+    """Print tax of one car or error message"""
+    try:
+        tax = CarEcoTax(production_year, horse_powers, as_of=as_of)
+        print(tax.calculate())
+        return 0
+    except CarEcoTaxProdYearError as prod_year_error:
+        print(prod_year_error)
+        return 1
+    except CarEcoTaxHorsePowerError as hp_error:
+        print(hp_error)
+        return 1
+
+
+# Options of "-p N -y N" call handled without argparse
+SIMPLE_OPTIONS = {"-p": "horsepowers", "--horsepowers": "horsepowers",
+                  "-y": "prod_year", "--prod-year": "prod_year"}
+
+
+def parse_simple_args(argv: list):
+    """
+    Return (prod_year, horsepowers) of plain "-p N -y N" arguments or None
+    if argparse is needed
+    """
+    if len(argv) != 4:
+        return None
+    values = {}
+    for option, value in (argv[0:2], argv[2:4]):
+        name = SIMPLE_OPTIONS.get(option)
+        if name is None or name in values:
+            return None
+        try:
+            values[name] = int(value)
+        except ValueError:
+            return None
+    return values["prod_year"], values["horsepowers"]
+
 
 def main():
+    simple_args = parse_simple_args(sys.argv[1:])
+    if simple_args is not None:
+        sys.exit(single_main(*simple_args))
+    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--horsepowers", "-p",
                         type=int,
                         nargs=1,
-                        required=True,
                         help="Horse powers of machine")
     parser.add_argument("--prod-year", "-y",
                         type=int,
                         nargs=1,
-                        required=True,
                         help="Year of production")
+    parser.add_argument("--input", "-i",
+                        metavar="FILE",
+                        help="bulk mode: CSV or JSON Lines file with "
+                             "prod_year and horsepowers fields, "
+                             "- for stdin")
+    parser.add_argument("--output", "-o",
+                        metavar="FILE",
+                        help="bulk mode output file, stdout by default")
+    parser.add_argument("--rejects",
+                        metavar="FILE",
+                        help="bulk mode malformed rows file, "
+                             "stderr by default")
+    parser.add_argument("--format",
+                        choices=["csv", "jsonl"],
+                        help="bulk mode input format, detected by "
+                             "file extension by default")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=1000,
+                        help="bulk mode number of lines per buffered write")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="bulk mode number of worker processes, "
+                             "input should be a file")
+    parser.add_argument("--stats",
+                        action='store_true',
+                        default=False,
+                        help="bulk mode print per shard throughput "
+                             "or tax cache stats to stderr")
+    parser.add_argument("--as-of",
+                        type=parse_as_of,
+                        help="calculate tax as of YYYY year or YYYY-MM-DD "
+                             "date, current date by default")
+    parser.add_argument("--serve",
+                        action='store_true',
+                        default=False,
+                        help="answer \"prod_year horsepowers\" queries "
+                             "from stdin line by line")
     parser.add_argument("--debug",
                         action='store_true',
                         dest='debug',
                         default=False,
                         help="turn on debug mode")
+    from profiling import add_profile_arguments
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    car_age = args.prod_year[0]
-    car_horse_powers = args.horsepowers[0]
-    debug = args.debug
-
+    if args.debug:
+        import logging
+        logging.basicConfig(level=logging.DEBUG,
+                            format='%(asctime)s - '
+                                   '%(levelname)s - '
+                                   '%(message)s',
+                            datefmt='%d-%b-%y %H:%M:%S')
+    if args.input:
+        if args.chunk_size <= 0:
+            parser.error("--chunk-size should be greater then 0")
+        if args.workers <= 0:
+            parser.error("--workers should be greater then 0")
+        if args.workers > 1 and args.input == "-":
+            parser.error("--workers requires --input file")
+        if args.workers > 1 and args.profile:
+            parser.error("--profile covers only one process, "
+                         "use it with --workers 1")
+    elif not args.serve and None in (args.horsepowers, args.prod_year):
+        parser.error("--horsepowers and --prod-year are required "
+                     "without --input or --serve")
+    from profiling import start_profiling
+    profiler = start_profiling(args, "taxcalc")
     try:
-        tax = CarEcoTax(car_age, car_horse_powers, debug)
-        print(tax.calculate())
-        sys.exit(0)
-    except CarEcoTaxProdYearError as prod_year_error:
-        print(prod_year_error)
-        sys.exit(1)
-    except CarEcoTaxHorsePowerError as hp_error:
-        print(hp_error)
-        sys.exit(1)
+        if args.input:
+            exit_code = bulk_main(args)
+        elif args.serve:
+            exit_code = serve_main(args.as_of)
+        else:
+            exit_code = single_main(args.prod_year[0], args.horsepowers[0],
+                                    args.as_of)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    sys.exit(exit_code)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,153 @@
+import sys
+import argparse
+import json
+import mmap
+import struct
+from array import array
+from taxcalc import SCHEDULES
+from taxcalc import TaxSchedule
+from taxcalc import reference_year
+from taxcalc import validate_car
+
+
+# File starts with magic, format version and length of JSON header,
+# float64 taxes follow JSON header aligned to 8 bytes
+MAGIC = b"CETX"
+FORMAT_VERSION = 1
+PREFIX = struct.Struct("<4sHI")
+# Car ages 0..8, every car older than 8 years has the same tax
+AGES = 9
+
+
+def table_offset(header_size: int) -> int:
+    """Return offset of taxes after prefix and header of header_size"""
+    return (PREFIX.size + header_size + 7) // 8 * 8
+
+
+def export_table(path: str, first_tax_year: int, last_tax_year: int,
+                 max_hp: int, schedule: TaxSchedule = None) -> int:
+    """
+    Write taxes of every tax year, car age and hp from 1 to max_hp to
+    binary file, return number of taxes. Current schedule is used by
+    default
+    """
+    if first_tax_year > last_tax_year or max_hp <= 0:
+        raise ValueError("Wrong tax years or max hp")
+    if schedule is None:
+        schedule = SCHEDULES.check()
+    taxes = array("d")
+    for tax_year in range(first_tax_year, last_tax_year + 1):
+        rate_table = schedule.table(tax_year)
+        for age in range(AGES):
+            _, tax_age = validate_car(tax_year - age, 1, tax_year)
+            rates = rate_table.rates[tax_age]
+            taxes.extend(hp * rates[rate_table.bracket(hp)]
+                         for hp in range(1, max_hp + 1))
+    header = json.dumps({
+        "reference_year": reference_year(),
+        "first_tax_year": first_tax_year,
+        "last_tax_year": last_tax_year,
+        "max_hp": max_hp,
+        "byteorder": sys.byteorder,
+        "schedule": schedule.data
+    }).encode("utf-8")
+    offset = table_offset(len(header))
+    with open(path, "wb") as table_file:
+        table_file.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        table_file.write(header)
+        table_file.write(b"\0" * (offset - PREFIX.size - len(header)))
+        taxes.tofile(table_file)
+    return len(taxes)
+
+
+class TaxTable:
+    """
+    Read only memory mapped table written by export_table. Lookups read
+    tax from page cache shared by all processes mapping the same file
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as table_file:
+            self.mmap = mmap.mmap(table_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        try:
+            magic, version, header_size = PREFIX.unpack_from(self.mmap)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not tax table of version "
+                                 f"{FORMAT_VERSION}")
+            offset = table_offset(header_size)
+            self.header = json.loads(
+                self.mmap[PREFIX.size:PREFIX.size + header_size])
+            if self.header["byteorder"] != sys.byteorder:
+                raise ValueError(f"{path} byte order is "
+                                 f"{self.header['byteorder']}")
+            self.first_tax_year = self.header["first_tax_year"]
+            self.last_tax_year = self.header["last_tax_year"]
+            self.max_hp = self.header["max_hp"]
+            self.taxes = memoryview(self.mmap)[offset:].cast("d")
+            tax_years = self.last_tax_year - self.first_tax_year + 1
+            if len(self.taxes) != tax_years * AGES * self.max_hp:
+                self.taxes.release()
+                raise ValueError(f"{path} is truncated")
+        except (struct.error, ValueError, KeyError, TypeError):
+            self.mmap.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, production_year: int, horse_powers: int, as_of=None):
+        """
+        Return CarEcoTax(production_year, horse_powers, as_of) tax or None
+        if tax year or horse powers are out of table
+        """
+        tax_year = reference_year(as_of)
+        production_year, _ = validate_car(production_year, horse_powers,
+                                          tax_year)
+        if not self.first_tax_year <= tax_year <= self.last_tax_year \
+                or horse_powers > self.max_hp:
+            return None
+        age = min(tax_year - production_year, AGES - 1)
+        tax = self.taxes[((tax_year - self.first_tax_year) * AGES + age)
+                         * self.max_hp + horse_powers - 1]
+        return int(tax) if tax.is_integer() else tax
+
+    def close(self) -> None:
+        self.taxes.release()
+        self.mmap.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export taxes of every tax year, car age and hp to "
+                    "binary table")
+    parser.add_argument("--output", "-o",
+                        required=True,
+                        help="table file")
+    parser.add_argument("--first-year",
+                        type=int,
+                        default=reference_year(),
+                        help="first tax year, current one by default")
+    parser.add_argument("--last-year",
+                        type=int,
+                        help="last tax year, first one by default")
+    parser.add_argument("--max-hp",
+                        type=int,
+                        default=1000,
+                        help="max horse powers in table")
+    args = parser.parse_args()
+    last_year = args.last_year or args.first_year
+    try:
+        taxes = export_table(args.output, args.first_year, last_year,
+                             args.max_hp)
+    except (ValueError, OSError) as export_error:
+        print(export_error, file=sys.stderr)
+        sys.exit(1)
+    print(f"{taxes} taxes written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
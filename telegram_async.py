@@ -0,0 +1,183 @@
+import sys
+import logging
+import asyncio
+import os
+from urllib.parse import urlsplit
+from asynchttp import ConnectionPool
+from asynchttp import HTTPError
+from telegram_bot import TelegramBot
+from telegram_bot import TelegramBotApiError
+from telegram_bot import TelegramRateLimitError
+from telegram_bot import check_api_response
+from telegram_bot import TELEGRAM_API_URL
+from chatstore import SQLiteStorage
+from metrics import start_http_server
+from taxcalc import SCHEDULES
+from profiling import TRACER
+from telegram_bot import API_ERRORS
+from telegram_bot import API_REQUEST_SECONDS
+
+
+class AsyncTelegramBot(TelegramBot):
+    """
+    TelegramBot running on asyncio: long polling getUpdates, keep-alive
+    connection pool and concurrent sendMessage calls of outbound scheduler
+    """
+
+    def __init__(self, token, api_url=TELEGRAM_API_URL, poll_timeout=25,
+                 max_concurrent_sends=16, storage=None):
+        super().__init__(token, api_url, storage)
+        self.poll_timeout = poll_timeout
+        self.max_concurrent_sends = max_concurrent_sends
+        self.get_updates_path = urlsplit(self.api_get_updates_url).path
+        self.send_message_path = urlsplit(self.api_send_message_url).path
+        # One connection for long polling and one per concurrent send
+        self.client = ConnectionPool(api_url, size=max_concurrent_sends + 1,
+                                     headers={"User-Agent": "AutoEcoTaxBot"})
+        self.send_slots = None
+        # Set when messages are submitted or sends are finished
+        self.outbound_ready = None
+
+    async def api_call(self, path: str, payload: dict, timeout: float):
+        """Make Telegram API call and return result if it was successful"""
+        method = path.rsplit("/", 1)[-1]
+        try:
+            with API_REQUEST_SECONDS.labels(method).time(), \
+                    TRACER.span("http"):
+                response = await self.client.post_json(path, payload,
+                                                       timeout=timeout)
+        except (HTTPError, OSError, ValueError, asyncio.TimeoutError):
+            API_ERRORS.labels(method).inc()
+            raise
+        logging.debug(f"Payload: {payload}")
+        logging.debug(f"Response: {response}")
+        return check_api_response(method, response)
+
+    async def get_updates_async(self) -> None:
+        """Long poll updates from telegram"""
+        # Chats with not replied message restored from storage are
+        # processed next cycle, don't wait for new updates then
+        timeout = self.poll_timeout
+        if self.sessions.has_ready():
+            timeout = 0
+        payload = {
+            "offset": self.offset,
+            "timeout": timeout
+        }
+        self.updates = await self.api_call(self.get_updates_path, payload,
+                                           timeout + 10)
+        logging.debug(f"All updates from telegram API: {self.updates}")
+        if self.updates:
+            self.offset = self.updates[-1]["update_id"] + 1
+            logging.info(f"Offset updated to {self.offset}")
+
+    def submit_message(self, chat_id, payload: dict,
+                       created_at: float) -> None:
+        """Queue message, it is sent by send_loop"""
+        self.start_outbound().submit(chat_id, payload, created_at)
+        if self.outbound_ready is not None:
+            self.outbound_ready.set()
+
+    async def send_outbound(self, message) -> None:
+        """Send message of scheduler and report result to it"""
+        try:
+            sent_response = await self.api_call(self.send_message_path,
+                                                message.payload, timeout=30)
+        except TelegramRateLimitError as rate_limit:
+            logging.warning(f"Rate limited, retry after "
+                            f"{rate_limit.retry_after}s")
+            self.outbound.rate_limited(message, rate_limit.retry_after)
+        # Any error is a failed attempt, otherwise chat stays in flight
+        # and its next replies are never sent
+        except Exception as api_error:
+            logging.error(f"Failed sent message to {message.chat_id} chat "
+                          f"id, attempt {message.attempts + 1}: {api_error}")
+            if not self.outbound.failed(message):
+                self.reply_dropped(message)
+        else:
+            self.outbound.sent(message)
+            self.reply_sent(message, sent_response)
+        finally:
+            self.send_slots.release()
+            self.outbound_ready.set()
+
+    async def send_loop(self) -> None:
+        """Send queued messages when scheduler allows, till cancelled"""
+        self.send_slots = asyncio.Semaphore(self.max_concurrent_sends)
+        self.outbound_ready = asyncio.Event()
+        outbound = self.start_outbound()
+        sends = set()
+        try:
+            while True:
+                await self.send_slots.acquire()
+                message, wait = outbound.next_message()
+                if message is None:
+                    self.send_slots.release()
+                    self.outbound_ready.clear()
+                    try:
+                        await asyncio.wait_for(self.outbound_ready.wait(),
+                                               wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                send = asyncio.ensure_future(self.send_outbound(message))
+                sends.add(send)
+                send.add_done_callback(sends.discard)
+        finally:
+            for send in sends:
+                send.cancel()
+
+    async def run_async(self) -> None:
+        """One polling cycle: get updates, process chats and reply"""
+        try:
+            await self.get_updates_async()
+        # ValueError and KeyError are not JSON or malformed responses, e.g.
+        # error page of proxy
+        except (TelegramBotApiError, HTTPError, OSError, ValueError,
+                KeyError, asyncio.TimeoutError) as bot_api_error:
+            logging.error(bot_api_error)
+            self.updates = []
+            # Don't flood API while it is unavailable
+            await asyncio.sleep(1)
+        self.process_updates()
+
+    async def run_forever(self) -> None:
+        """Run polling cycles and send loop till cancelled"""
+        send_loop = asyncio.ensure_future(self.send_loop())
+        try:
+            while True:
+                await self.run_async()
+        finally:
+            send_loop.cancel()
+            await self.client.close()
+            self.sessions.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    try:
+        token = os.environ['TELEGRAM_BOT_TOKEN']
+    except KeyError:
+        logging.error("TELEGRAM_BOT_TOKEN env var not set. Cannot get token")
+        sys.exit(1)
+    api_url = os.environ.get('TELEGRAM_API_URL', TELEGRAM_API_URL)
+    storage = None
+    if os.environ.get('TELEGRAM_BOT_DB'):
+        storage = SQLiteStorage(os.environ['TELEGRAM_BOT_DB'])
+    bot = AsyncTelegramBot(token, api_url, storage=storage)
+    bot.bind_gauges()
+    if os.environ.get('METRICS_PORT'):
+        start_http_server(int(os.environ['METRICS_PORT']))
+    bot.metrics_textfile = os.environ.get('METRICS_TEXTFILE')
+    SCHEDULES.install_sighup()
+    logging.info("Starting async Telegram Bot...")
+    try:
+        asyncio.run(bot.run_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import sys
-import requests
 import logging
 import time
-import datetime
 import re
 import os
-from taxcalc import CarEcoTax
+from collections import deque
+from taxcalc import TAX_CACHE
+from taxcalc import CLOCK
+from taxcalc import SCHEDULES
 from taxcalc import CarEcoTaxProdYearError
 from taxcalc import CarEcoTaxHorsePowerError
+from chatstore import ChatSessionStore
+from chatstore import SQLiteStorage
+from metrics import REGISTRY
+from metrics import start_http_server
+from outbound import OutboundScheduler
+from outbound import OutboundSender
+from outbound import RateLimitError
+from profiling import TRACER
 
 
 class TelegramBotApiError(Exception):
@@ -15,43 +24,145 @@ class TelegramBotApiError(Exception):
     pass
 
 
+class TelegramRateLimitError(RateLimitError, TelegramBotApiError):
+    """Exception for 429 response with retry_after parameter"""
+    pass
+
+
+def is_text_message(update) -> bool:
+    """Bot answers only text messages, other updates are acknowledged"""
+    message = update.get("message") if isinstance(update, dict) else None
+    return isinstance(message, dict) and \
+        isinstance(message.get("text"), str) and \
+        isinstance(message.get("chat"), dict) and \
+        "id" in message["chat"] and "message_id" in message
+
+
+def check_api_response(method: str, response: dict):
+    """Return result of Telegram API response or raise exception"""
+    if response["ok"]:
+        return response["result"]
+    API_ERRORS.labels(method).inc()
+    retry_after = (response.get("parameters") or {}).get("retry_after")
+    if retry_after is not None:
+        RATE_LIMITED.inc()
+        raise TelegramRateLimitError(f"Telegram API rate limit: {response}",
+                                     retry_after)
+    raise TelegramBotApiError(f"Telegram API response not ok: {response}")
+
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "telegram_api_request_seconds", "Telegram API call latency",
+    labelnames=("method",))
+API_ERRORS = REGISTRY.counter(
+    "telegram_api_errors_total", "Failed Telegram API calls",
+    labelnames=("method",))
+UPDATES = REGISTRY.counter(
+    "telegram_updates_total", "Received updates")
+REPLIES = REGISTRY.counter(
+    "telegram_replies_total", "Sent replies")
+UPDATE_TO_REPLY_SECONDS = REGISTRY.histogram(
+    "telegram_update_to_reply_seconds",
+    "Time from receiving update to sent reply")
+PROCESS_CHAT_SECONDS = REGISTRY.histogram(
+    "telegram_process_chat_seconds", "Duration of replying to updates batch")
+TAX_CALCULATION_SECONDS = REGISTRY.histogram(
+    "tax_calculation_seconds", "Duration of tax calculation",
+    buckets=(0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+             0.0001, 0.001))
+RATE_LIMITED = REGISTRY.counter(
+    "telegram_rate_limited_total", "Telegram API 429 responses")
+OUTBOUND_PENDING = REGISTRY.gauge(
+    "telegram_outbound_pending", "Replies waiting for sending")
+DROPPED_REPLIES = REGISTRY.counter(
+    "telegram_dropped_replies_total", "Replies dropped after retries")
+ACTIVE_SESSIONS = REGISTRY.gauge(
+    "telegram_active_sessions", "Open conversations")
+TAX_CACHE_REQUESTS = REGISTRY.gauge(
+    "tax_cache_requests", "Tax cache lookups by result",
+    labelnames=("result",))
+TAX_CACHE_REQUESTS.labels("hit").set_function(lambda: TAX_CACHE.hits)
+TAX_CACHE_REQUESTS.labels("miss").set_function(lambda: TAX_CACHE.misses)
+TAX_CACHE_REQUESTS.labels("eviction").set_function(
+    lambda: TAX_CACHE.evictions)
+
+
 class TelegramBot:
     """Telegram Bot main class"""
     start_keyboard = [["/start"]]
     horse_powers_keyboard = [["156"], ["234"]]
-    prod_year_keyboard = [[str(datetime.datetime.today().year - year)]
-                          for year in range(8)]
-    prod_year_keyboard.append([f"մինչև {prod_year_keyboard[-1][0]}"])
+    clock = CLOCK
+    prod_year_keyboard_year, prod_year_keyboard_cache = None, None
     # Regex pattern for horse powers and production year
     regex_pattern = re.compile(r"(մինչև\s)?([0-9]{2,4})")
     offset = 0
+    # getUpdates long polling timeout in seconds, None means short polling
+    poll_timeout = None
     updates = []
-    chat_ids = []
-    chat_history = {}
     url, payload, keyboard, reply_text = None, None, None, None
+    # Seconds after which not finished conversation is dropped
+    session_ttl = 24 * 60 * 60
+    # Seconds between summary log lines and metrics textfile writes
+    summary_interval = 60
+    metrics_textfile = None
+    # Outbound messages per second for all chats and for one chat, None
+    # means unlimited
+    send_rate = 30
+    chat_send_rate = 1
+    sender_threads = 4
 
-    def __init__(self, token):
-        api_url = f"https://api.telegram.org/bot{token}/"
+    def __init__(self, token, api_url=TELEGRAM_API_URL, storage=None):
+        api_url = f"{api_url}/bot{token}/"
         self.api_send_message_url = f"{api_url}sendMessage"
         self.api_get_updates_url = f"{api_url}getUpdates"
+        self.sessions = ChatSessionStore(self.session_ttl, storage=storage)
+        # Continue from last committed update after restart
+        self.offset = self.sessions.offset
+        self.next_summary_at = time.monotonic() + self.summary_interval
+        # Created on first reply, so send rates could be changed before
+        self.outbound, self.sender = None, None
+        # (chat_id, message_id) of replies sent or dropped by sender
+        # threads, storage is changed only by processing thread
+        self.finished_outbound = deque()
+
+    def bind_gauges(self) -> None:
+        """
+        Report sessions and outbound queue of this bot by process wide
+        gauges, called once for the bot process serves
+        """
+        ACTIVE_SESSIONS.set_function(lambda: len(self.sessions))
+        OUTBOUND_PENDING.set_function(
+            lambda: len(self.outbound) if self.outbound else 0)
 
     def __request(self) -> dict:
         """Make a http call and return result object if it was successful"""
+        return self.api_request(self.url, self.payload)
+
+    def api_request(self, url: str, payload: dict):
+        """Call Telegram API method of url, return result if it was ok"""
         headers = {
             "accept": "application/json",
             "User-Agent": "AutoEcoTaxBot",
             "content-type": "application/json"
         }
 
-        response = requests.post(self.url,
-                                 json=self.payload,
-                                 headers=headers).json()
-        logging.debug(f"Payload: {self.payload}")
+        # requests takes longer to import than everything else, so it is
+        # imported on first API call, not by tests of conversation logic
+        import requests
+        method = url.rsplit("/", 1)[-1]
+        try:
+            with API_REQUEST_SECONDS.labels(method).time(), \
+                    TRACER.span("http"):
+                response = requests.post(url, json=payload,
+                                         headers=headers).json()
+        except requests.exceptions.RequestException:
+            API_ERRORS.labels(method).inc()
+            raise
+        logging.debug(f"Payload: {payload}")
         logging.debug(f"Response: {response}")
-        if not response["ok"]:
-            raise TelegramBotApiError(f"Telegram API response "
-                                      f"not ok: {response}")
-        return response["result"]
+        return check_api_response(method, response)
 
     def get_updates(self) -> None:
         """Get Updates from telegram"""
@@ -60,7 +171,7 @@ class TelegramBot:
         logging.debug(f"offset: {self.offset}")
         self.payload = {
             "offset": self.offset,
-            "timeout": None
+            "timeout": self.poll_timeout
         }
         self.updates = self.__request()
         logging.debug(f"All updates from telegram API: {self.updates}")
@@ -69,72 +180,159 @@ class TelegramBot:
             self.offset = self.updates[-1]["update_id"] + 1
             logging.info(f"Offset updated to {self.offset}")
 
-    def send_message(self) -> bool:
-        """Try to sent message and return True if it successfully sent"""
-        self.url = self.api_send_message_url
-        self.payload = {
+    def send_message_payload(self) -> dict:
+        """Return sendMessage payload for current chat reply"""
+        payload = {
             "chat_id": self.chat_id,
             "reply_to_message_id": self.reply_id,
             "text": self.reply_text
         }
         if self.keyboard:
-            self.payload["parse_mode"] = "Markdown"
-            self.payload["reply_markup"] = {"keyboard": self.keyboard,
-                                            "one_time_keyboard": True,
-                                            "resize_keyboard": True}
+            payload["parse_mode"] = "Markdown"
+            payload["reply_markup"] = {"keyboard": self.keyboard,
+                                       "one_time_keyboard": True,
+                                       "resize_keyboard": True}
+        return payload
+
+    def send_message(self) -> bool:
+        """
+        Queue reply of current chat and mark chat processed. Reply is sent
+        by outbound scheduler, so processing never waits for network. It
+        is persisted together with chat state till it is sent, so replies
+        queued before restart are sent after it
+        """
+        self.sessions.mark_processed(self.chat_id)
+        with TRACER.span("format"):
+            payload = self.send_message_payload()
+        self.sessions.add_outbound(self.chat_id, self.reply_id, payload,
+                                   self.session.updated_at)
+        self.submit_message(self.chat_id, payload, self.session.updated_at)
+        return True
+
+    def resend_restored(self) -> None:
+        """Queue replies which were not sent before restart"""
+        for chat_id, payload, created_at in \
+                self.sessions.take_restored_outbound():
+            logging.info(f"Resend not sent reply to {chat_id} chat id")
+            self.submit_message(chat_id, payload, created_at)
+
+    def forget_finished(self) -> None:
+        """Remove sent and dropped replies from storage on next commit"""
+        while self.finished_outbound:
+            self.sessions.remove_outbound(*self.finished_outbound.popleft())
+
+    def start_outbound(self) -> OutboundScheduler:
+        """Return outbound scheduler, create it with current send rates"""
+        if self.outbound is None:
+            self.outbound = OutboundScheduler(self.send_rate,
+                                              self.chat_send_rate)
+        return self.outbound
+
+    def submit_message(self, chat_id, payload: dict,
+                       created_at: float) -> None:
+        """Give message to sender threads"""
+        if self.sender is None:
+            self.sender = OutboundSender(self.start_outbound(),
+                                         self.send_payload,
+                                         (TelegramBotApiError,),
+                                         self.reply_sent, self.reply_dropped,
+                                         self.sender_threads)
+        self.sender.submit(chat_id, payload, created_at)
+
+    def send_payload(self, payload: dict):
+        """Send message, network errors raise TelegramBotApiError"""
+        import requests
         try:
-            sent_response = self.__request()
-            logging.info(f"Sent message: {sent_response}")
-            self.chat_history[self.chat_id]["processed"] = True
-            return True
-        except TelegramBotApiError as api_error:
-            logging.error(f"Failed sent message {self.reply_text} to "
-                          f"{self.chat_id} chat id, error{api_error}")
-            return False
+            return self.api_request(self.api_send_message_url, payload)
+        except requests.exceptions.RequestException as request_error:
+            raise TelegramBotApiError(f"sendMessage failed: "
+                                      f"{request_error}")
+
+    def reply_sent(self, message, result=None) -> None:
+        """Record metrics of sent reply, called by sender threads"""
+        self.finished_outbound.append(
+            (message.chat_id, message.payload["reply_to_message_id"]))
+        logging.debug(f"Sent message: {result}")
+        UPDATE_TO_REPLY_SECONDS.observe(
+            max(self.sessions.clock() - message.created_at, 0))
+        REPLIES.inc()
+
+    def reply_dropped(self, message) -> None:
+        self.finished_outbound.append(
+            (message.chat_id, message.payload["reply_to_message_id"]))
+        DROPPED_REPLIES.inc()
+        logging.error(f"Dropped message {message.payload['text']} to "
+                      f"{message.chat_id} chat id after "
+                      f"{message.attempts} attempts")
+
+    def log_summary(self) -> None:
+        """Log counters summary and write metrics textfile once a while"""
+        now = time.monotonic()
+        if now < self.next_summary_at:
+            return
+        self.next_summary_at = now + self.summary_interval
+        logging.info(f"summary: active_chats={len(self.sessions)} "
+                     f"ready_chats={len(self.sessions.ready)} "
+                     f"updates={UPDATES.labels().value} "
+                     f"replies={REPLIES.labels().value} "
+                     f"offset={self.offset} "
+                     f"tax_cache_hit_rate="
+                     f"{TAX_CACHE.stats()['hit_rate']:.3f}")
+        if self.metrics_textfile:
+            REGISTRY.write_textfile(self.metrics_textfile)
 
     def add_updates_to_queue(self) -> None:
-        """Add updates to chat_ids and chat_history"""
+        """
+        Apply updates to their chats in order, every message is replied
+        by its own conversation step, so several messages of one chat in
+        one batch are not lost
+        """
         for update in self.updates:
-            chat_id = update["message"]["chat"]["id"]
-            message_id = update["message"]["message_id"]
-            message_text = update["message"]["text"]
-            if chat_id not in self.chat_ids:
-                self.chat_ids.append(chat_id)
-                self.chat_history[chat_id] = {"last_message": message_text,
-                                              "last_message_id": message_id,
-                                              "horse_powers": None,
-                                              "prod_year": None,
-                                              "processed": False}
-            else:
-                self.chat_history[chat_id]["last_message"] = message_text
-                self.chat_history[chat_id]["last_message_id"] = message_id
-                self.chat_history[chat_id]["processed"] = False
+            self.handle_update(update)
+        UPDATES.inc(len(self.updates))
+        logging.debug(f"Applied {len(self.updates)} updates, "
+                      f"{len(self.sessions)} active chats")
         # Clean up self.updates
-        logging.info(f"chat ids are: {self.chat_ids}")
-        logging.info(f"chat_history: {self.chat_history}")
         self.updates = []
 
+    def handle_update(self, update: dict) -> None:
+        """Apply one update to chat session and reply to it"""
+        if not is_text_message(update):
+            # Stickers, edited messages and others are not answered
+            return
+        message = update["message"]
+        chat_id = message["chat"]["id"]
+        self.sessions.add_message(chat_id, message["message_id"],
+                                  message["text"])
+        self.process_message(chat_id)
+
     def cleanup_old_chats(self):
-        cleanup_indexes = []
-        for chat_id_index, chat_id in enumerate(self.chat_ids):
-            prod_year = self.chat_history[chat_id]["prod_year"]
-            horse_power = self.chat_history[chat_id]["horse_powers"]
-            replied = self.chat_history[chat_id]["processed"]
-            if prod_year is not None and horse_power is not None and replied:
-                del self.chat_history[chat_id]
-                logging.info(f"removed {chat_id} processed chat from queue")
-                cleanup_indexes.append(chat_id_index)
-        if cleanup_indexes:
-            for index in cleanup_indexes:
-                del self.chat_ids[index]
-
-    def extract_from_message(self, field) -> bool:
-        """Try to extract from message horse_powers of prod_year"""
-        if self.regex_pattern.findall(self.message):
-            self.chat_history[self.chat_id][field] = \
-                int(self.regex_pattern.findall(self.message)[0][1])
-            return True
-        return False
+        """Remove expired sessions, finished ones are removed at once"""
+        for chat_id in self.sessions.evict_expired():
+            logging.info(f"removed {chat_id} expired chat from queue")
+
+    @classmethod
+    def parse_number(cls, message: str):
+        """Return production year or horse powers of message or None"""
+        match = cls.regex_pattern.search(message)
+        return int(match.group(2)) if match else None
+
+    @staticmethod
+    def build_prod_year_keyboard(current_year: int) -> list:
+        """Return keyboard with last 8 years and older cars button"""
+        keyboard = [[str(current_year - year)] for year in range(8)]
+        keyboard.append([f"մինչև {keyboard[-1][0]}"])
+        return keyboard
+
+    @property
+    def prod_year_keyboard(self) -> list:
+        """Production year keyboard, rebuilt when year changes"""
+        current_year = self.clock.year()
+        if current_year != self.prod_year_keyboard_year:
+            self.prod_year_keyboard_cache = \
+                self.build_prod_year_keyboard(current_year)
+            self.prod_year_keyboard_year = current_year
+        return self.prod_year_keyboard_cache
 
     def prod_year_response_helper(self) -> None:
         """Method for set prod year keyboard and reply_text"""
@@ -146,64 +344,78 @@ class TelegramBot:
         self.reply_text = "մուտքագրեք մեքենայի շարժիչի ձիաուժերի քանակը"
 
     def process_chat(self):
-        """Process chat message"""
-        for chat_id in self.chat_ids:
-            self.chat_id = chat_id
-            self.message = self.chat_history[chat_id]["last_message"]
-            self.reply_id = self.chat_history[chat_id]["last_message_id"]
-            self.replied = self.chat_history[chat_id]["processed"]
-            self.prod_year = self.chat_history[chat_id]["prod_year"]
-            self.horse_powers = self.chat_history[chat_id]["horse_powers"]
-            # Don't response to already replied messages
-            if self.replied:
-                continue
-            if self.message == "/start":
-                self.prod_year_response_helper()
-                # Reset counters
-                self.chat_history[chat_id]["prod_year"] = None
-                self.chat_history[chat_id]["horse_powers"] = None
-                if self.send_message():
-                    logging.info(f"Replied to message: {self.reply_id}")
-                continue
-            elif self.prod_year is None and \
-                    not self.extract_from_message("prod_year"):
-                self.prod_year_response_helper()
-                if self.send_message():
-                    logging.info(f"Replied to message: {self.reply_id}")
-                continue
-            elif self.prod_year is None and \
-                    self.extract_from_message("prod_year"):
-                self.horse_powers_response_helper()
-                self.send_message()
-                continue
-            elif self.horse_powers is None and \
-                    not self.extract_from_message("horse_powers"):
-                self.horse_powers_response_helper()
-                self.send_message()
-                continue
-            elif self.prod_year and self.horse_powers:
-                try:
-                    tax = CarEcoTax(self.prod_year,
-                                    self.horse_powers).calculate()
-                    self.reply_text = f"Վճարման ենթակա բնապահպանության " \
-                                      f"հարկը կազմում է` {tax} ֏"
-                    self.keyboard = None
-                    logging.info(f"Calculate {tax} tax for {self.prod_year} "
-                                 f"year and {self.horse_powers} hp")
-                except CarEcoTaxProdYearError as year_error:
-                    logging.info(f"{year_error}")
-                    self.reply_text = f"մուտքագրված արտադրման " \
-                                      f"տարեթիվը {self.prod_year} սխալ է"
-                    self.chat_history[chat_id]["prod_year"] = None
-                except CarEcoTaxHorsePowerError as hp_error:
-                    self.reply_text = f"մուտքագրված {hp_error} ձիաուժը սխալ է"
-                    self.chat_history[chat_id]["horse_powers"] = None
+        """Process chats with not replied message, like ones restored
+        from storage after restart"""
+        for chat_id in self.sessions.ready_chat_ids():
+            self.process_message(chat_id)
+
+    def process_message(self, chat_id) -> None:
+        """Reply to chat last message, one step of conversation"""
+        self.chat_id = chat_id
+        self.session = self.sessions.get(chat_id)
+        # Don't response to already replied messages
+        if self.session is None or self.session.processed:
+            return
+        self.message = self.session.last_message
+        self.reply_id = self.session.last_message_id
+        self.prod_year = self.session.prod_year
+        self.horse_powers = self.session.horse_powers
+        # Message is parsed once, number is production year or horse powers
+        with TRACER.span("parse"):
+            number = self.parse_number(self.message)
+        if self.message == "/start":
+            self.prod_year_response_helper()
+            # Reset counters
+            self.session.prod_year = None
+            self.session.horse_powers = None
+        elif self.prod_year is None and number is None:
+            self.prod_year_response_helper()
+        elif self.prod_year is None and self.horse_powers is None:
+            self.session.prod_year = number
+            self.horse_powers_response_helper()
+        elif self.horse_powers is None and number is None:
+            self.horse_powers_response_helper()
+        else:
+            # Message is the missing value, the other one could be known
+            # after wrong input was corrected
+            if self.prod_year is None:
+                self.prod_year = self.session.prod_year = number
+            elif self.horse_powers is None:
+                self.horse_powers = self.session.horse_powers = number
+            if self.calculate_reply():
+                # Conversation is finished, next message starts new one
                 self.send_message()
-                continue
-        self.cleanup_old_chats()
+                self.sessions.remove(chat_id)
+                logging.info(f"removed {chat_id} processed chat from queue")
+                return
+        if self.send_message():
+            logging.debug(f"Replied to message: {self.reply_id}")
+
+    def calculate_reply(self) -> bool:
+        """Set tax reply text, return False if car data was wrong"""
+        try:
+            with TAX_CALCULATION_SECONDS.time(), TRACER.span("lookup"):
+                tax = TAX_CACHE.calculate(self.prod_year, self.horse_powers)
+        except CarEcoTaxProdYearError as year_error:
+            logging.info(f"{year_error}")
+            self.reply_text = f"մուտքագրված արտադրման " \
+                              f"տարեթիվը {self.prod_year} սխալ է"
+            self.session.prod_year = None
+            return False
+        except CarEcoTaxHorsePowerError as hp_error:
+            self.reply_text = f"մուտքագրված {hp_error} ձիաուժը սխալ է"
+            self.session.horse_powers = None
+            return False
+        self.reply_text = f"Վճարման ենթակա բնապահպանության " \
+                          f"հարկը կազմում է` {tax} ֏"
+        self.keyboard = None
+        logging.info(f"Calculate {tax} tax for {self.prod_year} "
+                     f"year and {self.horse_powers} hp")
+        return True
 
     def run(self) -> None:
         """Primary method for running bot"""
+        import requests
         try:
             self.get_updates()
         except TelegramBotApiError as bot_api_error:
@@ -212,17 +424,34 @@ class TelegramBot:
         except requests.exceptions.ConnectionError as con_error:
             logging.error(con_error)
             self.updates = []
-        # If updates exists add them to queue
+        self.process_updates()
+
+    def process_updates(self) -> None:
+        """Reply to self.updates and restored chats, commit sessions"""
+        if self.sessions.restored_outbound:
+            self.resend_restored()
+        # If updates exists reply to them
         if self.updates:
-            self.add_updates_to_queue()
+            with PROCESS_CHAT_SECONDS.time():
+                self.add_updates_to_queue()
         else:
             logging.debug(f"No new updates exists: {self.updates}")
 
-        if self.chat_ids:
+        if self.sessions.has_ready():
             self.process_chat()
+        self.cleanup_old_chats()
+        self.forget_finished()
+        self.sessions.commit(self.offset)
+        self.log_summary()
 
 
 def main():
+    import argparse
+    from profiling import add_profile_arguments
+    from profiling import start_profiling
+    parser = argparse.ArgumentParser(description="Car eco tax Telegram bot")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
     debug = False
     if debug:
         logging.basicConfig(level=logging.DEBUG,
@@ -237,11 +466,30 @@ def main():
     except KeyError:
         logging.error("TELEGRAM_BOT_TOKEN env var not set. Cannot get token")
         sys.exit(1)
-    bot = TelegramBot(token)
+    storage = None
+    if os.environ.get('TELEGRAM_BOT_DB'):
+        storage = SQLiteStorage(os.environ['TELEGRAM_BOT_DB'])
+    bot = TelegramBot(token, storage=storage)
+    bot.bind_gauges()
+    if os.environ.get('METRICS_PORT'):
+        start_http_server(int(os.environ['METRICS_PORT']))
+    bot.metrics_textfile = os.environ.get('METRICS_TEXTFILE')
+    SCHEDULES.install_sighup()
+    profiler = start_profiling(args, "telegram_bot")
+    if args.profile or args.trace:
+        import signal
+        # Profile and stage totals are written on exit, also by docker stop
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
     logging.info("Starting Telegram Bot...")
-    while True:
-        time.sleep(1)
-        bot.run()
+    try:
+        while True:
+            time.sleep(1)
+            bot.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler is not None:
+            profiler.stop()
 
 
 if __name__ == "__main__":
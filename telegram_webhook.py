@@ -0,0 +1,236 @@
+import sys
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import ssl
+from collections import OrderedDict
+from asynchttp import Response
+from asynchttp import json_response
+from asynchttp import serve
+from chatstore import SQLiteStorage
+from metrics import REGISTRY
+from metrics import start_http_server
+from taxcalc import SCHEDULES
+from telegram_bot import TelegramBot
+from telegram_bot import TelegramBotApiError
+from telegram_bot import TELEGRAM_API_URL
+from telegram_bot import is_text_message
+
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+
+WEBHOOK_REQUESTS = REGISTRY.counter(
+    "telegram_webhook_requests_total", "Webhook requests by response status",
+    labelnames=("status",))
+WEBHOOK_QUEUE = REGISTRY.gauge(
+    "telegram_webhook_queue", "Webhook updates waiting for processing")
+
+
+class WebhookServer:
+    """
+    Receives Telegram webhook update POSTs and feeds them to bot
+    process_updates flow. Requests are only validated and queued, so many
+    of them are accepted at once. When max_queue updates are waiting, new
+    ones wait up to enqueue_timeout seconds and then get 429, Telegram
+    retries them later. Batches are processed on the event loop, as
+    SQLite storage is bound to its thread, so requests wait while up to
+    batch_size updates are processed
+    """
+    # Update ids remembered for skipping Telegram retries
+    seen_size = 10000
+
+    def __init__(self, bot: TelegramBot, secret_token: str = None,
+                 path: str = "/webhook", max_queue: int = 1000,
+                 enqueue_timeout: float = 1.0, batch_size: int = 100,
+                 idle_timeout: float = 1.0) -> None:
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.queue = None
+        self.seen = OrderedDict()
+        # Updates before committed offset were processed before restart
+        self.first_update_id = bot.offset or 0
+
+    def bind_gauges(self) -> None:
+        """Report bot and queue of this server by process wide gauges"""
+        self.bot.bind_gauges()
+        WEBHOOK_QUEUE.set_function(
+            lambda: self.queue.qsize() if self.queue else 0)
+
+    def response(self, status: int, data=None, headers=None) -> Response:
+        WEBHOOK_REQUESTS.labels(str(status)).inc()
+        if data is None:
+            return Response(status, dict(headers or {}), b"")
+        return json_response(status, data, headers)
+
+    def is_duplicate(self, update_id: int) -> bool:
+        if update_id < self.first_update_id or update_id in self.seen:
+            return True
+        self.seen[update_id] = None
+        if len(self.seen) > self.seen_size:
+            self.seen.popitem(last=False)
+        return False
+
+    async def handle(self, request) -> Response:
+        """asynchttp.serve handler"""
+        if request.path != self.path:
+            return self.response(404, {"error": "Not Found"})
+        if request.method != "POST":
+            return self.response(405, {"error": "Method Not Allowed"},
+                                 {"Allow": "POST"})
+        if self.secret_token is not None and not hmac.compare_digest(
+                request.headers.get(SECRET_TOKEN_HEADER, ""),
+                self.secret_token):
+            return self.response(401, {"error": "Unauthorized"})
+        try:
+            update = json.loads(request.body)
+            update_id = int(update["update_id"])
+        except (ValueError, TypeError, KeyError) as update_error:
+            return self.response(400, {"error": f"Malformed update: "
+                                                f"{update_error!r}"})
+        if not is_text_message(update) or self.is_duplicate(update_id):
+            return self.response(200)
+        # Bot uses update id as offset, keep the parsed one
+        update["update_id"] = update_id
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.max_queue)
+        try:
+            await asyncio.wait_for(self.queue.put(update),
+                                   self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            # Telegram sends it again
+            self.seen.pop(update_id, None)
+            return self.response(429, {"error": "Too Many Requests"},
+                                 {"Retry-After": "1"})
+        return self.response(200)
+
+    async def next_batch(self) -> list:
+        """Return queued updates, wait for first one if nothing is ready"""
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.max_queue)
+        updates = []
+        if self.queue.empty() and not self.bot.sessions.has_ready():
+            try:
+                updates.append(await asyncio.wait_for(self.queue.get(),
+                                                      self.idle_timeout))
+            except asyncio.TimeoutError:
+                return updates
+        while len(updates) < self.batch_size and not self.queue.empty():
+            updates.append(self.queue.get_nowait())
+        return updates
+
+    def process_batch(self, updates: list) -> None:
+        """Run one bot cycle of updates"""
+        if updates:
+            self.bot.offset = max(self.bot.offset or 0,
+                                  max(update["update_id"]
+                                      for update in updates) + 1)
+        self.bot.updates = updates
+        self.bot.process_updates()
+
+    async def process_forever(self) -> None:
+        """Process queued updates till cancelled"""
+        while True:
+            self.process_batch(await self.next_batch())
+            # Let handlers queue more updates between cycles
+            await asyncio.sleep(0)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0,
+                    ssl_context=None):
+        """Start listener and return it, port 0 means any free port"""
+        return await serve(self.handle, host, port, ssl=ssl_context)
+
+
+def set_webhook(bot: TelegramBot, url: str, secret_token: str = None,
+                max_connections: int = 40):
+    """Register webhook url of bot"""
+    payload = {"url": url, "max_connections": max_connections,
+               "allowed_updates": ["message"]}
+    if secret_token:
+        payload["secret_token"] = secret_token
+    api_url = bot.api_send_message_url.rsplit("/", 1)[0]
+    return bot.api_request(f"{api_url}/setWebhook", payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Telegram bot receiving updates by webhook")
+    parser.add_argument("--host",
+                        default="0.0.0.0",
+                        help="listen address")
+    parser.add_argument("--port",
+                        type=int,
+                        default=8443,
+                        help="listen port")
+    parser.add_argument("--path",
+                        default="/webhook",
+                        help="webhook path")
+    parser.add_argument("--url",
+                        help="public webhook url registered by setWebhook")
+    parser.add_argument("--certfile",
+                        help="TLS certificate, listener is HTTP without it")
+    parser.add_argument("--keyfile",
+                        help="TLS private key of --certfile")
+    parser.add_argument("--max-queue",
+                        type=int,
+                        default=1000,
+                        help="updates waiting for processing before 429")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    try:
+        token = os.environ['TELEGRAM_BOT_TOKEN']
+    except KeyError:
+        logging.error("TELEGRAM_BOT_TOKEN env var not set. Cannot get token")
+        sys.exit(1)
+    secret_token = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+    if not secret_token:
+        logging.warning("TELEGRAM_WEBHOOK_SECRET env var not set, webhook "
+                        "requests are not authenticated")
+    api_url = os.environ.get('TELEGRAM_API_URL', TELEGRAM_API_URL)
+    storage = None
+    if os.environ.get('TELEGRAM_BOT_DB'):
+        storage = SQLiteStorage(os.environ['TELEGRAM_BOT_DB'])
+    bot = TelegramBot(token, api_url, storage=storage)
+    if os.environ.get('METRICS_PORT'):
+        start_http_server(int(os.environ['METRICS_PORT']))
+    bot.metrics_textfile = os.environ.get('METRICS_TEXTFILE')
+    SCHEDULES.install_sighup()
+    ssl_context = None
+    if args.certfile:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(args.certfile, args.keyfile)
+    if args.url:
+        try:
+            set_webhook(bot, args.url, secret_token)
+        except TelegramBotApiError as bot_api_error:
+            logging.error(bot_api_error)
+            sys.exit(1)
+    webhook = WebhookServer(bot, secret_token, args.path, args.max_queue)
+    webhook.bind_gauges()
+
+    async def serve_forever():
+        server = await webhook.start(args.host, args.port, ssl_context)
+        logging.info(f"Receiving webhook updates on "
+                     f"{args.host}:{args.port}{args.path}")
+        async with server:
+            await webhook.process_forever()
+
+    try:
+        asyncio.run(serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bot.sessions.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import sys
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from taxcalc import SCHEDULES
+from telegram_bot import TelegramBot
+from telegram_bot import TelegramBotApiError
+from telegram_bot import TELEGRAM_API_URL
+from telegram_bot import is_text_message
+
+
+def partition(chat_id, workers: int) -> int:
+    """Return worker index for chat, all chat updates go to one worker"""
+    return hash(chat_id) % workers
+
+
+def drain_queue(updates_queue, timeout: float, max_updates: int = 1000
+                ) -> list:
+    """
+    Return updates from queue, waits up to timeout seconds for first one
+    and takes the rest without waiting
+    """
+    try:
+        if timeout:
+            updates = [updates_queue.get(timeout=timeout)]
+        else:
+            updates = [updates_queue.get_nowait()]
+    except queue.Empty:
+        return []
+    while len(updates) < max_updates:
+        try:
+            updates.append(updates_queue.get_nowait())
+        except queue.Empty:
+            break
+    return updates
+
+
+def run_ingest(bot: TelegramBot, queues: list, stop) -> None:
+    """Fetch updates and put them to worker queues by chat id till stop"""
+    import requests
+    while not stop.is_set():
+        try:
+            bot.get_updates()
+        except (TelegramBotApiError,
+                requests.exceptions.ConnectionError) as bot_api_error:
+            logging.error(bot_api_error)
+            time.sleep(1)
+            continue
+        # Offset is already after skipped updates
+        for update in bot.updates:
+            if not is_text_message(update):
+                continue
+            chat_id = update["message"]["chat"]["id"]
+            queues[partition(chat_id, len(queues))].put(update)
+        bot.updates = []
+
+
+def run_worker(bot: TelegramBot, updates_queue, stop,
+               idle_timeout: float = 1.0) -> None:
+    """Process updates from queue with bot conversation logic till stop"""
+    while not stop.is_set():
+        # Chats with not replied message restored from storage need next
+        # cycle right away
+        timeout = 0 if bot.sessions.has_ready() else idle_timeout
+        bot.updates = drain_queue(updates_queue, timeout)
+        bot.process_updates()
+
+
+def worker_main(token: str, api_url: str, updates_queue, stop,
+                send_rate=TelegramBot.send_rate,
+                chat_send_rate=TelegramBot.chat_send_rate) -> None:
+    """Entry point of worker process, send_rate is rate of this worker"""
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(processName)s - '
+                               '%(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    # Workers calculate taxes, ingest process doesn't
+    SCHEDULES.install_sighup()
+    bot = TelegramBot(token, api_url)
+    bot.send_rate, bot.chat_send_rate = send_rate, chat_send_rate
+    bot.bind_gauges()
+    try:
+        run_worker(bot, updates_queue, stop)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(token: str, api_url: str, workers: int, stop,
+                  send_rate=TelegramBot.send_rate,
+                  chat_send_rate=TelegramBot.chat_send_rate) -> tuple:
+    """
+    Start worker processes, return (processes, queues). Bot send_rate is
+    split between workers, chat_send_rate is not as chat has one worker
+    """
+    worker_rate = send_rate / workers if send_rate else send_rate
+    queues = [multiprocessing.Queue() for _ in range(workers)]
+    processes = [multiprocessing.Process(target=worker_main,
+                                         args=(token, api_url,
+                                               updates_queue, stop,
+                                               worker_rate, chat_send_rate),
+                                         name=f"worker-{index}",
+                                         daemon=True)
+                 for index, updates_queue in enumerate(queues)]
+    for process in processes:
+        process.start()
+    return processes, queues
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Telegram bot with one ingest and several worker "
+                    "processes")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("--send-rate",
+                        type=float,
+                        default=TelegramBot.send_rate,
+                        help="messages per second of all workers")
+    args = parser.parse_args()
+    if args.send_rate <= 0:
+        parser.error("--send-rate should be greater then 0")
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(processName)s - '
+                               '%(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    try:
+        token = os.environ['TELEGRAM_BOT_TOKEN']
+    except KeyError:
+        logging.error("TELEGRAM_BOT_TOKEN env var not set. Cannot get token")
+        sys.exit(1)
+    api_url = os.environ.get('TELEGRAM_API_URL', TELEGRAM_API_URL)
+    stop = multiprocessing.Event()
+    processes, queues = start_workers(token, api_url, args.workers, stop,
+                                      args.send_rate)
+    ingest = TelegramBot(token, api_url)
+    ingest.poll_timeout = 25
+    logging.info(f"Starting Telegram Bot with {args.workers} workers...")
+    try:
+        run_ingest(ingest, queues, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(5)
+
+
+if __name__ == "__main__":
+    main()
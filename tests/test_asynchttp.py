@@ -0,0 +1,153 @@
+import unittest
+import asyncio
+import sys
+from unittest import mock
+sys.path.append('..')
+from asynchttp import ConnectionPool
+from asynchttp import Response
+from asynchttp import serve
+from fake_telegram import benchmark
+from telegram_async import AsyncTelegramBot
+
+
+async def echo(request):
+    return Response(200, {}, request.body)
+
+
+class ServeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = await serve(echo, "127.0.0.1", 0, max_body_size=16)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def raw_status(self, message: bytes) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                       self.port)
+        writer.write(message)
+        status_line = await asyncio.wait_for(reader.readline(), 5)
+        writer.close()
+        return status_line.split()[1]
+
+    async def test_chunked_body(self):
+        body = await self.raw_status(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3\r\nabc\r\n2;ext=1\r\nde\r\n0\r\n\r\n")
+        self.assertEqual(body, b"200")
+
+    async def test_chunked_limit(self):
+        # Rejected by chunk size, data is never sent
+        status = await self.raw_status(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"ffffffff\r\n")
+        self.assertEqual(status, b"413")
+        status = await self.raw_status(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"a\r\n0123456789\r\na\r\n")
+        self.assertEqual(status, b"413")
+        status = await self.raw_status(
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            + b"0" * 2000 + b"1\r\n")
+        self.assertEqual(status, b"400")
+
+    async def test_keep_alive(self):
+        pool = ConnectionPool(f"http://127.0.0.1:{self.port}", size=1)
+        connect = pool.connect
+        connections = []
+
+        async def counting_connect():
+            connections.append(await connect())
+            return connections[-1]
+
+        pool.connect = counting_connect
+        for body in (b"one", b"two"):
+            response = await pool.request("POST", "/", body)
+            self.assertEqual(response.body, body)
+        self.assertEqual(len(connections), 1)
+        self.assertEqual(pool.idle, connections)
+        await pool.close()
+
+
+class ReconnectTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reconnect_after_server_close(self):
+        connections = []
+
+        async def answer_once(reader, writer):
+            # Server closes keep-alive connection after one response
+            connections.append(writer)
+            while await reader.readline() not in (b"\r\n", b""):
+                pass
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(answer_once, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = ConnectionPool(f"http://127.0.0.1:{port}", size=1)
+        try:
+            for _ in range(2):
+                response = await pool.request("GET", "/", timeout=5)
+                self.assertEqual(response.body, b"ok")
+        finally:
+            await pool.close()
+            server.close()
+        self.assertEqual(len(connections), 2)
+
+
+class AsyncBotTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_fake_telegram_conversations(self):
+        results = await benchmark("async", 3, 0, 10)
+        self.assertEqual(results["replies"], 9)
+
+
+class AsyncBotErrorsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.responses = []
+
+        async def proxy(request):
+            return self.responses.pop(0)
+
+        self.server = await serve(proxy, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.bot = AsyncTelegramBot("test", f"http://127.0.0.1:{port}",
+                                    poll_timeout=0)
+
+    async def asyncTearDown(self):
+        await self.bot.client.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_malformed_responses_keep_polling(self):
+        self.responses = [Response(502, {}, b"<html>Bad Gateway</html>"),
+                          Response(200, {}, b'{"result": []}'),
+                          Response(200, {}, b'{"ok": true, "result": []}')]
+        with mock.patch("telegram_async.asyncio.sleep") as sleep:
+            for _ in range(3):
+                await self.bot.run_async()
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(self.responses, [])
+
+    async def test_unexpected_send_error_is_failed_attempt(self):
+        self.responses = [Response(502, {}, b"<html>Bad Gateway</html>")]
+        self.bot.send_slots = asyncio.Semaphore(1)
+        self.bot.outbound_ready = asyncio.Event()
+        outbound = self.bot.start_outbound()
+        outbound.submit(7, {"chat_id": 7, "text": "tax",
+                            "reply_to_message_id": 1}, 0.0)
+        message, _ = outbound.next_message()
+        await self.bot.send_slots.acquire()
+        await self.bot.send_outbound(message)
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual([chat_id for _, _, chat_id in outbound.delayed],
+                         [7])
+        self.assertEqual(len(outbound), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
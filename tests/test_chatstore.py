@@ -0,0 +1,106 @@
+import unittest
+import os
+import sys
+import tempfile
+sys.path.append('..')
+from chatstore import ChatSessionStore
+from chatstore import SQLiteStorage
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ChatSessionStoreTest(unittest.TestCase):
+
+    def test_ready_queue(self):
+        store = ChatSessionStore()
+        store.add_message(1, 10, "/start")
+        store.add_message(2, 11, "/start")
+        store.add_message(1, 12, "2015")
+        self.assertEqual(store.ready_chat_ids(), [1, 2])
+        self.assertEqual(store.get(1).last_message, "2015")
+        store.mark_processed(1)
+        self.assertEqual(store.ready_chat_ids(), [2])
+        self.assertTrue(store.get(1).processed)
+
+    def test_remove_several_chats(self):
+        store = ChatSessionStore()
+        for chat_id in range(5):
+            store.add_message(chat_id, chat_id, "/start")
+        store.remove(1)
+        store.remove(3)
+        self.assertEqual(list(store.sessions), [0, 2, 4])
+        self.assertEqual(store.ready_chat_ids(), [0, 2, 4])
+
+    def test_evict_expired(self):
+        clock = FakeClock()
+        store = ChatSessionStore(ttl=60, clock=clock)
+        store.add_message(1, 1, "/start")
+        clock.now += 30
+        store.add_message(2, 2, "/start")
+        clock.now += 40
+        self.assertEqual(store.evict_expired(), [1])
+        self.assertNotIn(1, store)
+        self.assertIn(2, store)
+        self.assertEqual(store.ready_chat_ids(), [2])
+
+
+class SQLiteStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bot.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_restart_resumes_sessions_and_offset(self):
+        store = ChatSessionStore(storage=SQLiteStorage(self.path))
+        store.add_message(1, 10, "/start")
+        store.mark_processed(1)
+        store.add_message(1, 11, "2015")
+        store.get(1).prod_year = 2015
+        store.save(1)
+        store.add_message(2, 12, "/start")
+        store.add_message(3, 13, "/start")
+        store.remove(3)
+        store.commit(14)
+        # Not committed changes are lost on crash
+        store.add_message(4, 14, "/start")
+        store.close()
+
+        restarted = ChatSessionStore(storage=SQLiteStorage(self.path))
+        self.assertEqual(restarted.offset, 14)
+        self.assertEqual(list(restarted.sessions), [1, 2])
+        self.assertEqual(restarted.ready_chat_ids(), [1, 2])
+        self.assertEqual(restarted.get(1).prod_year, 2015)
+        self.assertEqual(restarted.get(1).last_message, "2015")
+        self.assertFalse(restarted.get(1).processed)
+        restarted.close()
+
+    def test_not_sent_replies_survive_restart(self):
+        store = ChatSessionStore(storage=SQLiteStorage(self.path))
+        store.add_outbound(1, 10, {"chat_id": 1, "text": "a"}, 5.0)
+        store.add_outbound(2, 11, {"chat_id": 2, "text": "b"}, 6.0)
+        store.add_outbound(3, 12, {"chat_id": 3, "text": "c"}, 7.0)
+        store.remove_outbound(3, 12)
+        store.commit(13)
+        store.remove_outbound(1, 10)
+        store.commit(13)
+        store.close()
+
+        restarted = ChatSessionStore(storage=SQLiteStorage(self.path))
+        self.assertEqual(restarted.take_restored_outbound(),
+                         [(2, {"chat_id": 2, "text": "b"}, 6.0)])
+        self.assertEqual(restarted.take_restored_outbound(), [])
+        restarted.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import os
+import sys
+import tempfile
+import urllib.request
+sys.path.append('..')
+from metrics import Registry
+from metrics import start_http_server
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        errors = self.registry.counter("api_errors_total", "Errors",
+                                       labelnames=("method",))
+        errors.labels("sendMessage").inc()
+        errors.labels("sendMessage").inc(2)
+        sessions = self.registry.gauge("active_sessions", "Sessions")
+        sessions.set_function(lambda: 7)
+        text = self.registry.render()
+        self.assertIn("# TYPE api_errors_total counter\n", text)
+        self.assertIn('api_errors_total{method="sendMessage"} 3\n', text)
+        self.assertIn("active_sessions 7\n", text)
+
+    def test_histogram(self):
+        latency = self.registry.histogram("latency_seconds", "Latency",
+                                          buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            latency.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("latency_seconds_count 4", lines)
+        self.assertIn("latency_seconds_sum 3.65", lines)
+
+    def test_duplicate_name(self):
+        self.registry.counter("requests_total", "Requests")
+        with self.assertRaises(ValueError):
+            self.registry.gauge("requests_total", "Requests")
+
+    def test_textfile_and_http(self):
+        self.registry.counter("requests_total", "Requests").inc()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bot.prom")
+            self.registry.write_textfile(path)
+            with open(path) as textfile:
+                self.assertEqual(textfile.read(), self.registry.render())
+        server = start_http_server(0, "127.0.0.1", self.registry)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            with urllib.request.urlopen(url) as response:
+                self.assertEqual(response.read().decode(),
+                                 self.registry.render())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+import sys
+import threading
+sys.path.append('..')
+from outbound import OutboundScheduler
+from outbound import OutboundSender
+from outbound import RateLimitError
+from outbound import TokenBucket
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refill_and_take(self):
+        bucket = TokenBucket(2, 2, 0.0)
+        for _ in range(2):
+            self.assertEqual(bucket.wait_time(0.0), 0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.wait_time(0.0), 0.5)
+        self.assertEqual(bucket.wait_time(0.5), 0)
+        self.assertFalse(bucket.is_full(0.5))
+        self.assertTrue(bucket.is_full(10.0))
+
+    def test_unlimited(self):
+        bucket = TokenBucket(None, 1, 0.0)
+        for _ in range(100):
+            self.assertEqual(bucket.wait_time(0.0), 0)
+            bucket.take()
+
+    def test_rate_should_be_positive(self):
+        for rate in (0, -1):
+            with self.assertRaises(ValueError):
+                TokenBucket(rate, 1, 0.0)
+
+
+class OutboundSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = OutboundScheduler(rate=2, chat_rate=1, chat_burst=1,
+                                           clock=self.clock)
+
+    def send_all(self):
+        """Send messages as scheduler allows, return (time, text) list"""
+        sent = []
+        while True:
+            message, wait = self.scheduler.next_message()
+            if message is None:
+                if wait is None:
+                    return sent
+                self.clock.now += wait
+                continue
+            sent.append((self.clock.now, message.payload))
+            self.scheduler.sent(message)
+
+    def test_global_and_chat_rate(self):
+        for chat_id in (1, 2, 3):
+            self.scheduler.submit(chat_id, f"{chat_id}a", 0)
+        self.scheduler.submit(1, "1b", 0)
+        self.assertEqual(len(self.scheduler), 4)
+        sent = self.send_all()
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual([text for _, text in sent], ["1a", "2a", "3a", "1b"])
+        # Second message of chat 1 waits for its bucket
+        self.assertEqual(sent[3][0], 1.0)
+        # Global rate 2 per second
+        self.assertEqual(sent[2][0], 0.5)
+
+    def test_chat_in_flight_keeps_order(self):
+        self.scheduler = OutboundScheduler(rate=None, chat_rate=None,
+                                           clock=self.clock)
+        self.scheduler.submit(1, "first", 0)
+        self.scheduler.submit(1, "second", 0)
+        message, _ = self.scheduler.next_message()
+        self.assertEqual(message.payload, "first")
+        self.assertEqual(self.scheduler.next_message(), (None, None))
+        self.scheduler.sent(message)
+        self.assertEqual(self.scheduler.next_message()[0].payload, "second")
+
+    def test_failed_backoff_and_drop(self):
+        self.scheduler.max_attempts = 3
+        self.scheduler.submit(1, "text", 0)
+        message, _ = self.scheduler.next_message()
+        self.assertTrue(self.scheduler.failed(message))
+        retry, wait = self.scheduler.next_message()
+        self.assertIsNone(retry)
+        self.assertTrue(0.5 <= wait <= 1)
+        # Chat bucket allows one message per second
+        self.clock.now = 1
+        message, _ = self.scheduler.next_message()
+        self.assertEqual(message.attempts, 1)
+        self.assertTrue(self.scheduler.failed(message))
+        self.clock.now += 2
+        message, _ = self.scheduler.next_message()
+        self.assertFalse(self.scheduler.failed(message))
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(self.scheduler.next_message(), (None, None))
+
+    def test_rate_limited_pauses_all_chats(self):
+        self.scheduler.submit(1, "1a", 0)
+        self.scheduler.submit(2, "2a", 0)
+        message, _ = self.scheduler.next_message()
+        self.scheduler.rate_limited(message, 5)
+        self.assertEqual(self.scheduler.next_message(), (None, 5))
+        self.clock.now = 5
+        sent = self.send_all()
+        self.assertEqual([text for _, text in sent], ["1a", "2a"])
+
+    def test_prune_buckets(self):
+        self.scheduler.submit(1, "text", 0)
+        self.send_all()
+        self.assertIn(1, self.scheduler.chat_buckets)
+        self.clock.now += self.scheduler.prune_interval
+        self.scheduler.next_message()
+        self.assertEqual(self.scheduler.chat_buckets, {})
+
+
+class OutboundSenderTest(unittest.TestCase):
+
+    def test_retry_and_rate_limit(self):
+        scheduler = OutboundScheduler(rate=None, chat_rate=None, backoff=0.01)
+        calls = []
+        sent = []
+        done = threading.Event()
+
+        def send(payload):
+            calls.append(payload)
+            if len(calls) == 1:
+                raise RateLimitError("429", 0.01)
+            if len(calls) == 2:
+                raise ValueError("network")
+            return len(calls)
+
+        def on_sent(message, result):
+            sent.append((message.payload, result))
+            done.set()
+
+        sender = OutboundSender(scheduler, send, (ValueError,), on_sent,
+                                threads=2)
+        sender.submit(1, "text", 0)
+        self.assertTrue(done.wait(5))
+        sender.stop(5)
+        self.assertEqual(calls, ["text"] * 3)
+        self.assertEqual(sent, [("text", 3)])
+        self.assertEqual(len(scheduler), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+sys.path.append('..')
+from profiling import NULL_SPAN
+from profiling import SamplingProfiler
+from profiling import Tracer
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TracerTest(unittest.TestCase):
+
+    def test_disabled_tracer_records_nothing(self):
+        tracer = Tracer()
+        self.assertIs(tracer.span("parse"), NULL_SPAN)
+        with tracer.span("parse"):
+            pass
+        self.assertEqual(tracer.totals, {})
+
+    def test_stage_totals(self):
+        tracer = Tracer()
+        tracer.enable(report_at_exit=False)
+        with tracer.span("parse"):
+            pass
+        self.assertEqual(tracer.wrap("lookup", max)(1, 2), 2)
+        self.assertEqual(list(tracer.wrap_iter("read", [1, 2])), [1, 2])
+        counts = {name: count
+                  for name, (_, count) in tracer.totals.items()}
+        # Last read call is the end of iteration
+        self.assertEqual(counts, {"parse": 1, "lookup": 1, "read": 3})
+        report = tracer.report().splitlines()
+        self.assertEqual(report[0].split(),
+                         ["stage", "calls", "total", "s", "mean", "us",
+                          "share"])
+        self.assertEqual(len(report), 4)
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def test_collapsed_stacks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "profile.folded")
+            stop = threading.Event()
+            worker = threading.Thread(target=busy_loop, args=(stop,),
+                                      name="busy")
+            worker.start()
+            profiler = SamplingProfiler(path, interval=0.001)
+            profiler.start()
+            stop.wait(0.1)
+            profiler.stop()
+            stop.set()
+            worker.join()
+            with open(path, encoding="utf-8") as profile:
+                lines = profile.read().splitlines()
+        busy = [line for line in lines if line.startswith("busy;")]
+        self.assertTrue(busy, lines)
+        stack, count = busy[0].rsplit(" ", 1)
+        self.assertIn("busy_loop (test_profiling.py:", stack)
+        self.assertGreater(int(count), 0)
+
+
+class CommandLineProfileTest(unittest.TestCase):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def test_bulk_profile_and_trace(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "taxcalc.pstats")
+            result = subprocess.run(
+                [sys.executable, "taxcalc.py", "--input", "-", "--trace",
+                 "--profile", "cprofile", "--profile-output", path],
+                cwd=self.root, input="prod_year,horsepowers\n2015,150\n",
+                capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            stats = pstats.Stats(path)
+        functions = {name for _, _, name in stats.stats}
+        self.assertIn("calculate_bulk_lines", functions)
+        stages = [line.split()[0] for line in result.stderr.splitlines()]
+        for stage in ("parse", "validate", "lookup", "format", "write"):
+            self.assertIn(stage, stages)
+
+    def test_trace_of_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cars.csv")
+            with open(path, "w", encoding="utf-8") as cars:
+                cars.write("prod_year,horsepowers\n")
+                cars.writelines(f"2015,{hp}\n" for hp in range(100, 200))
+            command = [sys.executable, "taxcalc.py", "--input", path,
+                       "--workers", "2", "--trace"]
+            result = subprocess.run(command, cwd=self.root,
+                                    capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            profiled = subprocess.run(command + ["--profile", "sample"],
+                                      cwd=self.root, capture_output=True,
+                                      text=True)
+        counts = {line.split()[0]: int(line.split()[1])
+                  for line in result.stderr.splitlines()[1:]}
+        self.assertEqual(counts["lookup"], 100)
+        self.assertEqual(counts["validate"], 200)
+        self.assertEqual(profiled.returncode, 2)
+        self.assertIn("--profile", profiled.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import asyncio
+import json
+import sys
+sys.path.append('..')
+from asynchttp import ConnectionPool
+from asynchttp import encode_message
+from asynchttp import read_body
+from asynchttp import read_headers
+from taxcalc import CLOCK
+from taxcalc import calculate_tax
+from tax_api import TaxApi
+
+
+class TaxApiTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = await TaxApi().start()
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.client = ConnectionPool(f"http://127.0.0.1:{self.port}",
+                                     size=1)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def get(self, target, headers=None):
+        return await self.client.request("GET", target, headers=headers)
+
+    async def test_get_tax(self):
+        response = await self.get("/tax?year=15&hp=150&as_of=2020")
+        self.assertEqual(response.status, 200)
+        result = calculate_tax(2015, 150, as_of=2020)
+        self.assertEqual(json.loads(response.body),
+                         {"year": 2015, "hp": 150, "tax_age": 5,
+                          "bracket": result.bracket, "tax": result.amount})
+
+    async def test_cache_headers(self):
+        response = await self.get("/tax?year=2015&hp=150")
+        etag = response.headers["etag"]
+        self.assertTrue(etag.startswith(f'"{CLOCK.year()}-'))
+        self.assertIn("max-age=", response.headers["cache-control"])
+        response = await self.get("/tax?year=2015&hp=150",
+                                  {"If-None-Match": etag})
+        self.assertEqual((response.status, response.body), (304, b""))
+        # Other tax year has other ETag
+        response = await self.get("/tax?year=2015&hp=150&as_of=2020",
+                                  {"If-None-Match": etag})
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.headers["etag"].startswith('"2020-'))
+        # Wrong query with cached ETag is not 304
+        response = await self.get("/tax?year=2015&hp=0",
+                                  {"If-None-Match": etag})
+        self.assertEqual(response.status, 400)
+
+    async def test_get_errors(self):
+        for target in ("/tax?year=2015", "/tax?year=x&hp=150",
+                       "/tax?year=2015&hp=0", "/tax?year=2015&hp=1&as_of=x",
+                       "/tax?year=2015&hp=1_50", "/tax?year=2015&hp=150.7",
+                       "/tax?year=2015&hp=%20150%20",
+                       "/tax?year=2015&hp=-150",
+                       "/tax?year=2015&hp=100&as_of=0",
+                       "/tax?year=2015&hp=100&as_of=10000"):
+            response = await self.get(target)
+            self.assertEqual(response.status, 400, target)
+            self.assertIn("error", json.loads(response.body))
+        self.assertEqual((await self.get("/taxes")).status, 404)
+        response = await self.client.request("POST", "/tax")
+        self.assertEqual((response.status, response.headers["allow"]),
+                         (405, "GET"))
+
+    async def test_batch(self):
+        cars = [{"year": 2015, "hp": 150, "as_of": 2020},
+                {"year": 2015, "hp": 100, "as_of": "2020-05-01"},
+                {"year": 2021, "hp": 100, "as_of": 2020},
+                {"year": 2015},
+                ["2015", 150],
+                {"year": 2015.9, "hp": 150},
+                {"year": 2015, "hp": "1_50"},
+                {"year": "2015", "hp": 150},
+                {"year": 2015, "hp": True}]
+        response = await self.client.request(
+            "POST", "/tax/batch", json.dumps(cars).encode("utf-8"))
+        self.assertEqual(response.status, 200)
+        results = json.loads(response.body)
+        self.assertEqual([result.get("tax") for result in results],
+                         [calculate_tax(2015, 150, as_of=2020).amount, 1050,
+                          None, None, None, None, None, None, None])
+        self.assertEqual(results[2],
+                         {"error": "Production year could not be greater "
+                                   "than current"})
+        self.assertEqual(results[3], {"error": "hp should be integer: None"})
+        self.assertEqual(results[5],
+                         {"error": "year should be integer: 2015.9"})
+        self.assertEqual(results[6],
+                         {"error": "hp should be integer: '1_50'"})
+
+    async def test_batch_errors(self):
+        for body in (b"{", b'{"year": 2015}'):
+            response = await self.client.request("POST", "/tax/batch", body)
+            self.assertEqual(response.status, 400, body)
+
+    async def test_pipelining(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                       self.port)
+        targets = [f"/tax?year=2015&hp={hp}&as_of=2020"
+                   for hp in range(1, 21)]
+        writer.write(b"".join(encode_message(f"GET {target} HTTP/1.1",
+                                             {"Host": "localhost"}, b"")
+                              for target in targets))
+        taxes = []
+        for _ in targets:
+            await reader.readline()
+            headers = await read_headers(reader)
+            taxes.append(json.loads(await read_body(reader, headers))["tax"])
+        writer.close()
+        self.assertEqual(taxes, [calculate_tax(2015, hp, as_of=2020).amount
+                                 for hp in range(1, 21)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,37 @@
 import unittest
 import datetime
+import io
+import json
+import logging
+import os
 import sys
+import subprocess
+import tempfile
+from unittest import mock
 sys.path.append('..')
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from taxcalc import CarEcoTax
 from taxcalc import CarEcoTaxProdYearError
 from taxcalc import CarEcoTaxHorsePowerError
+from taxcalc import rate_table
+from taxcalc import calculate_bulk_lines
+from taxcalc import write_bulk_results
+from taxcalc import bulk_shards
+from taxcalc import shard_byte_ranges
+from taxcalc import TaxCache
+from taxcalc import FixedClock
+from taxcalc import SystemClock
+from taxcalc import TaxResult
+from taxcalc import TaxResultBatch
+from taxcalc import calculate_tax
+from taxcalc import DEFAULT_SCHEDULE
+from taxcalc import ScheduleReloader
+from taxcalc import TaxSchedule
+from taxcalc import parse_simple_args
+from taxcalc import serve_lines
 
 
 class CatEcoTaxTest(unittest.TestCase):
@@ -123,5 +150,640 @@ class CatEcoTaxTest(unittest.TestCase):
             CarEcoTax(prod_year, horse_powers).calculate()
 
 
+class CarEcoTaxLoggingTest(unittest.TestCase):
+
+    def test_log_argument_does_not_configure_root_logger(self):
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        CarEcoTax(2015, 150, log=True).calculate()
+        self.assertEqual(root.handlers, handlers)
+
+    def test_debug_messages_use_module_logger(self):
+        with self.assertLogs("taxcalc", level=logging.DEBUG) as logs:
+            CarEcoTax(2015, 400).calculate()
+        self.assertIn("DEBUG:taxcalc:set tax age to", logs.output[1])
+        self.assertTrue(any("more then 300 horse powers: 400" in line
+                            for line in logs.output))
+
+
+class TaxResultTest(unittest.TestCase):
+
+    def test_calculate_tax_matches_calculator(self):
+        for year, hp in ((2015, 50), (2018, 95), (2010, 301), (2019, 151)):
+            tax = CarEcoTax(year, hp, as_of=2020)
+            result = calculate_tax(year, hp, as_of=2020)
+            self.assertEqual(result.amount, tax.calculate())
+            self.assertEqual(result, tax.result())
+            self.assertEqual(result.tax_age, tax.car_tax_age)
+            self.assertEqual(rate_table().bracket(hp), result.bracket)
+
+    def test_calculate_tax_normalizes_two_digit_year(self):
+        self.assertEqual(calculate_tax(15, 100, as_of=2020),
+                         TaxResult(2015, 100, 5, 2, 1050))
+
+    def test_calculate_tax_errors(self):
+        with self.assertRaises(CarEcoTaxProdYearError):
+            calculate_tax(2021, 100, as_of=2020)
+        with self.assertRaises(CarEcoTaxHorsePowerError):
+            calculate_tax(2015, 0)
+
+    def test_result_is_immutable(self):
+        result = calculate_tax(2015, 100, as_of=2020)
+        with self.assertRaises(AttributeError):
+            result.amount = 0
+        with self.assertRaises(AttributeError):
+            result.note = "note"
+
+    def test_calculator_has_no_instance_dict(self):
+        with self.assertRaises(AttributeError):
+            CarEcoTax(2015, 100).__dict__
+
+    def test_batch_round_trip(self):
+        results = [calculate_tax(year, hp, as_of=2020)
+                   for year, hp in ((2015, 50), (2018, 95), (2010, 301))]
+        batch = TaxResultBatch(results)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(list(batch), results)
+        self.assertEqual(batch[-1], results[-1])
+        self.assertEqual(batch.nbytes, 3 * 20)
+
+    def test_batch_calculate_without_numpy(self):
+        batch = TaxResultBatch()
+        rejected = batch._calculate_each([2015, 2021, 2010], [100, 100, 0],
+                                         as_of=2020)
+        self.assertEqual(rejected, [1, 2])
+        self.assertEqual(list(batch), [calculate_tax(2015, 100, as_of=2020)])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_batch_calculate_matches_calculate_tax(self):
+        years = [2015, 2021, 15, 2010, 2019, "2015", 2018]
+        horse_powers = [100, 100, 120, 0, 301, 100, 77]
+        batch = TaxResultBatch()
+        rejected = batch.calculate(years, horse_powers, as_of=2020)
+        self.assertEqual(rejected, [1, 3, 5])
+        expected = [calculate_tax(years[index], horse_powers[index],
+                                  as_of=2020)
+                    for index in (0, 2, 4, 6)]
+        self.assertEqual(list(batch), expected)
+
+
+class TaxRateTableTest(unittest.TestCase):
+
+    @staticmethod
+    def range_chain_tax(horse_powers, car_tax_age):
+        """Tax by the range() chain formula which rate table replaced"""
+        tax_per_hp = rate_table().tax_per_hp
+        if horse_powers in range(0, 51):
+            tax_data = tax_per_hp["from_0_to_50"]
+        elif horse_powers in range(51, 81):
+            tax_data = tax_per_hp["from_51_to_80"]
+        elif horse_powers in range(81, 101):
+            tax_data = tax_per_hp["from_81_to_100"]
+        elif horse_powers in range(101, 151):
+            tax_data = tax_per_hp["from_101_to_150"]
+        elif horse_powers in range(151, 201):
+            tax_data = tax_per_hp["from_151_to_200"]
+        elif horse_powers in range(200, 251):
+            tax_data = tax_per_hp["from_201_to_250"]
+        elif horse_powers in range(250, 301):
+            tax_data = tax_per_hp["from_251_to_300"]
+        else:
+            tax_data = tax_per_hp["more_then_300"]
+        return horse_powers * (tax_data["for_three_years"]
+                               + ((car_tax_age - 3)
+                                  * (tax_data["per_additional_year"])))
+
+    def test_rate_table_matches_range_chain(self):
+        for car_tax_age in rate_table().tax_ages:
+            for horse_powers in range(1, 2001):
+                expected = self.range_chain_tax(horse_powers, car_tax_age)
+                testcase = horse_powers * rate_table().rate(horse_powers,
+                                                            car_tax_age)
+                error_message = f"Eco tax for {horse_powers} hp and " \
+                                f"{car_tax_age} tax age should be {expected}"
+                self.assertEqual(testcase, expected, error_message)
+                self.assertIs(type(testcase), type(expected), error_message)
+
+    def test_bracket_bounds(self):
+        self.assertEqual(rate_table().upper_bounds,
+                         (50, 80, 100, 150, 200, 250, 300))
+        self.assertEqual(rate_table().bracket(200), 4)
+        self.assertEqual(rate_table().bracket(201), 5)
+        self.assertEqual(rate_table().bracket(250), 5)
+        self.assertEqual(rate_table().bracket(251), 6)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class CarEcoTaxCalculateManyTest(unittest.TestCase):
+
+    def test_matches_scalar_calculate(self):
+        current_year = datetime.datetime.today().year
+        years = [year for year in range(current_year - 12, current_year + 1)
+                 for _ in range(1, 400)]
+        horse_powers = [hp for _ in range(current_year - 12, current_year + 1)
+                        for hp in range(1, 400)]
+        taxes, errors = CarEcoTax.calculate_many(years, horse_powers)
+        self.assertFalse(errors.any())
+        for year, hp, tax in zip(years, horse_powers, taxes):
+            expected = CarEcoTax(year, hp).calculate()
+            self.assertEqual(tax, expected, f"{year} year and {hp} hp")
+
+    def test_two_digit_production_year(self):
+        year = datetime.datetime.today().year - 5
+        taxes, errors = CarEcoTax.calculate_many(numpy.array([year % 100]),
+                                                 numpy.array([120]))
+        self.assertEqual(taxes[0], CarEcoTax(year, 120).calculate())
+
+    def test_as_of(self):
+        taxes, errors = CarEcoTax.calculate_many([2015, 2021], [100, 100],
+                                                 as_of=2020)
+        self.assertEqual(errors.tolist(), [False, True])
+        self.assertEqual(taxes[0], 1050)
+
+    def test_invalid_rows_error_mask(self):
+        next_year = datetime.datetime.today().year + 1
+        years = [2015, next_year, 198, 0, -1, "random_string", 2015, 2015]
+        horse_powers = [100, 100, 100, 100, 100, 100, 0, "random_string"]
+        taxes, errors = CarEcoTax.calculate_many(years, horse_powers)
+        self.assertEqual(errors.tolist(),
+                         [False, True, True, True, True, True, True, True])
+        self.assertEqual(taxes[0], CarEcoTax(2015, 100).calculate())
+        self.assertTrue(numpy.isnan(taxes[1:]).all())
+
+    def test_out_of_int64_range(self):
+        for years, horse_powers in (([2015, 10 ** 20], [100, 100]),
+                                    ([2015, 2015], [100, -10 ** 20]),
+                                    ([2015, 2015], [100, 2 ** 63]),
+                                    ([2015, 2015],
+                                     numpy.array([100, 2 ** 64 - 1],
+                                                 dtype=numpy.uint64))):
+            taxes, errors = CarEcoTax.calculate_many(years, horse_powers)
+            self.assertEqual(errors.tolist(), [False, True])
+            self.assertEqual(taxes[0], CarEcoTax(2015, 100).calculate())
+
+
+class BulkModeTest(unittest.TestCase):
+
+    def run_bulk(self, text, input_format, chunk_size=2):
+        output, rejects = io.StringIO(), io.StringIO()
+        results = calculate_bulk_lines(io.StringIO(text), input_format)
+        counts = write_bulk_results(results, output, rejects, chunk_size)
+        return output.getvalue(), rejects.getvalue(), counts
+
+    def test_csv_matches_single_car_calculation(self):
+        year = datetime.datetime.today().year - 6
+        text = f"prod_year,horsepowers\n{year},251\n{year % 100},100\n"
+        output, rejects, counts = self.run_bulk(text, "csv")
+        expected = f"prod_year,horsepowers,tax\n" \
+                   f"{year},251,{CarEcoTax(year, 251).calculate()}\n" \
+                   f"{year % 100},100,{CarEcoTax(year, 100).calculate()}\n"
+        self.assertEqual(output, expected)
+        self.assertEqual(rejects, "")
+        self.assertEqual(counts, (3, 0))
+
+    def test_csv_malformed_rows_rejected(self):
+        next_year = datetime.datetime.today().year + 1
+        text = f"prod_year,horsepowers\n2015,abc\n{next_year},100\n" \
+               f"2015\n2015,100\n"
+        output, rejects, counts = self.run_bulk(text, "csv")
+        self.assertEqual(output.splitlines()[1:],
+                         [f"2015,100,{CarEcoTax(2015, 100).calculate()}"])
+        self.assertEqual([json.loads(line)["record"]
+                          for line in rejects.splitlines()],
+                         ["2015,abc", f"{next_year},100", "2015"])
+        self.assertEqual(counts, (2, 3))
+
+    def test_not_utf8_and_malformed_csv_rejected(self):
+        # Not UTF-8 bytes as read with surrogateescape
+        text = "prod_year,horsepowers\n2015,1\udcff0\n" \
+               "2015,\"a\udce9\nb\"\n" + "1" * 200000 + ",1\n" \
+               "2015,100\n"
+        output, rejects, counts = self.run_bulk(text, "csv")
+        self.assertEqual(output.splitlines()[1:],
+                         [f"2015,100,{CarEcoTax(2015, 100).calculate()}"])
+        rejected = [json.loads(line) for line in rejects.splitlines()]
+        self.assertEqual([reject["error"] for reject in rejected[:2]],
+                         ["Record is not valid UTF-8"] * 2)
+        self.assertEqual(rejected[0]["record"], "2015,1\\xff0")
+        self.assertTrue(rejected[2]["error"].startswith("Malformed CSV: "))
+        self.assertEqual(counts, (2, 3))
+
+    def test_values_are_plain_digits(self):
+        text = "prod_year,horsepowers\n2015,1_00\n2015,+100\n" \
+               "2015, 100\n2015,100\n"
+        output, rejects, counts = self.run_bulk(text, "csv")
+        self.assertEqual(output.splitlines()[1:],
+                         [f"2015,100,{CarEcoTax(2015, 100).calculate()}"])
+        self.assertEqual([json.loads(line)["error"]
+                          for line in rejects.splitlines()],
+                         ["horsepowers should be integer: '1_00'",
+                          "horsepowers should be integer: '+100'",
+                          "horsepowers should be integer: ' 100'"])
+        output, rejects, counts = self.run_bulk(
+            '{"prod_year": "2015", "horsepowers": "1_00"}\n', "jsonl")
+        self.assertEqual(counts, (0, 1))
+
+    def test_csv_quoted_line_breaks(self):
+        text = 'note,prod_year,horsepowers\n"multi\nline",2015,150\n' \
+               '"a\r\nb",x,1\n'
+        output, rejects, counts = self.run_bulk(text, "csv")
+        tax = CarEcoTax(2015, 150).calculate()
+        self.assertEqual(output, f'note,prod_year,horsepowers,tax\n'
+                                 f'"multi\nline",2015,150,{tax}\n')
+        self.assertEqual(json.loads(rejects)["record"], '"a\r\nb",x,1')
+        self.assertEqual(counts, (2, 1))
+
+    def test_jsonl(self):
+        text = '{"prod_year": 2015, "horsepowers": 150}\n' \
+               'not json\n' \
+               '{"prod_year": 2015}\n'
+        output, rejects, counts = self.run_bulk(text, "jsonl")
+        self.assertEqual(json.loads(output),
+                         {"prod_year": 2015, "horsepowers": 150,
+                          "tax": CarEcoTax(2015, 150).calculate()})
+        self.assertEqual(len(rejects.splitlines()), 2)
+        self.assertEqual(counts, (1, 2))
+
+
+class BulkShardsTest(unittest.TestCase):
+
+    def setUp(self):
+        lines = ["prod_year,horsepowers\n"]
+        for row in range(500):
+            lines.append(f"{1990 + row % 45},{row % 420 - 5}\r\n")
+        lines.append("broken line\n")
+        file, self.path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(file, "w", newline="") as csv_file:
+            csv_file.writelines(lines)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_byte_ranges_start_at_line_start(self):
+        ranges = shard_byte_ranges(self.path, 7)
+        with open(self.path, "rb") as file:
+            data = file.read()
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(data[next_start - 1:next_start], b"\n")
+
+    def assert_same_output(self, shards_count: int) -> list:
+        output, rejects = io.StringIO(), io.StringIO()
+        with open(self.path, encoding="utf-8", errors="surrogateescape",
+                  newline="") as source:
+            write_bulk_results(calculate_bulk_lines(source, "csv"),
+                               output, rejects, 1000)
+        shards = list(bulk_shards(self.path, "csv", workers=2,
+                                  shards=shards_count))
+        self.assertEqual("".join(shard[0] for shard in shards),
+                         output.getvalue())
+        self.assertEqual("".join(shard[1] for shard in shards),
+                         rejects.getvalue())
+        return shards
+
+    def test_same_output_as_single_process(self):
+        shards = self.assert_same_output(5)
+        self.assertEqual(sum(shard[2].written + shard[2].rejected
+                             for shard in shards[1:]), 501)
+
+    def test_quoted_line_breaks_and_not_utf8(self):
+        with open(self.path, "wb") as csv_file:
+            csv_file.write(b"prod_year,horsepowers,note\n")
+            for row in range(200):
+                csv_file.write(f'2015,{100 + row},"first\nsecond ""{row}""'
+                               f'\nthird"\n'.encode("utf-8"))
+            csv_file.write(b"2015,100,\xff\n")
+        ranges = shard_byte_ranges(self.path, 7, quoted=True)
+        with open(self.path, "rb") as file:
+            data = file.read()
+        for start, _ in ranges[1:]:
+            self.assertEqual(data[start:start + 5], b"2015,")
+        shards = self.assert_same_output(7)
+        self.assertEqual(len(shards), 8)
+        expected = "prod_year,horsepowers,note,tax\n" + "".join(
+            f'2015,{100 + row},"first\nsecond ""{row}""\nthird",'
+            f'{CarEcoTax(2015, 100 + row).calculate()}\n'
+            for row in range(200))
+        self.assertEqual("".join(shard[0] for shard in shards), expected)
+        self.assertEqual("".join(shard[1] for shard in shards),
+                         '{"error": "Record is not valid UTF-8", '
+                         '"record": "2015,100,\\\\xff"}\n')
+
+    def test_shards_use_date_of_single_process(self):
+        schedule_path = self.path + ".json"
+        self.addCleanup(os.remove, schedule_path)
+        tax_per_hp = rate_table().tax_per_hp
+        doubled = {name: {key: value * 2 for key, value in rate.items()}
+                   for name, rate in tax_per_hp.items()}
+        with open(schedule_path, "w") as schedule_file:
+            json.dump({"version": 1, "schedules": [
+                {"effective_from": "2000-01-01", "tax_per_hp": tax_per_hp},
+                {"effective_from": "2021-07-01", "tax_per_hp": doubled}]},
+                schedule_file)
+        with open(self.path, "w") as csv_file:
+            csv_file.write("prod_year,horsepowers\n2015,100\n")
+        today = datetime.date(2021, 3, 1)
+        with mock.patch("taxcalc.SCHEDULES",
+                        ScheduleReloader(schedule_path)), \
+                mock.patch("taxcalc.CLOCK", FixedClock(today)):
+            shards = list(bulk_shards(self.path, "csv", workers=2))
+            tax = CarEcoTax(2015, 100).calculate()
+        self.assertEqual(tax, 1200)
+        self.assertEqual("".join(shard[0] for shard in shards),
+                         f"prod_year,horsepowers,tax\n2015,100,{tax}\n")
+
+
+class TaxCacheTest(unittest.TestCase):
+
+    def test_same_result_as_calculate(self):
+        cache = TaxCache()
+        year = datetime.datetime.today().year - 4
+        for _ in range(2):
+            for horse_powers in (50, 150, 251, 350):
+                self.assertEqual(cache.calculate(year, horse_powers),
+                                 CarEcoTax(year, horse_powers).calculate())
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (4, 4))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_two_digit_year_shares_entry(self):
+        cache = TaxCache()
+        cache.calculate(2015, 100)
+        cache.calculate(15, 100)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_lru_eviction(self):
+        cache = TaxCache(maxsize=2)
+        cache.calculate(2015, 100)
+        cache.calculate(2015, 200)
+        cache.calculate(2015, 100)
+        cache.calculate(2015, 300)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual([key[1] for key in cache.entries], [100, 300])
+
+    def test_year_rollover_drops_entries(self):
+        year = [2030]
+        cache = TaxCache(current_year=lambda: year[0])
+        cache.calculate(2015, 100)
+        year[0] = 2031
+        cache.calculate(2015, 200)
+        self.assertEqual([key[:3] for key in cache.entries],
+                         [(2015, 200, 2031)])
+
+    def test_errors_are_not_cached(self):
+        cache = TaxCache()
+        with self.assertRaises(CarEcoTaxHorsePowerError):
+            cache.calculate(2015, 0)
+        with self.assertRaises(CarEcoTaxProdYearError):
+            cache.calculate(2015.0, 100)
+        self.assertEqual(len(cache.entries), 0)
+
+
+class AsOfTest(unittest.TestCase):
+
+    def test_as_of_year(self):
+        car_eco_tax = CarEcoTax(2015, 100, as_of=2020)
+        self.assertEqual(car_eco_tax.car_tax_age, 5)
+        self.assertEqual(car_eco_tax.calculate(), 1050)
+
+    def test_as_of_date(self):
+        car_eco_tax = CarEcoTax(10, 100, as_of=datetime.date(2010, 3, 1))
+        self.assertEqual(car_eco_tax.car_tax_age, 1)
+        self.assertEqual(car_eco_tax.calculate(), 450)
+
+    def test_production_year_after_as_of(self):
+        with self.assertRaises(CarEcoTaxProdYearError):
+            CarEcoTax(2015, 100, as_of=2014)
+
+    def test_cache_as_of(self):
+        cache = TaxCache()
+        self.assertEqual(cache.calculate(2015, 100, as_of=2020), 1050)
+        self.assertEqual(cache.calculate(2015, 100, as_of=2016), 750)
+
+    def test_clocks(self):
+        self.assertEqual(SystemClock().year(),
+                         datetime.date.today().year)
+        self.assertEqual(FixedClock(2020).year(), 2020)
+        self.assertEqual(FixedClock(datetime.datetime(2019, 5, 1)).today(),
+                         datetime.date(2019, 5, 1))
+
+
+class TaxScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "tax_schedule.json")
+        self.tax_per_hp = rate_table().tax_per_hp
+        # Everything twice as expensive from 2021
+        self.doubled = {
+            name: {key: value * 2 for key, value in rate.items()}
+            for name, rate in self.tax_per_hp.items()}
+        self.write_schedules([("2000-01-01", self.tax_per_hp)])
+
+    def write_schedules(self, schedules, version=1):
+        with open(self.path, "w") as schedule_file:
+            json.dump({"version": version,
+                       "schedules": [{"effective_from": effective_from,
+                                      "tax_per_hp": tax_per_hp}
+                                     for effective_from, tax_per_hp
+                                     in schedules]},
+                      schedule_file)
+
+    def reloader(self):
+        reloader = ScheduleReloader(self.path)
+        patcher = mock.patch("taxcalc.SCHEDULES", reloader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return reloader
+
+    def test_bundled_schedule(self):
+        self.assertEqual(rate_table().upper_bounds,
+                         (50, 80, 100, 150, 200, 250, 300))
+
+    def test_effective_from(self):
+        schedule = TaxSchedule({"version": 1, "schedules": [
+            {"effective_from": "2021-07-01", "tax_per_hp": self.doubled},
+            {"effective_from": "2000-01-01", "tax_per_hp": self.tax_per_hp}
+        ]})
+        self.assertIs(schedule.table(2020).tax_per_hp, self.tax_per_hp)
+        self.assertIs(schedule.table(datetime.date(2021, 6, 30)).tax_per_hp,
+                      self.tax_per_hp)
+        self.assertIs(schedule.table(datetime.date(2021, 7, 1)).tax_per_hp,
+                      self.doubled)
+        self.assertIs(schedule.table(2021).tax_per_hp, self.doubled)
+        self.assertIs(schedule.table(1990).tax_per_hp, self.tax_per_hp)
+
+    def test_wrong_schedules(self):
+        for data in ({"version": 2, "schedules": []},
+                     {"version": 1, "schedules": []},
+                     {"version": 1, "schedules": [{"tax_per_hp": {}}]},
+                     {"version": 1, "schedules": [
+                         {"effective_from": "2000-01-01",
+                          "tax_per_hp": {"from_0_to_50": {}}}]}):
+            with self.assertRaises(ValueError, msg=data):
+                TaxSchedule(data)
+
+    def test_calculation_uses_schedule_as_of(self):
+        self.write_schedules([("2000-01-01", self.tax_per_hp),
+                              ("2021-01-01", self.doubled)])
+        self.reloader()
+        self.assertEqual(CarEcoTax(2015, 100, as_of=2020).calculate(), 1050)
+        self.assertEqual(CarEcoTax(2015, 100, as_of=2021).calculate(), 2400)
+        self.assertEqual(calculate_tax(2015, 100, as_of=2021).amount, 2400)
+        cache = TaxCache()
+        self.assertEqual(cache.calculate(2015, 100, as_of=2020), 1050)
+        self.assertEqual(cache.calculate(2015, 100, as_of=2021), 2400)
+
+    def test_reload_on_file_change(self):
+        reloader = self.reloader()
+        cache = TaxCache()
+        self.assertEqual(cache.calculate(2015, 100, as_of=2020), 1050)
+        self.write_schedules([("2000-01-01", self.doubled)])
+        os.utime(self.path, ns=(0, 0))
+        # File is checked at most once per check_interval
+        self.assertEqual(cache.calculate(2015, 100, as_of=2020), 1050)
+        reloader.next_check_at = 0
+        self.assertEqual(cache.calculate(2015, 100, as_of=2020), 2100)
+        self.assertEqual(CarEcoTax(2015, 100, as_of=2020).calculate(), 2100)
+
+    def test_wrong_file_keeps_schedule(self):
+        reloader = self.reloader()
+        schedule = reloader.schedule
+        self.write_schedules([], version=1)
+        with self.assertLogs("taxcalc", level="ERROR"):
+            self.assertFalse(reloader.reload())
+        self.assertIs(reloader.schedule, schedule)
+        self.assertEqual(CarEcoTax(2015, 100, as_of=2020).calculate(), 1050)
+
+    def test_reload_request(self):
+        reloader = self.reloader()
+        schedule = reloader.schedule
+        reloader.request_reload()
+        self.assertIsNot(reloader.check(), schedule)
+        self.assertFalse(reloader.reload_requested)
+
+    def test_missing_file_uses_default_schedule(self):
+        os.remove(self.path)
+        reloader = self.reloader()
+        self.assertIs(reloader.schedule, DEFAULT_SCHEDULE)
+        self.assertFalse(reloader.reload(force=False))
+        self.assertEqual(CarEcoTax(2015, 100, as_of=2020).calculate(), 1050)
+        self.write_schedules([("2000-01-01", self.doubled)])
+        self.assertTrue(reloader.reload(force=False))
+        self.assertEqual(CarEcoTax(2015, 100, as_of=2020).calculate(), 2100)
+
+    def test_wrong_file_at_start_uses_default_schedule(self):
+        self.write_schedules([], version=1)
+        with self.assertLogs("taxcalc", level="ERROR"):
+            reloader = self.reloader()
+        self.assertIs(reloader.schedule, DEFAULT_SCHEDULE)
+
+    def test_tax_per_hp(self):
+        tax = CarEcoTax(2015, 100, as_of=2020)
+        self.assertIs(tax.tax_per_hp, tax.rate_table.tax_per_hp)
+        self.assertEqual(tax.tax_per_hp, self.tax_per_hp)
+        with self.assertRaises(AttributeError):
+            tax.tax_per_hp = {}
+        self.assertEqual(CarEcoTax.tax_per_hp, self.tax_per_hp)
+        self.assertEqual(CarEcoTax.tax_per_hp["more_then_300"],
+                         {"for_three_years": 25, "per_additional_year": 5})
+
+    def test_wrong_as_of_year(self):
+        schedule = TaxSchedule({"version": 1, "schedules": [
+            {"effective_from": "2021-07-01", "tax_per_hp": self.doubled},
+            {"effective_from": "2000-01-01", "tax_per_hp": self.tax_per_hp}
+        ]})
+        for as_of in (0, 10000):
+            with self.assertRaises(CarEcoTaxProdYearError):
+                schedule.table(as_of)
+        with self.assertRaises(CarEcoTaxProdYearError):
+            CarEcoTax(2015, 100, as_of=10000)
+
+    def test_instance_keeps_table_after_reload(self):
+        reloader = self.reloader()
+        tax = CarEcoTax(2015, 100, as_of=2020)
+        self.write_schedules([("2000-01-01", self.doubled)])
+        reloader.reload()
+        self.assertEqual(tax.calculate(), 1050)
+
+
+class CommandLineTest(unittest.TestCase):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def run_taxcalc(self, *args, input=None):
+        return subprocess.run([sys.executable, "taxcalc.py", *args],
+                              cwd=self.root, input=input,
+                              capture_output=True, text=True)
+
+    def test_import_skips_heavy_modules(self):
+        code = "import sys, taxcalc; " \
+               "print([name for name in ('argparse', 'logging', 'csv', " \
+               "'profiling') " \
+               "if name in sys.modules])"
+        output = subprocess.run([sys.executable, "-c", code], cwd=self.root,
+                                capture_output=True, text=True,
+                                check=True).stdout
+        self.assertEqual(output, "[]\n")
+
+    def test_parse_simple_args(self):
+        self.assertEqual(parse_simple_args(["-p", "150", "-y", "2015"]),
+                         (2015, 150))
+        self.assertEqual(parse_simple_args(["--prod-year", "15",
+                                            "--horsepowers", "-1"]),
+                         (15, -1))
+        for argv in (["-p", "150"], ["-p", "150", "-p", "150"],
+                     ["-p", "150", "-y", "x"],
+                     ["-p", "150", "--as-of", "2020"],
+                     ["-p", "150", "-y", "2015", "--debug"]):
+            self.assertIsNone(parse_simple_args(argv), argv)
+
+    def test_simple_call(self):
+        result = self.run_taxcalc("-p", "150", "-y", "2015")
+        expected = CarEcoTax(2015, 150).calculate()
+        self.assertEqual((result.returncode, result.stdout),
+                         (0, f"{expected}\n"))
+        result = self.run_taxcalc("-y", "2015", "-p", "0")
+        self.assertEqual((result.returncode, result.stdout),
+                         (1, "Horse powers should be integer and greater "
+                             "then 0\n"))
+
+    def test_bulk_not_utf8_input(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cars.csv")
+            rejects_path = os.path.join(directory, "rejects.jsonl")
+            with open(path, "wb") as cars:
+                cars.write(b"prod_year,horsepowers\n2015,1\xff0\n"
+                           + b"1" * 200000 + b",1\n2015,100\n")
+            result = self.run_taxcalc("--input", path, "--rejects",
+                                      rejects_path, "--as-of", "2020")
+            with open(rejects_path, encoding="utf-8") as rejects:
+                errors = [json.loads(line)["error"] for line in rejects]
+        self.assertEqual((result.returncode, result.stdout),
+                         (0, "prod_year,horsepowers,tax\n2015,100,1050\n"))
+        self.assertEqual(errors[0], "Record is not valid UTF-8")
+        self.assertTrue(errors[1].startswith("Malformed CSV: "))
+
+    def test_serve_lines(self):
+        answers = list(serve_lines(["2015 100\n", "2015,100\n", "\n",
+                                    "2015 100 1\n", "2021 100\n",
+                                    "15 0\n"], as_of=2020))
+        self.assertEqual(answers, [
+            "1050\n", "1050\n",
+            "error: expected production year and horse powers, got ''\n",
+            "error: expected production year and horse powers, "
+            "got '2015 100 1'\n",
+            "error: Production year could not be greater than current\n",
+            "error: Horse powers should be integer and greater then 0\n"])
+
+    def test_serve(self):
+        result = self.run_taxcalc("--serve", "--as-of", "2020",
+                                  input="2015 100\n2010 301\n")
+        self.assertEqual((result.returncode, result.stdout),
+                         (0, "1050\n15050\n"))
+
+
 if __name__ == '__main__':
     unittest.main()
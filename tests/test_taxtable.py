@@ -0,0 +1,67 @@
+import unittest
+import os
+import sys
+import tempfile
+sys.path.append('..')
+from taxcalc import CarEcoTaxHorsePowerError
+from taxcalc import CarEcoTaxProdYearError
+from taxcalc import SCHEDULES
+from taxcalc import calculate_tax
+from taxtable import TaxTable
+from taxtable import export_table
+
+
+class TaxTableTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "taxes.bin")
+        export_table(self.path, 2019, 2021, 400)
+        self.table = TaxTable(self.path)
+        self.addCleanup(self.table.close)
+
+    def test_lookup_matches_calculate_tax(self):
+        for tax_year in range(2019, 2022):
+            for production_year in range(2005, tax_year + 1):
+                for hp in range(1, 401):
+                    self.assertEqual(
+                        self.table.lookup(production_year, hp, tax_year),
+                        calculate_tax(production_year, hp, tax_year).amount,
+                        f"{production_year} year, {hp} hp, {tax_year}")
+
+    def test_two_digit_production_year(self):
+        self.assertEqual(self.table.lookup(15, 100, 2020), 1050)
+
+    def test_out_of_table(self):
+        self.assertIsNone(self.table.lookup(2015, 401, 2020))
+        self.assertIsNone(self.table.lookup(2015, 100, 2022))
+        self.assertIsNone(self.table.lookup(2015, 100, 2018))
+
+    def test_invalid_car(self):
+        with self.assertRaises(CarEcoTaxProdYearError):
+            self.table.lookup(2021, 100, 2020)
+        with self.assertRaises(CarEcoTaxHorsePowerError):
+            self.table.lookup(2015, 0, 2020)
+
+    def test_header(self):
+        self.assertEqual(self.table.header["schedule"],
+                         SCHEDULES.check().data)
+        self.assertEqual(self.table.header["max_hp"], 400)
+        self.assertEqual(os.path.getsize(self.path) % 8, 0)
+
+    def test_wrong_file(self):
+        with open(self.path, "r+b") as table_file:
+            table_file.write(b"XXXX")
+        with self.assertRaises(ValueError):
+            TaxTable(self.path)
+
+    def test_truncated_file(self):
+        with open(self.path, "r+b") as table_file:
+            table_file.truncate(os.path.getsize(self.path) - 8)
+        with self.assertRaises(ValueError):
+            TaxTable(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+sys.path.append('..')
+from chatstore import SQLiteStorage
+from fake_telegram import message_update
+from outbound import OutboundMessage
+from taxcalc import CarEcoTax
+from telegram_bot import ACTIVE_SESSIONS
+from telegram_bot import TelegramBot
+
+
+class MutableClock:
+
+    def __init__(self, year):
+        self.current_year = year
+
+    def year(self):
+        return self.current_year
+
+
+class ProdYearKeyboardTest(unittest.TestCase):
+
+    def test_keyboard_rebuilt_when_year_changes(self):
+        bot = TelegramBot("test")
+        bot.clock = MutableClock(2025)
+        self.assertEqual(bot.prod_year_keyboard[0], ["2025"])
+        self.assertEqual(bot.prod_year_keyboard[-1], ["մինչև 2018"])
+        keyboard = bot.prod_year_keyboard
+        self.assertIs(bot.prod_year_keyboard, keyboard)
+        bot.clock.current_year = 2026
+        self.assertEqual(bot.prod_year_keyboard[0], ["2026"])
+        self.assertEqual(len(bot.prod_year_keyboard), 9)
+
+
+class ReplayBot(TelegramBot):
+    """TelegramBot collecting replies and counting parsed messages"""
+    parsed = 0
+
+    def __init__(self, storage=None):
+        super().__init__("test", storage=storage)
+        self.replies = []
+
+    def submit_message(self, chat_id, payload, created_at):
+        self.replies.append(payload)
+
+    def parse_number(self, message):
+        self.parsed += 1
+        return super().parse_number(message)
+
+
+class ReplayTest(unittest.TestCase):
+    year = str(datetime.datetime.today().year - 5)
+
+    def replay(self, batches):
+        """Feed recorded update batches, return replies by chat id"""
+        bot = ReplayBot()
+        update_id = 1
+        for batch in batches:
+            bot.updates = []
+            for chat_id, text in batch:
+                bot.updates.append(message_update(update_id, chat_id, text))
+                update_id += 1
+            bot.process_updates()
+        self.assertEqual(bot.parsed, update_id - 1)
+        replies = {}
+        for reply in bot.replies:
+            replies.setdefault(reply["chat_id"], []).append(reply["text"])
+        self.bot = bot
+        return replies
+
+    def test_messages_of_one_batch_are_not_lost(self):
+        conversation = [(1, "/start"), (1, self.year), (1, "150")]
+        tax = CarEcoTax(int(self.year), 150).calculate()
+        for batches in ([conversation], [[message] for message
+                                         in conversation]):
+            texts = self.replay(batches)[1]
+            self.assertEqual(len(texts), 3)
+            self.assertTrue(texts[-1].endswith(f" {tax} ֏"), texts)
+            # Finished conversation is removed at once
+            self.assertEqual(len(self.bot.sessions), 0)
+
+    def test_interleaved_chats(self):
+        batch = [(chat_id, text)
+                 for text in ("/start", self.year, "150", self.year, "90")
+                 for chat_id in (1, 2, 3)]
+        replies = self.replay([batch])
+        tax = CarEcoTax(int(self.year), 150).calculate()
+        # Messages after finished conversation start new one
+        next_tax = CarEcoTax(int(self.year), 90).calculate()
+        for chat_id in (1, 2, 3):
+            texts = replies[chat_id]
+            self.assertEqual(len(texts), 5)
+            self.assertTrue(texts[2].endswith(f" {tax} ֏"), texts)
+            self.assertTrue(texts[4].endswith(f" {next_tax} ֏"), texts)
+        self.assertEqual(len(self.bot.sessions), 0)
+
+    def test_wrong_input_is_asked_again(self):
+        future_year = str(datetime.datetime.today().year + 2)
+        replies = self.replay([[(1, "/start"), (1, "hello"),
+                                (1, future_year), (1, "abc"), (1, "150")],
+                               [(1, self.year)]])
+        texts = replies[1]
+        self.assertEqual(texts[0], texts[1])
+        self.assertIn(future_year, texts[4])
+        tax = CarEcoTax(int(self.year), 150).calculate()
+        self.assertTrue(texts[-1].endswith(f" {tax} ֏"), texts)
+
+    def test_other_updates_are_skipped(self):
+        bot = ReplayBot()
+        bot.updates = [{"update_id": 1, "edited_message": {}},
+                       {"update_id": 2, "message": {"message_id": 2,
+                                                    "chat": {"id": 1},
+                                                    "sticker": {}}}]
+        bot.process_updates()
+        self.assertEqual(bot.replies, [])
+        self.assertEqual(len(bot.sessions), 0)
+
+    def test_restored_chat_is_replied(self):
+        bot = ReplayBot()
+        bot.sessions.add_message(1, 1, "/start")
+        bot.process_updates()
+        self.assertEqual(len(bot.replies), 1)
+        self.assertFalse(bot.sessions.has_ready())
+
+
+class RestartTest(unittest.TestCase):
+
+    def test_not_sent_replies_are_resent(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bot.db")
+            bot = ReplayBot(SQLiteStorage(path))
+            bot.updates = [message_update(1, 1, "/start"),
+                           message_update(2, 2, "/start")]
+            bot.process_updates()
+            # Only reply to chat 1 was sent before crash
+            bot.reply_sent(OutboundMessage(1, bot.replies[0], 0))
+            bot.process_updates()
+            bot.sessions.close()
+
+            restarted = ReplayBot(SQLiteStorage(path))
+            restarted.process_updates()
+            self.assertEqual(restarted.replies, bot.replies[1:])
+            restarted.reply_sent(OutboundMessage(2, restarted.replies[0], 0))
+            restarted.process_updates()
+            restarted.sessions.close()
+            storage = SQLiteStorage(path)
+            self.assertEqual(storage.load_outbound(), [])
+            storage.close()
+
+
+class GaugesTest(unittest.TestCase):
+
+    def test_gauges_bound_to_served_bot(self):
+        served = TelegramBot("test")
+        served.bind_gauges()
+        served.sessions.add_message(1, 1, "/start")
+        gauge = ACTIVE_SESSIONS.labels()
+        self.assertEqual(gauge.function(), 1)
+        # Other bots of the process, e.g. of tests, don't replace it
+        TelegramBot("test")
+        self.assertEqual(gauge.function(), 1)
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_requests_imported_on_first_api_call(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = "import sys, telegram_bot; " \
+               "print('requests' in sys.modules, " \
+               "'http.server' in sys.modules)"
+        output = subprocess.run([sys.executable, "-c", code], cwd=root,
+                                capture_output=True, text=True,
+                                check=True).stdout
+        self.assertEqual(output, "False False\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import asyncio
+import datetime
+import json
+import sys
+sys.path.append('..')
+from asynchttp import ConnectionPool
+from fake_telegram import stubbed_bot
+from taxcalc import CarEcoTax
+from telegram_webhook import SECRET_TOKEN_HEADER
+from telegram_webhook import WebhookServer
+from webhook_replay import conversation_updates
+from webhook_replay import replay
+
+
+class WebhookServerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.bot = stubbed_bot()
+        self.webhook = WebhookServer(self.bot, "secret", max_queue=2,
+                                     enqueue_timeout=0.01, idle_timeout=0.01)
+        self.server = await self.webhook.start()
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        self.client = ConnectionPool(self.url, size=1)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def post(self, update, secret="secret", path="/webhook"):
+        body = update if isinstance(update, bytes) \
+            else json.dumps(update).encode("utf-8")
+        return await self.client.request("POST", path, body,
+                                         {SECRET_TOKEN_HEADER: secret})
+
+    async def test_rejected_requests(self):
+        update = conversation_updates(1)[0]
+        self.assertEqual((await self.post(update, "wrong")).status, 401)
+        self.assertEqual((await self.post(update, path="/other")).status,
+                         404)
+        response = await self.client.request("GET", "/webhook")
+        self.assertEqual(response.status, 405)
+        self.assertEqual(response.headers["allow"], "POST")
+        self.assertEqual((await self.post(b"{")).status, 400)
+        self.assertEqual((await self.post([update])).status, 400)
+        self.assertIsNone(self.webhook.queue)
+
+    async def test_skipped_updates(self):
+        update = conversation_updates(1)[0]
+        sticker = {"update_id": 5, "message": {"message_id": 5,
+                                               "chat": {"id": 1},
+                                               "sticker": {}}}
+        for skipped in (update, sticker):
+            self.assertEqual((await self.post(skipped)).status, 200)
+        self.assertEqual(self.webhook.queue.qsize(), 1)
+
+    async def test_string_update_id(self):
+        update = conversation_updates(1, first_update_id=5)[0]
+        update["update_id"] = "5"
+        self.assertEqual((await self.post(update)).status, 200)
+        self.webhook.process_batch(await self.webhook.next_batch())
+        self.assertEqual(self.bot.offset, 6)
+        self.assertEqual(len(self.bot.replies), 1)
+
+    async def test_backpressure(self):
+        statuses = [(await self.post(update)).status
+                    for update in conversation_updates(1)]
+        self.assertEqual(statuses, [200, 200, 429])
+        # Rejected update is accepted when Telegram sends it again
+        self.webhook.process_batch(await self.webhook.next_batch())
+        self.assertEqual(
+            (await self.post(conversation_updates(1)[2])).status, 200)
+
+    async def test_replay_conversations(self):
+        self.webhook.max_queue = 1000
+        processing = asyncio.ensure_future(self.webhook.process_forever())
+        results = await replay(f"{self.url}/webhook", conversation_updates(5),
+                               rate=500, secret_token="secret")
+        for _ in range(100):
+            if len(self.bot.replies) == 15:
+                break
+            await asyncio.sleep(0.01)
+        processing.cancel()
+        self.assertEqual(results["statuses"], {"200": 15})
+        self.assertEqual(self.bot.offset, 16)
+        year = datetime.datetime.today().year - 5
+        tax = CarEcoTax(year, 150).calculate()
+        self.assertEqual(len(self.bot.replies), 15)
+        for chat_id in range(1, 6):
+            texts = [reply["text"] for reply in self.bot.replies
+                     if reply["chat_id"] == chat_id]
+            self.assertEqual(len(texts), 3)
+            self.assertTrue(texts[-1].endswith(f" {tax} ֏"), texts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import datetime
+import os
+import queue
+import subprocess
+import sys
+import threading
+sys.path.append('..')
+from fake_telegram import message_update
+from taxcalc import CarEcoTax
+from telegram_bot import TelegramBot
+from telegram_workers import drain_queue
+from telegram_workers import partition
+from telegram_workers import run_ingest
+from telegram_workers import run_worker
+
+
+class PartitionTest(unittest.TestCase):
+
+    def test_chat_goes_to_one_worker(self):
+        for chat_id in (1, 2, 12345, -100123456789):
+            worker = partition(chat_id, 4)
+            self.assertIn(worker, range(4))
+            self.assertEqual(partition(chat_id, 4), worker)
+
+    def test_drain_queue(self):
+        updates_queue = queue.Queue()
+        self.assertEqual(drain_queue(updates_queue, 0), [])
+        for update_id in range(5):
+            updates_queue.put(update_id)
+        self.assertEqual(drain_queue(updates_queue, 0, max_updates=3),
+                         [0, 1, 2])
+        self.assertEqual(drain_queue(updates_queue, 0.01), [3, 4])
+
+
+class RunIngestTest(unittest.TestCase):
+
+    def test_not_message_updates_are_skipped(self):
+        bot = TelegramBot("test")
+        stop = threading.Event()
+        edited = {"update_id": 1,
+                  "edited_message": {"message_id": 1, "chat": {"id": 1},
+                                     "text": "/start"}}
+        responses = [[edited, message_update(2, 1, "/start")]]
+
+        def request(url, payload):
+            if not responses:
+                stop.set()
+                return []
+            return responses.pop(0)
+
+        bot.api_request = request
+        queues = [queue.Queue()]
+        run_ingest(bot, queues, stop)
+        self.assertEqual(bot.offset, 3)
+        self.assertEqual(drain_queue(queues[0], 0),
+                         [message_update(2, 1, "/start")])
+
+
+class RunWorkerTest(unittest.TestCase):
+
+    def test_worker_replies_from_stand_in_queue(self):
+        bot = TelegramBot("test")
+        replies = []
+
+        def request(url, payload):
+            replies.append(payload)
+            if len(replies) == 6:
+                stop.set()
+            return {"message_id": len(replies)}
+
+        bot.api_request = request
+        stop = threading.Event()
+        updates_queue = queue.Queue()
+        year = str(datetime.datetime.today().year - 3)
+        for update_id, (chat_id, text) in enumerate(
+                [(1, "/start"), (2, "/start")]):
+            updates_queue.put(message_update(update_id, chat_id, text))
+        worker = threading.Thread(target=run_worker,
+                                  args=(bot, updates_queue, stop, 0.01))
+        worker.start()
+        # Next message is sent after reply, as users do
+        sent = 2
+        for text in (year, "100"):
+            while len(replies) < sent:
+                stop.wait(0.01)
+            for chat_id in (1, 2):
+                updates_queue.put(message_update(sent, chat_id, text))
+                sent += 1
+        tax = CarEcoTax(int(year), 100).calculate()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(len(replies), 6)
+        for chat_id in (1, 2):
+            texts = [reply["text"] for reply in replies
+                     if reply["chat_id"] == chat_id]
+            self.assertEqual(len(texts), 3)
+            self.assertTrue(texts[-1].endswith(f" {tax} ֏"), texts)
+
+
+class CommandLineTest(unittest.TestCase):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def test_send_rate_should_be_positive(self):
+        result = subprocess.run(
+            [sys.executable, "telegram_workers.py", "--send-rate", "0"],
+            cwd=self.root, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("--send-rate should be greater then 0", result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
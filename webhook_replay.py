@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import statistics
+import time
+from urllib.parse import urlsplit
+from asynchttp import ConnectionPool
+from fake_telegram import FakeTelegramApi
+from telegram_bot import TelegramBot
+from telegram_webhook import SECRET_TOKEN_HEADER
+from telegram_webhook import WebhookServer
+
+
+def load_updates(path: str) -> list:
+    """
+    Return updates recorded in file: JSON lines of updates, JSON array of
+    them or getUpdates response
+    """
+    with open(path, encoding="utf-8") as updates_file:
+        text = updates_file.read()
+    if text.lstrip().startswith(("[", '{"ok"')):
+        data = json.loads(text)
+        return data["result"] if isinstance(data, dict) else data
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def conversation_updates(chats: int, first_update_id: int = 1) -> list:
+    """
+    Updates of chats going through the whole conversation, messages of
+    all chats are interleaved
+    """
+    script = ["/start", str(datetime.datetime.today().year - 5), "150"]
+    updates = []
+    for text in script:
+        for chat_id in range(1, chats + 1):
+            update_id = first_update_id + len(updates)
+            updates.append({"update_id": update_id,
+                            "message": {"message_id": update_id,
+                                        "date": int(time.time()),
+                                        "chat": {"id": chat_id,
+                                                 "type": "private"},
+                                        "text": text}})
+    return updates
+
+
+async def replay(url: str, updates: list, rate: float = None,
+                 secret_token: str = None, connections: int = 8,
+                 timeout: float = 30) -> dict:
+    """
+    POST updates to webhook url at rate updates per second, None means as
+    fast as connections allow. 429 responses are retried after Retry-After
+    as Telegram does. Returns response statuses and latency
+    """
+    client = ConnectionPool(url, size=connections)
+    path = urlsplit(url).path or "/"
+    headers = {"Content-Type": "application/json"}
+    if secret_token:
+        headers[SECRET_TOKEN_HEADER] = secret_token
+    statuses = {}
+    latencies = []
+
+    async def post(update):
+        body = json.dumps(update).encode("utf-8")
+        while True:
+            sent_at = time.perf_counter()
+            response = await client.request("POST", path, body, headers,
+                                            timeout)
+            latencies.append(time.perf_counter() - sent_at)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            if response.status != 429:
+                return
+            await asyncio.sleep(float(response.headers.get("retry-after",
+                                                           1)))
+
+    started = time.perf_counter()
+    posts = []
+    try:
+        for index, update in enumerate(updates):
+            if rate:
+                delay = started + index / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            posts.append(asyncio.ensure_future(post(update)))
+        await asyncio.gather(*posts)
+    finally:
+        await client.close()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "updates": len(updates),
+        "statuses": {str(status): count
+                     for status, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(updates) / elapsed, 1),
+        "latency_p50": round(statistics.median(latencies), 6)
+        if latencies else None,
+        "latency_p99": round(latencies[int(len(latencies) * 0.99) - 1], 6)
+        if latencies else None
+    }
+
+
+async def replay_offline(updates: list, rate: float = None,
+                         connections: int = 8, max_queue: int = 1000,
+                         timeout: float = 30) -> dict:
+    """
+    Replay updates to webhook bot replying to fake Telegram API, return
+    replay stats and number of replies
+    """
+    token = "replay"
+    api = FakeTelegramApi(token)
+    api_server = await api.start()
+    api_url = f"http://127.0.0.1:{api_server.sockets[0].getsockname()[1]}"
+    bot = TelegramBot(token, api_url)
+    # Fake API has no rate limits
+    bot.send_rate = bot.chat_send_rate = None
+    secret_token = "replay-secret"
+    webhook = WebhookServer(bot, secret_token, max_queue=max_queue,
+                            idle_timeout=0.1)
+    webhook_server = await webhook.start()
+    port = webhook_server.sockets[0].getsockname()[1]
+    processing = asyncio.ensure_future(webhook.process_forever())
+    try:
+        results = await replay(f"http://127.0.0.1:{port}/webhook", updates,
+                               rate, secret_token, connections, timeout)
+        # Replies are sent by bot sender threads, wait till they stop
+        deadline = time.monotonic() + timeout
+        replies = -1
+        while replies != len(api.sent_messages) and \
+                time.monotonic() < deadline:
+            replies = len(api.sent_messages)
+            await asyncio.sleep(0.5)
+    finally:
+        processing.cancel()
+        webhook_server.close()
+        api_server.close()
+    results["replies"] = len(api.sent_messages)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded Telegram updates to webhook bot")
+    parser.add_argument("--url",
+                        help="webhook url, bot with fake Telegram API is "
+                             "started in process without it")
+    parser.add_argument("--file",
+                        help="recorded updates: JSON lines, JSON array or "
+                             "getUpdates response")
+    parser.add_argument("--chats",
+                        type=int,
+                        default=100,
+                        help="number of generated conversations without "
+                             "--file")
+    parser.add_argument("--rate",
+                        type=float,
+                        help="updates per second, as fast as possible by "
+                             "default")
+    parser.add_argument("--connections",
+                        type=int,
+                        default=8,
+                        help="concurrent webhook connections")
+    parser.add_argument("--secret-token",
+                        help="X-Telegram-Bot-Api-Secret-Token of --url")
+    parser.add_argument("--max-queue",
+                        type=int,
+                        default=1000,
+                        help="webhook queue size of in process bot")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    updates = load_updates(args.file) if args.file \
+        else conversation_updates(args.chats)
+    if args.url:
+        results = asyncio.run(replay(args.url, updates, args.rate,
+                                     args.secret_token, args.connections))
+    else:
+        results = asyncio.run(replay_offline(updates, args.rate,
+                                             args.connections,
+                                             args.max_queue))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()